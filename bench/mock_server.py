@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Mock_Server class from package bench
+
+This module provides a local stand-in for the ESAC services, to run the
+benchmarks (and to try the clients) without the live TAP+ and VOSpace
+servers.  It implements, with the Python standard library only:
+
+ - the TAP asynchronous endpoint (``/tap/async``): the jobs go through the
+   QUEUED and EXECUTING phases during configurable times, and then produce
+   a CSV result of fixed-width rows (as many as requested with ``TOP n`` in
+   the query, or a default number), streamed from ``/results/result``;
+ - the VOSpace transfers (``/vospace/servlet/transfers/async``) and data
+   (``/vospace/service/data/<user>/<jobId>``) endpoints: the files uploaded
+   are stored in a temporary folder, and are served back (with support for
+   ``Range`` requests) when pulled, or as a ZIP file for entire folders;
+ - the VOSpace nodes endpoint (``/vospace/nodes/<user>/<folder>``), for
+   the listing of the folders.
+
+Both kinds of jobs follow UWS 1.1, including the blocking WAIT parameter,
+and a latency can be added to every response.
+
+Usage:
+    Use the server from Python code::
+
+        with Mock_Server(queue_time=0.5, exec_time=1.0) as server:
+            qry = EAS_Query(tap_url=server.tap_url)
+            vos = VOSpace_Handler(vospace_url=server.vospace_url)
+            ...
+
+    or run it standalone, from the top folder of the repository::
+
+        $ python -m bench.mock_server --port 8080 --queue-time 1 --exec-time 2
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+from time import sleep, monotonic
+from urllib.parse import urlsplit, parse_qs
+from itertools import count
+from datetime import datetime, timezone
+from email.utils import formatdate
+
+import argparse, os, re, shutil, tempfile, zipfile, zlib
+
+
+Job_Document = """<?xml version="1.0" encoding="UTF-8"?>
+<uws:job xmlns:uws="http://www.ivoa.net/xml/UWS/v1.0"
+         xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1">
+  <uws:jobId>{job_id}</uws:jobId>
+  <uws:phase>{phase}</uws:phase>{error}
+  <uws:results>{results}</uws:results>
+</uws:job>
+"""
+
+Error_Summary = """
+  <uws:errorSummary type="fatal" hasDetail="false">
+    <uws:message>{}</uws:message>
+  </uws:errorSummary>"""
+
+Container_Node = """<?xml version="1.0" encoding="UTF-8"?>
+<vos:node xmlns:vos="http://www.ivoa.net/xml/VOSpace/v2.0"
+          xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+          uri="vos://esavo!vospace/{path}" xsi:type="vos:ContainerNode">
+  <vos:nodes>{nodes}
+  </vos:nodes>
+</vos:node>
+"""
+
+Child_Node = """
+    <vos:node uri="vos://esavo!vospace/{path}" xsi:type="vos:{type}">
+      <vos:properties>
+        <vos:property uri="ivo://ivoa.net/vospace/core#length">{length}</vos:property>
+        <vos:property uri="ivo://ivoa.net/vospace/core#date">{date}</vos:property>
+      </vos:properties>
+    </vos:node>"""
+
+Result_Link = """
+    <uws:result id="result" xlink:type="simple" xlink:href="{}"/>"""
+
+CSV_Header = b"source_id,ra,dec,flux_g,flux_r,flag\n"
+
+
+def csv_row(i):
+    """Returns the i-th row of the CSV results (all rows have the same size)."""
+    return "{:010d},{:11.6f},{:+11.6f},{:10.4f},{:10.4f},{}\n".format(
+        i, (i * 0.0137) % 360.0, ((i * 0.0071) % 180.0) - 90.0,
+        (i % 9973) * 0.01, (i % 7919) * 0.01, i % 2).encode("ASCII")
+
+
+CSV_Row_Size = len(csv_row(0))
+
+
+def csv_size(rows):
+    """Returns the size in bytes of the CSV results with the given rows."""
+    return len(CSV_Header) + rows * CSV_Row_Size
+
+
+def csv_rows_for_size(size):
+    """Returns the number of rows of the CSV results of about size bytes."""
+    return max(1, (size - len(CSV_Header)) // CSV_Row_Size)
+
+
+def iter_csv(rows, rows_per_block=8192):
+    """Yields the CSV results with the given rows, in blocks of rows.  The
+    rows of a block are repeated (but for the source_id) in the next ones,
+    so that very large results are produced quickly."""
+    block = b''.join(csv_row(i) for i in range(min(rows, rows_per_block)))
+    yield CSV_Header
+    for first in range(0, rows, rows_per_block):
+        n = min(rows_per_block, rows - first)
+        yield block[:n * CSV_Row_Size]
+
+
+class Mock_Job(object):
+    """
+    UWS job of the mock server, whose phase depends on the time elapsed
+    """
+
+    def __init__(self, job_id, phases, error=None, **attrs):
+        """Initialize object (class instance) attributes.  The job goes
+        through the phases (list of (phase, duration) pairs) since its
+        creation, and then to COMPLETED (or ERROR, if an error message is
+        provided)."""
+        self.job_id = job_id
+        self.phases = phases
+        self.error = error
+        self.created = monotonic()
+        self.__dict__.update(attrs)
+
+    def phase(self):
+        """Returns the current phase, and the seconds until it changes (or
+        None for final phases)."""
+        elapsed = monotonic() - self.created
+        for phase, duration in self.phases:
+            if elapsed < duration:
+                return phase, duration - elapsed
+            elapsed -= duration
+        return ('ERROR' if self.error else 'COMPLETED'), None
+
+
+class Mock_Request_Handler(BaseHTTPRequestHandler):
+    """
+    HTTP requests handler of the mock server
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately: avoid delayed ACK stalls
+    disable_nagle_algorithm = True
+    Chunk_Size = 1024 * 1024
+
+    def send_error(self, code, message=None, explain=None):
+        # The body of the request may not have been read
+        self.close_connection = True
+        BaseHTTPRequestHandler.send_error(self, code, message, explain)
+
+    def log_message(self, format, *args):
+        if self.server.mock.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    # Dispatching
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        mock = self.server.mock
+        url = urlsplit(self.path)
+        self.params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [p for p in url.path.split('/') if p]
+        if mock.latency > 0:
+            sleep(mock.latency)
+        try:
+            if parts[:2] == ['tap', 'async']:
+                self.tap(method, parts[2:])
+            elif parts[:4] == ['vospace', 'servlet', 'transfers', 'async']:
+                self.transfers(method, parts[4:])
+            elif parts[:2] == ['vospace', 'nodes'] and len(parts) > 2:
+                self.nodes(method, parts[2:])
+            elif parts[:3] == ['vospace', 'service', 'data'] and len(parts) == 5:
+                self.data(method, parts[3], parts[4])
+            else:
+                self.send_error(404)
+        except BrokenPipeError:
+            pass
+
+    # TAP endpoint
+
+    def tap(self, method, parts):
+        mock = self.server.mock
+        if method == 'POST' and not parts:
+            params = {k: v[-1] for k, v in parse_qs(self.read_body().decode("UTF-8")).items()}
+            params.update(self.params)
+            query = params.get('QUERY', '')
+            top = re.search(r'\bTOP\s+(\d+)', query, re.IGNORECASE)
+            error = None
+            if params.get('FORMAT', 'csv') != 'csv':
+                error = "Output format {} not supported by the mock server".format(params['FORMAT'])
+            job = mock.new_job('q', [('QUEUED', mock.queue_time), ('EXECUTING', mock.exec_time)],
+                               error, rows=int(top.group(1)) if top else mock.default_rows)
+            self.redirect('/tap/async/' + job.job_id)
+        elif method in ('GET', 'DELETE') and len(parts) >= 1:
+            job = mock.jobs.get(parts[0])
+            if job is None:
+                self.send_error(404)
+            elif method == 'DELETE':
+                mock.remove_job(job.job_id)
+                self.send_text(b'')
+            elif len(parts) == 1:
+                self.send_job(job, '/tap/async/{}/results/result'.format(job.job_id))
+            elif parts[1:] == ['results', 'result'] and job.phase()[0] == 'COMPLETED':
+                if mock.gzip_results and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    self.send_gzip(iter_csv(job.rows), 'text/csv')
+                else:
+                    self.send_chunks(iter_csv(job.rows), csv_size(job.rows), 'text/csv')
+            else:
+                self.send_error(404)
+        else:
+            self.send_error(405)
+
+    # VOSpace endpoints
+
+    def transfers(self, method, parts):
+        mock = self.server.mock
+        if not self.authorized():
+            return
+        if method == 'POST' and not parts:
+            tx = self.read_body().decode("UTF-8", "replace")
+            target = re.search(r'<vos:target>\s*vos://[^/]*/([^<]*?)\s*</vos:target>', tx)
+            direction = re.search(r'<vos:direction>\s*(\w+)\s*</vos:direction>', tx)
+            if target is None or direction is None:
+                self.send_error(400, "Invalid transfer document")
+                return
+            job = mock.new_job('t', [('EXECUTING', mock.transfer_time)],
+                               target=target.group(1).strip('/'), direction=direction.group(1))
+            self.redirect('/vospace/servlet/transfers/async/' + job.job_id)
+        elif method in ('GET', 'DELETE') and len(parts) == 1:
+            job = mock.jobs.get(parts[0])
+            if job is None:
+                self.send_error(404)
+            elif method == 'DELETE':
+                mock.remove_job(job.job_id)
+                self.send_text(b'')
+            else:
+                self.send_job(job)
+        else:
+            self.send_error(405)
+
+    def data(self, method, user, job_id):
+        mock = self.server.mock
+        if not self.authorized():
+            return
+        job = mock.jobs.get(job_id)
+        if job is None or job.phase()[0] != 'COMPLETED':
+            self.send_error(404)
+        elif method == 'POST' and job.direction == 'pushToVoSpace':
+            self.receive_file(job)
+        elif method == 'GET' and job.direction == 'pullFromVoSpace':
+            self.send_node(job.target)
+        else:
+            self.send_error(405)
+
+    def nodes(self, method, parts):
+        """Sends the description of a container node, with its children."""
+        if not self.authorized():
+            return
+        path = self.server.mock.node_path(*parts)
+        if method != 'GET':
+            self.send_error(405)
+        elif not os.path.isdir(path):
+            self.send_error(404)
+        else:
+            nodes = []
+            for name in sorted(os.listdir(path)):
+                child = os.path.join(path, name)
+                if name.endswith('.upload'): continue
+                stat = os.stat(child)
+                date = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+                nodes.append(Child_Node.format(
+                    path='/'.join(parts + [name]),
+                    type='ContainerNode' if os.path.isdir(child) else 'DataNode',
+                    length=0 if os.path.isdir(child) else stat.st_size,
+                    date=date.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'))
+            self.send_text(Container_Node.format(path='/'.join(parts), nodes=''.join(nodes))
+                           .encode("UTF-8"), 'text/xml')
+
+    def authorized(self):
+        if self.headers.get('Authorization') is None:
+            self.read_body()
+            self.send_response(401)
+            self.send_header('WWW-Authenticate', 'Basic realm="vospace"')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return False
+        return True
+
+    def receive_file(self, job):
+        """Stores the file of a multipart/form-data upload, as it arrives."""
+        boundary = re.search(r'boundary="?([^";]+)"?', self.headers.get('Content-Type', ''))
+        if boundary is None:
+            self.send_error(400, "Missing multipart boundary")
+            return
+        delimiter = b'\r\n--' + boundary.group(1).encode("ASCII")
+        chunks = self.iter_body()
+        head = b''
+        for chunk in chunks:
+            head += chunk
+            if b'\r\n\r\n' in head: break
+        headers, _, data = head.partition(b'\r\n\r\n')
+        name = re.search(rb'filename="([^"]*)"', headers)
+        if name is None:
+            for chunk in chunks: pass
+            self.send_error(400, "Missing file in upload")
+            return
+        path = self.server.mock.node_path(job.target, name.group(1).decode("UTF-8"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        keep = len(delimiter) + 4
+        with open(path + '.upload', 'wb') as out:
+            for chunk in chunks:
+                if len(data) > keep:
+                    out.write(data[:-keep])
+                    data = data[-keep:]
+                data += chunk
+            end = data.find(delimiter)
+            out.write(data[:end] if end >= 0 else data)
+        os.replace(path + '.upload', path)
+        self.send_text(b'Upload completed')
+
+    def send_node(self, target):
+        """Sends a stored file, or a ZIP file with the content of a folder."""
+        path = self.server.mock.node_path(target)
+        if os.path.isdir(path):
+            with tempfile.TemporaryFile() as zip_file:
+                with zipfile.ZipFile(zip_file, 'w') as archive:
+                    for folder, _, files in os.walk(path):
+                        for name in files:
+                            archive.write(os.path.join(folder, name),
+                                          os.path.relpath(os.path.join(folder, name), path))
+                self.send_file(zip_file, 'application/zip')
+        elif os.path.isfile(path):
+            with open(path, 'rb') as node_file:
+                self.send_file(node_file, 'application/octet-stream')
+        else:
+            self.send_error(404)
+
+    # Requests and responses
+
+    def iter_body(self):
+        """Yields the body of the request (plain or chunked), chunk by chunk."""
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    while self.rfile.readline().strip(): pass
+                    return
+                while size > 0:
+                    chunk = self.rfile.read(min(size, Mock_Request_Handler.Chunk_Size))
+                    size -= len(chunk)
+                    yield chunk
+                self.rfile.readline()
+        else:
+            size = int(self.headers.get('Content-Length', 0))
+            while size > 0:
+                chunk = self.rfile.read(min(size, Mock_Request_Handler.Chunk_Size))
+                if not chunk: return
+                size -= len(chunk)
+                yield chunk
+
+    def read_body(self):
+        return b''.join(self.iter_body())
+
+    def redirect(self, path):
+        self.send_response(303)
+        self.send_header('Location', path)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_text(self, data, content_type='text/plain'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_job(self, job, result_path=None):
+        """Sends the job document, blocking up to WAIT seconds (UWS 1.1)
+        while the job is in a non final phase."""
+        phase, remaining = job.phase()
+        wait = float(self.params.get('WAIT', 0))
+        if remaining is not None and wait > 0:
+            sleep(min(wait, remaining))
+            phase, remaining = job.phase()
+        error = Error_Summary.format(job.error) if phase == 'ERROR' else ''
+        results = Result_Link.format(result_path) if phase == 'COMPLETED' and result_path else ''
+        self.send_text(Job_Document.format(job_id=job.job_id, phase=phase, error=error,
+                                           results=results).encode("UTF-8"), 'text/xml')
+
+    def send_chunks(self, chunks, size, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(chunk)
+
+    def send_gzip(self, chunks, content_type):
+        """Sends the chunks compressed in gzip format, with chunked encoding."""
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        data = compressor.flush()
+        self.wfile.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(data), data))
+
+    def send_file(self, node_file, content_type):
+        """Sends a file, or the part of it requested with a Range header (if
+        the If-Range validator, if any, matches the file ETag or date)."""
+        size = node_file.seek(0, os.SEEK_END)
+        stat = os.fstat(node_file.fileno())
+        etag = '"{:x}-{:x}"'.format(stat.st_size, stat.st_mtime_ns)
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        start = 0
+        byte_range = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if byte_range and if_range in (None, etag, last_modified):
+            start = int(byte_range.group(1))
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, size - 1, size))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(size - start))
+        self.end_headers()
+        node_file.seek(start)
+        shutil.copyfileobj(node_file, self.wfile, Mock_Request_Handler.Chunk_Size)
+
+
+class Mock_Server(object):
+    """
+    Local stand-in for the TAP+ and VOSpace services
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, queue_time=0.0, exec_time=0.0,
+                 transfer_time=0.0, latency=0.0, default_rows=1000, storage=None,
+                 gzip_results=False, verbose=False):
+        """Initialize object (class instance) attributes.  The queries stay
+        queue_time seconds in the QUEUED phase and exec_time seconds in the
+        EXECUTING phase, the transfer jobs transfer_time seconds in the
+        EXECUTING phase, and every response is delayed latency seconds.  The
+        uploaded files are stored in the storage folder (a temporary folder,
+        removed by stop(), by default).  If gzip_results is True, the query
+        results are sent compressed to the clients that accept gzip.  Port 0
+        selects a free port."""
+        self.queue_time = queue_time
+        self.exec_time = exec_time
+        self.transfer_time = transfer_time
+        self.latency = latency
+        self.default_rows = default_rows
+        self.gzip_results = gzip_results
+        self.verbose = verbose
+        self.own_storage = storage is None
+        self.storage = storage if storage is not None else tempfile.mkdtemp(prefix='vospace_')
+
+        self.jobs = {}
+        self.jobs_lock = Lock()
+        self.job_ids = count(1)
+
+        self.httpd = ThreadingHTTPServer((host, port), Mock_Request_Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def tap_url(self):
+        return self.url + '/tap/async'
+
+    @property
+    def vospace_url(self):
+        return self.url + '/vospace'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Serves the requests in a background thread."""
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def serve_forever(self):
+        """Serves the requests in the current thread."""
+        self.httpd.serve_forever()
+
+    def stop(self):
+        """Stops the server, and removes the temporary storage folder."""
+        if self.thread is not None:
+            self.httpd.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.httpd.server_close()
+        if self.own_storage:
+            shutil.rmtree(self.storage, ignore_errors=True)
+
+    def new_job(self, kind, phases, error=None, **attrs):
+        """Creates a new job (kind is used as prefix of the job id)."""
+        with self.jobs_lock:
+            job = Mock_Job('{}{}'.format(kind, next(self.job_ids)), phases, error, **attrs)
+            self.jobs[job.job_id] = job
+        return job
+
+    def remove_job(self, job_id):
+        with self.jobs_lock:
+            self.jobs.pop(job_id, None)
+
+    def node_path(self, *names):
+        """Returns the local path of the VOSpace node user/folder(/file),
+        which must be within the storage folder."""
+        path = os.path.normpath(os.path.join(self.storage, *names))
+        if os.path.commonpath([path, self.storage]) != self.storage:
+            raise ValueError("Invalid VOSpace node: {}".format('/'.join(names)))
+        return path
+
+
+def main():
+    """Runs the mock server until interrupted"""
+    parser = argparse.ArgumentParser(description="Local stand-in for the TAP+ and VOSpace services")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--queue-time', type=float, default=0.0,
+                        help="seconds in the QUEUED phase for the queries")
+    parser.add_argument('--exec-time', type=float, default=0.0,
+                        help="seconds in the EXECUTING phase for the queries")
+    parser.add_argument('--transfer-time', type=float, default=0.0,
+                        help="seconds in the EXECUTING phase for the transfers")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to every response")
+    parser.add_argument('--rows', type=int, default=1000,
+                        help="rows of the results of queries without TOP")
+    parser.add_argument('--storage', default=None,
+                        help="folder for the uploaded files (temporary by default)")
+    parser.add_argument('--gzip', action='store_true',
+                        help="send the query results compressed, if accepted")
+    args = parser.parse_args()
+
+    server = Mock_Server(args.host, args.port, args.queue_time, args.exec_time,
+                         args.transfer_time, args.latency, args.rows, args.storage,
+                         gzip_results=args.gzip, verbose=True)
+    print("TAP:     {}".format(server.tap_url))
+    print("VOSpace: {}".format(server.vospace_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
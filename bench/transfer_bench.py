@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark of the EAS queries and VOSpace transfers
+
+This script measures the time, throughput and peak memory (RSS) of the
+main operations of the ``eas`` and ``vos`` packages, against the local
+stand-in services of ``bench.mock_server`` (so that the live ESAC services
+are not needed), for several payload sizes:
+
+ - ``eas_run``: ``EAS_Query.run()`` until the job is finished (latency)
+ - ``eas_results``: ``EAS_Query.results()`` of a finished job
+ - ``eas_fits``: ``EAS_Query.save_results_as_fits_table()`` (in memory)
+ - ``eas_fits_chunked``: the same, in chunked mode
+ - ``eas_fits_parallel``: the same, in parallel mode
+ - ``vos_save_file``: ``VOSpace_Handler.save_file()``
+ - ``vos_retrieve_file``: ``VOSpace_Handler.retrieve_file()``
+
+Each case is run in a separate process, so that its peak RSS is not
+affected by the other cases nor by the server.
+
+Usage:
+    From the top folder of the repository::
+
+        $ python -m bench.transfer_bench --sizes 1K,1M,100M,1G --repeat 3
+
+    Use ``--help`` to see the options (latencies of the mock server, cases
+    to run...).
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from time import monotonic
+from bench.mock_server import Mock_Server, csv_rows_for_size, csv_size
+from eas.eas_qry import EAS_Query
+from vos.vos_handler import VOSpace_Handler
+from uws.uws_job import UWS_Job_Waiter
+
+import argparse, json, os, resource, subprocess, sys, tempfile
+
+
+Units = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(text):
+    """Converts a size like 512, 64K, 10M or 1G to bytes."""
+    text = text.strip().upper().rstrip('B')
+    unit = text[-1:] if text[-1:] in Units else ''
+    return int(float(text[:len(text) - len(unit)]) * Units[unit])
+
+
+def format_size(size):
+    """Converts a size in bytes to a short text (e.g. 10M)."""
+    for unit in ('G', 'M', 'K'):
+        if size >= Units[unit] and size % Units[unit] == 0:
+            return '{}{}'.format(size // Units[unit], unit)
+    return str(size)
+
+
+def peak_rss():
+    """Returns the peak resident set size of the process, in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def payload_name(size):
+    return 'payload_{}.bin'.format(format_size(size))
+
+
+def write_payload(file_name, size, block_size=1024 * 1024):
+    """Creates a local file of size bytes of random data."""
+    block = os.urandom(min(size, block_size))
+    with open(file_name, 'wb') as out:
+        for pos in range(0, size, block_size):
+            out.write(block[:size - pos])
+
+
+# Benchmark cases (run in the child processes): each one returns the time
+# of the operation measured, and the number of bytes transferred
+
+def finished_query(args):
+    qry = EAS_Query(waiter=UWS_Job_Waiter(initial_delay=0.01), tap_url=args.tap_url)
+    qry.setQuery("SELECT TOP {} * FROM bench".format(csv_rows_for_size(args.size)))
+    qry.run()
+    qry.wait_finished()
+    return qry
+
+
+def case_eas_run(args):
+    start = monotonic()
+    finished_query(args)
+    return monotonic() - start, 0
+
+
+def case_eas_results(args):
+    qry = finished_query(args)
+    start = monotonic()
+    data = qry.results()
+    return monotonic() - start, len(data)
+
+
+def case_eas_fits(args, chunked=False, parallel=False):
+    qry = finished_query(args)
+    file_name = os.path.join(args.work_dir, 'results.fits')
+    start = monotonic()
+    qry.save_results_as_fits_table(file_name, chunked=chunked, parallel=parallel)
+    elapsed = monotonic() - start
+    os.unlink(file_name)
+    return elapsed, csv_size(csv_rows_for_size(args.size))
+
+
+def case_eas_fits_chunked(args):
+    return case_eas_fits(args, chunked=True)
+
+
+def case_eas_fits_parallel(args):
+    return case_eas_fits(args, parallel=True)
+
+
+def vospace_handler(args):
+    vos = VOSpace_Handler(waiter=UWS_Job_Waiter(initial_delay=0.01), vospace_url=args.vospace_url)
+    vos.set_auth('bench', 'bench')
+    return vos
+
+
+def case_vos_save_file(args):
+    vos = vospace_handler(args)
+    start = monotonic()
+    vos.save_file('bench', payload_name(args.size),
+                  os.path.join(args.work_dir, payload_name(args.size)))
+    return monotonic() - start, args.size
+
+
+def case_vos_retrieve_file(args):
+    vos = vospace_handler(args)
+    file_name = os.path.join(args.work_dir, 'retrieved.bin')
+    start = monotonic()
+    vos.retrieve_file('bench/' + payload_name(args.size), '', file_name)
+    elapsed = monotonic() - start
+    os.unlink(file_name)
+    return elapsed, args.size
+
+
+Cases = ('eas_run', 'eas_results', 'eas_fits', 'eas_fits_chunked', 'eas_fits_parallel',
+         'vos_save_file', 'vos_retrieve_file')
+
+
+def run_child(args):
+    """Runs a single case, and prints its measurements as JSON."""
+    rss_start = peak_rss()
+    seconds, size = globals()['case_' + args.case](args)
+    print(json.dumps({'seconds': seconds, 'bytes': size,
+                      'rss_start': rss_start, 'peak_rss': peak_rss()}))
+
+
+def run_case(args, server, case, size):
+    """Runs a case in a child process, and returns its measurements."""
+    command = [sys.executable, '-m', 'bench.transfer_bench', '--child', case,
+               '--size', str(size), '--tap-url', server.tap_url,
+               '--vospace-url', server.vospace_url, '--work-dir', args.work_dir]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(command, cwd=root, stdout=subprocess.PIPE, check=True,
+                            universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    """Runs the benchmark, and prints a table with the results"""
+    parser = argparse.ArgumentParser(description="Benchmark of the EAS queries and VOSpace transfers")
+    parser.add_argument('--sizes', default='1K,1M,32M',
+                        help="comma separated payload sizes (e.g. 1K,10M,1G)")
+    parser.add_argument('--cases', default=','.join(Cases),
+                        help="comma separated cases, among: " + ', '.join(Cases))
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="runs of each case (the best time is reported)")
+    parser.add_argument('--queue-time', type=float, default=0.0)
+    parser.add_argument('--exec-time', type=float, default=0.0)
+    parser.add_argument('--transfer-time', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added by the mock server to every response")
+    parser.add_argument('--gzip', action='store_true',
+                        help="the mock server sends the query results compressed")
+    parser.add_argument('--json', default=None, help="file to store the results as JSON")
+    # Options of the child processes
+    parser.add_argument('--child', dest='case', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--tap-url', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--vospace-url', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        run_child(args)
+        return
+
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+    cases = [case.strip() for case in args.cases.split(',')]
+    for case in cases:
+        if case not in Cases:
+            parser.error("Unknown case: {}".format(case))
+
+    results = []
+    print("{:18s} {:>6s} {:>10s} {:>10s} {:>10s} {:>10s}".format(
+        "case", "size", "seconds", "MB/s", "RSS0 MB", "RSS MB"))
+    with tempfile.TemporaryDirectory(prefix='bench_') as work_dir, \
+         Mock_Server(queue_time=args.queue_time, exec_time=args.exec_time,
+                     transfer_time=args.transfer_time, latency=args.latency,
+                     gzip_results=args.gzip) as server:
+        args.work_dir = work_dir
+        for size in sizes:
+            if 'vos_save_file' in cases or 'vos_retrieve_file' in cases:
+                write_payload(os.path.join(work_dir, payload_name(size)), size)
+            if 'vos_retrieve_file' in cases:
+                # The file to retrieve must be already stored
+                args.size = size
+                args.vospace_url = server.vospace_url
+                case_vos_save_file(args)
+            for case in cases:
+                runs = [run_case(args, server, case, size) for _ in range(args.repeat)]
+                best = min(runs, key=lambda run: run['seconds'])
+                result = dict(best, case=case, size=size,
+                              peak_rss=max(run['peak_rss'] for run in runs))
+                results.append(result)
+                rate = result['bytes'] / result['seconds'] / Units['M'] if result['bytes'] else None
+                print("{:18s} {:>6s} {:10.4f} {:>10s} {:10.1f} {:10.1f}".format(
+                    case, format_size(size), result['seconds'],
+                    '{:.1f}'.format(rate) if rate is not None else '-',
+                    result['rss_start'] / Units['M'], result['peak_rss'] / Units['M']))
+                sys.stdout.flush()
+            if 'vos_save_file' in cases or 'vos_retrieve_file' in cases:
+                os.unlink(os.path.join(work_dir, payload_name(size)))
+
+    if args.json is not None:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Micro-benchmark of the UWS job document parsing
+
+This script compares the time needed to extract the phase and the job id
+of a UWS job document with the previous minidom based code (a full DOM
+built with ``parseString`` for each of them) and with ``parse_job()`` from
+the ``uws`` package.
+
+Usage:
+    From the top folder of the repository::
+
+        $ python -m bench.uws_parse_bench [number_of_iterations]
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from timeit import timeit
+from xml.dom.minidom import parseString
+from uws.uws_job import parse_job
+
+import sys
+
+Job_Document = """<?xml version="1.0" encoding="UTF-8"?>
+<uws:job xmlns:uws="http://www.ivoa.net/xml/UWS/v1.0"
+         xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1">
+  <uws:jobId>1553094345842O</uws:jobId>
+  <uws:runId>myQuery</uws:runId>
+  <uws:ownerId>anonymous</uws:ownerId>
+  <uws:phase>COMPLETED</uws:phase>
+  <uws:quote xsi:nil="true" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"/>
+  <uws:creationTime>2019-03-20T16:05:45.842+0100</uws:creationTime>
+  <uws:startTime>2019-03-20T16:05:45.847+0100</uws:startTime>
+  <uws:endTime>2019-03-20T16:05:46.213+0100</uws:endTime>
+  <uws:executionDuration>0</uws:executionDuration>
+  <uws:destruction>2019-03-27T16:05:45.842+0100</uws:destruction>
+  <uws:parameters>
+    <uws:parameter id="query">SELECT rightascension, declination FROM public.sc3_mer</uws:parameter>
+    <uws:parameter id="format">csv</uws:parameter>
+    <uws:parameter id="lang">ADQL</uws:parameter>
+    <uws:parameter id="request">doQuery</uws:parameter>
+  </uws:parameters>
+  <uws:results>
+    <uws:result id="result" xlink:type="simple"
+                xlink:href="https://eas.esac.esa.int/tap-dev/tap/async/1553094345842O/results/result"/>
+  </uws:results>
+</uws:job>
+"""
+
+
+def minidom_phase_and_job_id(data):
+    """Previous code: one DOM for the phase, and another one for the job id."""
+    dom = parseString(data)
+    phaseElement = dom.getElementsByTagName('uws:phase')[0]
+    phase = phaseElement.firstChild.toxml()
+    DOMTree = parseString(data)
+    collection = DOMTree.documentElement
+    jobId_element = collection.getElementsByTagName('uws:jobId')[0]
+    jobId = jobId_element.childNodes[0].data
+    return phase, jobId
+
+
+def parse_job_phase_and_job_id(data):
+    """New code: a single pass of the pull parser."""
+    job = parse_job(data)
+    return job.phase, job.job_id
+
+
+def main():
+    """Runs the benchmark, and prints the time per document of each method"""
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    assert minidom_phase_and_job_id(Job_Document) == parse_job_phase_and_job_id(Job_Document)
+
+    print("Parsing {} UWS job documents".format(number))
+    times = {}
+    for func in (minidom_phase_and_job_id, parse_job_phase_and_job_id):
+        times[func] = timeit(lambda: func(Job_Document), number=number)
+        print("  {:30s}: {:8.2f} us/doc".format(func.__name__, times[func] / number * 1e6))
+    print("  speed-up: {:.1f}x".format(times[minidom_phase_and_job_id] /
+                                       times[parse_job_phase_and_job_id]))
+
+
+if __name__ == '__main__':
+    main()
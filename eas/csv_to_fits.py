@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""CSV to FITS conversion functions from package eas
+
+This module converts the CSV results of the TAP+ queries into FITS binary
+tables, either in memory (``csv_to_hdulist()``) or chunk by chunk, for
+results that do not fit in memory (``write_fits_chunked()``, fed by
+``iter_csv_records()``), or in parallel, with a pool of processes that
+parse byte ranges of the CSV data (``csv_to_hdulist_parallel()``).
+Results in VOTable format can only be converted in memory
+(``table_to_hdulist(read_table(data, 'votable'))``), and results already
+in FITS format just get their primary header updated
+(``fits_to_hdulist()``).
+
+Usage:
+    In memory::
+
+        hdul = csv_to_hdulist(csv_data)
+        buf = hdulist_to_buffer(hdul)
+
+    Chunked, from an iterator of chunks of bytes::
+
+        write_fits_chunked(iter_csv_records(chunks, 100000), "results.fits")
+
+    In chunked mode the column types are taken from the first chunk of rows,
+    and the rest of the chunks are parsed with them (e.g., strings longer
+    than the ones found in the first chunk are truncated).  If the values of
+    a later chunk do not fit those types (e.g. floats in a column that was
+    all NULL or integer so far), the column types are promoted (integer to
+    float, numbers to strings), and the rows already written to the FITS
+    file are rewritten with the new types.
+
+    In parallel, from a CSV file (or bytes), using all the cores::
+
+        hdul = csv_to_hdulist_parallel("results.csv")
+
+    In parallel mode the column types of all the byte ranges are promoted to
+    a common type (e.g. the longest string).  In chunked and parallel modes,
+    the values must not contain new line characters.
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from astropy.io import ascii,fits
+from astropy.table import Table, Column, MaskedColumn
+
+import gc, io, mmap, multiprocessing, os
+import numpy as np
+
+FITS_Block_Size = 2880
+# Value of the NULL integers in the structured arrays (astropy default)
+Int_Fill_Value = 999999
+# Rows rewritten at a time when the column types of a FITS file are promoted
+Rewrite_Rows = 65536
+
+
+def primary_hdu(header=None):
+    """Creates the primary HDU, with a blank header if none is provided."""
+    if header is None:
+        header = fits.Header()
+    return fits.PrimaryHDU(header=header)
+
+
+def read_csv_table(csv_data, converters=None):
+    """Parses CSV data (bytes, str or a binary file object) into a Table,
+    with the given ascii.read() converters, if any."""
+    if hasattr(csv_data, 'read'):
+        csv_data = csv_data.read()
+    if not isinstance(csv_data, str):
+        csv_data = bytes(csv_data).decode("UTF-8")
+    # A string without new lines would be taken as a file name
+    if not csv_data.endswith('\n'):
+        csv_data += '\n'
+    if converters is None:
+        return ascii.read(csv_data, format='csv')
+    return ascii.read(csv_data, format='csv', guess=False, converters=converters)
+
+
+def read_table(data, fmt):
+    """Parses query results (bytes) in the given TAP+ output format into a
+    Table."""
+    if fmt == "csv":
+        return read_csv_table(data)
+    if fmt in ("votable", "votable_plain"):
+        return Table.read(io.BytesIO(data), format="votable")
+    return Table.read(io.BytesIO(data), format="fits")
+
+
+def table_to_hdulist(tab, header=None):
+    """Converts the Table into a FITS HDUList with a binary table, without
+    copying the table into an intermediate array of rows."""
+    return fits.HDUList([primary_hdu(header), fits.table_to_hdu(tab)])
+
+
+def csv_to_hdulist(csv_data, header=None):
+    """Converts the CSV data into a FITS HDUList with a binary table, without
+    going through temporary files."""
+    return table_to_hdulist(read_csv_table(csv_data), header)
+
+
+def fits_to_hdulist(fits_data, header=None):
+    """Opens FITS data (bytes) as an HDUList, updating its primary header
+    with the cards of header, if provided."""
+    hdul = fits.open(io.BytesIO(fits_data))
+    if header is not None:
+        hdul[0].header.update(header)
+    return hdul
+
+
+def hdulist_to_buffer(hdul):
+    """Writes the HDUList into an in-memory buffer, rewound to its start."""
+    buf = io.BytesIO()
+    hdul.writeto(buf)
+    buf.seek(0)
+    return buf
+
+
+def iter_lines(chunks):
+    """Splits an iterator of chunks of bytes into lines (including the
+    trailing new line characters)."""
+    pending = b''
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if pending:
+        yield pending + b'\n'
+
+
+# Types tried to parse a column, by kind of its current type
+Promotions = {'b': (bool, int, float, str), 'i': (int, float, str), 'u': (int, float, str),
+              'f': (float, str), 'U': (str,), 'S': (str,)}
+
+
+def csv_converters(dtype):
+    """Returns the converters for ascii.read() that parse each column of the
+    CSV data directly with the type of the corresponding field of dtype,
+    instead of guessing it, or with a wider type (see Promotions) if some of
+    the values of the column do not fit it."""
+    return {name: [ascii.convert_numpy(t)
+                   for t in Promotions.get(dtype.fields[name][0].kind, (str,))]
+            for name in dtype.names}
+
+
+def iter_csv_blocks(chunks, rows_per_chunk):
+    """Splits an iterator of chunks of CSV bytes into blocks of at most
+    rows_per_chunk rows, each of them with the header line prepended.  At
+    least one (maybe empty) block is returned."""
+    lines = iter_lines(chunks)
+    header = next(lines, b'')
+    rows = []
+    nblocks = 0
+    for line in lines:
+        rows.append(line)
+        if len(rows) >= rows_per_chunk:
+            yield header + b''.join(rows)
+            nblocks += 1
+            rows = []
+    if rows or nblocks == 0:
+        yield header + b''.join(rows)
+
+
+def iter_csv_tables(chunks, rows_per_chunk, dtype=None):
+    """Parses an iterator of chunks of CSV bytes into Tables of at most
+    rows_per_chunk rows.  At least one (maybe empty) table is returned.  If
+    dtype is provided, the column types are not guessed, but only widened
+    if needed (see csv_converters())."""
+    converters = csv_converters(dtype) if dtype is not None else None
+    for block in iter_csv_blocks(chunks, rows_per_chunk):
+        yield read_csv_table(block, converters)
+
+
+def iter_csv_records(chunks, rows_per_chunk, dtype=None):
+    """Parses an iterator of chunks of CSV bytes into structured arrays of at
+    most rows_per_chunk rows, with the provided dtype, or else the one
+    inferred from the first chunk of rows.  The rest of the chunks are parsed
+    directly with those column types, unless their values do not fit them
+    (e.g. floats in a column of integers): the dtype is then promoted (see
+    promote_dtype()) for that chunk and the following ones."""
+    converters = csv_converters(dtype) if dtype is not None else None
+    for block in iter_csv_blocks(chunks, rows_per_chunk):
+        tab = read_csv_table(block, converters)
+        records = table_to_records(tab)
+        # The Table of the chunk (and the parser objects) sit in reference
+        # cycles: free them now, so that the memory used does not grow with
+        # the number of chunks until the cyclic GC happens to run
+        del tab, block
+        gc.collect()
+        if dtype is not None and records.dtype != dtype:
+            new_dtype = promote_dtype(dtype, records.dtype)
+            if new_dtype != dtype:
+                dtype = new_dtype
+                converters = csv_converters(dtype)
+            records = promote_records(records, dtype)
+        if dtype is None:
+            dtype = records.dtype
+            converters = csv_converters(dtype)
+        yield records
+
+
+def promote_dtype(dtype, other):
+    """Returns the dtype of structured arrays with the fields of dtype, that
+    can hold the values of both dtype and other (e.g. float for integer
+    and float fields, strings for numbers and strings).  String fields keep
+    their length."""
+    fields = []
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        if field.kind not in 'US':
+            field = common_dtype([field, other.fields[name][0]])
+        fields.append((name, field))
+    return np.dtype(fields)
+
+
+def promote_records(records, dtype):
+    """Casts the records to dtype.  The NULL integers (Int_Fill_Value) cast
+    to floating point become NaN, and the NULL numbers (Int_Fill_Value or
+    NaN) cast to strings become empty strings."""
+    if records.dtype == dtype:
+        return records
+    promoted = np.empty(len(records), dtype=dtype)
+    for name in dtype.names:
+        col = records[name]
+        field = dtype.fields[name][0]
+        if col.dtype.kind in 'iu' and field.kind == 'f':
+            promoted[name] = np.where(col == Int_Fill_Value, np.nan, col)
+        elif col.dtype.kind in 'iuf' and field.kind in 'US':
+            null = np.isnan(col) if col.dtype.kind == 'f' else col == Int_Fill_Value
+            promoted[name] = np.where(null, '', col.astype(field))
+        else:
+            promoted[name] = col.astype(field)
+    return promoted
+
+
+def table_to_records(tab, dtype=None):
+    """Converts a Table into a structured array, filling masked values (NaN
+    for floating point columns, Int_Fill_Value for integers), and casting it
+    to dtype if provided."""
+    if tab.masked or tab.has_masked_columns:
+        for col in tab.itercols():
+            if hasattr(col, 'mask') and col.dtype.kind == 'f':
+                col.fill_value = np.nan
+            elif hasattr(col, 'mask') and col.dtype.kind in 'iu':
+                col.fill_value = Int_Fill_Value
+        tab = tab.filled()
+    records = np.array(tab)
+    if dtype is not None:
+        records = promote_records(records, dtype)
+    return records
+
+
+def fits_raw_dtype(dtype):
+    """Returns the dtype of the rows of a FITS binary table, as stored on
+    disk, for the records of the given dtype."""
+    fields = []
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        if field.kind == 'U':
+            fields.append((name, 'S{}'.format(field.itemsize // 4)))
+        elif field.kind == 'b':
+            fields.append((name, 'i1'))
+        else:
+            fields.append((name, field.newbyteorder('>')))
+    return np.dtype(fields)
+
+
+def records_to_raw(records, raw_dtype):
+    """Converts the records into FITS binary table rows."""
+    raw = np.empty(len(records), dtype=raw_dtype)
+    for name in records.dtype.names:
+        col = records[name]
+        if col.dtype.kind == 'b':
+            raw[name] = np.where(col, ord('T'), ord('F'))
+        elif col.dtype.kind == 'U':
+            raw[name] = np.char.encode(col, 'UTF-8')
+        else:
+            raw[name] = col
+    return raw
+
+
+def raw_to_records(raw, dtype):
+    """Converts FITS binary table rows back into records of the given dtype
+    (the inverse of records_to_raw())."""
+    records = np.empty(len(raw), dtype=dtype)
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        if field.kind == 'b':
+            records[name] = raw[name] == ord('T')
+        elif field.kind == 'U':
+            records[name] = np.char.decode(raw[name], 'UTF-8', 'replace')
+        else:
+            records[name] = raw[name]
+    return records
+
+
+def rewrite_rows(fits_file, data_pos, nrows, dtype, new_dtype):
+    """Rewrites the nrows rows of a FITS binary table, stored in fits_file
+    from data_pos, with the column types of new_dtype instead of dtype.  The
+    rows are converted in place, from the last ones to the first ones, as
+    the rows with the promoted types are never smaller."""
+    raw_dtype, new_raw_dtype = fits_raw_dtype(dtype), fits_raw_dtype(new_dtype)
+    for end in range(nrows, 0, -Rewrite_Rows):
+        start = max(end - Rewrite_Rows, 0)
+        fits_file.seek(data_pos + start * raw_dtype.itemsize)
+        raw = np.frombuffer(fits_file.read((end - start) * raw_dtype.itemsize), dtype=raw_dtype)
+        records = promote_records(raw_to_records(raw, dtype), new_dtype)
+        fits_file.seek(data_pos + start * new_raw_dtype.itemsize)
+        fits_file.write(records_to_raw(records, new_raw_dtype).tobytes())
+    fits_file.seek(data_pos + nrows * new_raw_dtype.itemsize)
+
+
+def write_fits_chunked(records, file_name, header=None):
+    """Writes the structured arrays returned by an iterator (e.g. by
+    iter_csv_records()) as a single FITS binary table, appending the rows of
+    each array as they arrive.  The column types are those of the first
+    array, promoted if needed for the following ones (see promote_dtype()),
+    in which case the rows already written are rewritten.  file_name can
+    also be a seekable binary file object, open for reading and writing."""
+    records = iter(records)
+    first = next(records)
+    dtype = first.dtype
+    raw_dtype = fits_raw_dtype(dtype)
+    table_hdu = fits.BinTableHDU.from_columns(np.empty(0, dtype=dtype))
+
+    own_file = not hasattr(file_name, 'write')
+    fits_file = open(file_name, "w+b") if own_file else file_name
+    try:
+        primary_hdu(header).writeto(fits_file)
+        header_pos = fits_file.tell()
+        fits_file.write(table_hdu.header.tostring().encode('ascii'))
+        data_pos = fits_file.tell()
+        nrows = 0
+        for chunk in chain([first], records):
+            if chunk.dtype != dtype:
+                new_dtype = promote_dtype(dtype, chunk.dtype)
+                if new_dtype != dtype:
+                    table_hdu = fits.BinTableHDU.from_columns(np.empty(0, dtype=new_dtype))
+                    if len(table_hdu.header.tostring()) != data_pos - header_pos:
+                        raise ValueError("Cannot promote the column types to {}".format(new_dtype))
+                    rewrite_rows(fits_file, data_pos, nrows, dtype, new_dtype)
+                    dtype, raw_dtype = new_dtype, fits_raw_dtype(new_dtype)
+                chunk = promote_records(chunk, dtype)
+            fits_file.write(records_to_raw(chunk, raw_dtype).tobytes())
+            nrows += len(chunk)
+        # Pad the data to a full FITS block, and set the final number of rows
+        fits_file.write(b'\0' * (-nrows * raw_dtype.itemsize % FITS_Block_Size))
+        end_pos = fits_file.tell()
+        table_hdu.header['NAXIS2'] = nrows
+        fits_file.seek(header_pos)
+        fits_file.write(table_hdu.header.tostring().encode('ascii'))
+        fits_file.seek(end_pos)
+    finally:
+        if own_file:
+            fits_file.close()
+
+
+Parallel_Min_Size = 8 * 1024 * 1024
+# Start method of the parsing processes: forking a process that runs other
+# threads (e.g. the job monitor, or the download threads) may deadlock them
+Parallel_Start_Method = ('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+                         else 'spawn')
+
+
+def csv_byte_ranges(data, parts):
+    """Splits CSV data (a bytes-like object) into the header line and at most
+    parts byte ranges (start, end) of similar size, that end at line
+    boundaries."""
+    size = len(data)
+    start = data.find(b'\n') + 1 if size else 0
+    if start == 0:
+        return bytes(data), []
+    header = bytes(data[:start])
+    ranges = []
+    step = max(1, (size - start) // parts)
+    while start < size:
+        end = data.find(b'\n', min(start + step, size - 1))
+        end = size if end < 0 else end + 1
+        ranges.append((start, end))
+        start = end
+    return header, ranges
+
+
+def parse_csv_range(header, source, start, end):
+    """Parses a byte range of CSV data (bytes, or the name of a file to read
+    them from) into a list of (name, values, mask) columns, the mask being
+    None if there are no missing values.  This is the task run by the
+    worker processes of csv_to_hdulist_parallel()."""
+    if isinstance(source, str):
+        with open(source, "rb") as csv_file:
+            csv_file.seek(start)
+            source = csv_file.read(end - start)
+    tab = read_csv_table(header + source)
+    columns = []
+    for col in tab.itercols():
+        mask = np.ma.getmaskarray(col) if hasattr(col, 'mask') else None
+        columns.append((col.name, np.ma.getdata(col),
+                        mask if mask is not None and mask.any() else None))
+    return columns
+
+
+def common_dtype(dtypes):
+    """Returns the type that can hold the values of all the given column
+    types (strings if any of them is a string)."""
+    if any(dtype.kind in 'US' for dtype in dtypes):
+        return np.dtype('U{}'.format(max(dtype.itemsize // 4 if dtype.kind == 'U' else
+                                         dtype.itemsize if dtype.kind == 'S' else 32
+                                         for dtype in dtypes)))
+    return np.result_type(*dtypes)
+
+
+def merge_columns(parts):
+    """Concatenates, column by column, the columns parsed from each byte
+    range, promoting them to a common type, into a Table (with masked
+    columns for the columns with missing values)."""
+    nonempty = [part for part in parts if len(part) and len(part[0][1])] or parts[:1]
+    tab = Table()
+    for i, (name, _, _) in enumerate(nonempty[0]):
+        arrays = [part[i][1] for part in nonempty]
+        masks = [part[i][2] for part in nonempty]
+        dtype = common_dtype([array.dtype for array in arrays])
+        values = np.concatenate([array.astype(dtype, copy=False) for array in arrays])
+        if any(mask is not None for mask in masks):
+            mask = np.concatenate([mask if mask is not None else np.zeros(len(array), bool)
+                                   for array, mask in zip(arrays, masks)])
+            tab.add_column(MaskedColumn(values, name=name, mask=mask, copy=False))
+        else:
+            tab.add_column(Column(values, name=name, copy=False))
+    return tab
+
+
+def parse_context():
+    """Returns the multiprocessing context of the parsing processes (see
+    Parallel_Start_Method).  The fork server imports this module before
+    forking them, so that it is not imported again by each process."""
+    context = multiprocessing.get_context(Parallel_Start_Method)
+    if Parallel_Start_Method == 'forkserver':
+        context.set_forkserver_preload(['eas.csv_to_fits'])
+    return context
+
+
+def csv_to_hdulist_parallel(csv_data, header=None, processes=None):
+    """Converts the CSV data (a bytes-like object, or the name of a CSV file)
+    into a FITS HDUList with a binary table, parsing byte ranges of the data
+    in parallel with a pool of processes (os.cpu_count() by default).  The
+    columns parsed are assembled directly into the table, without building
+    an intermediate array of rows.  Data smaller than Parallel_Min_Size are
+    converted in a single process."""
+    if processes is None:
+        processes = os.cpu_count() or 1
+    csv_file = data = None
+    try:
+        if isinstance(csv_data, str):
+            csv_file = open(csv_data, "rb")
+            if os.fstat(csv_file.fileno()).st_size == 0:
+                return csv_to_hdulist(b'', header)
+            data = mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = csv_data
+        if processes < 2 or len(data) < Parallel_Min_Size:
+            return csv_to_hdulist(data, header)
+        head, ranges = csv_byte_ranges(data, processes)
+        if not ranges:
+            return csv_to_hdulist(data, header)
+        with ProcessPoolExecutor(max_workers=processes, mp_context=parse_context()) as executor:
+            if csv_file is not None:
+                futures = [executor.submit(parse_csv_range, head, csv_data, start, end)
+                           for start, end in ranges]
+            else:
+                futures = [executor.submit(parse_csv_range, head, bytes(data[start:end]), 0, 0)
+                           for start, end in ranges]
+            parts = [future.result() for future in futures]
+    finally:
+        if csv_file is not None:
+            if data is not None:
+                data.close()
+            csv_file.close()
+    return table_to_hdulist(merge_columns(parts), header)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""EAS_Batch_Query class from package eas
+
+This module allows the execution of a batch of ADQL queries, submitted to
+the TAP+ asynchronous interface with a limit on the number of jobs running
+at the same time.  All the jobs are monitored by the shared job monitor
+(see uws.job_monitor), instead of using one thread per job.
+
+Usage:
+    The sequence of commands to perform a batch of queries would be
+     1. Create the EAS_Batch_Query object with the list of queries
+     2. Iterate over the ``as_completed()`` method, that returns the index
+        of each query in the list and its EAS_Query object, as soon as
+        the corresponding job finishes
+     3. Retrieve the results of each query with its ``results()`` method
+
+    For example::
+
+        batch = EAS_Batch_Query(queries, max_concurrent=8)
+        for idx, qry in batch.as_completed():
+            if qry.phase == 'COMPLETED':
+                qry.save_results_as_csv("tile_{}.csv".format(idx))
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from concurrent.futures import wait, FIRST_COMPLETED
+from eas.eas_qry import EAS_Query
+from uws.uws_job import UWS_Job_Waiter
+
+
+class EAS_Batch_Query(object):
+    """
+    Executes a list of ADQL queries concurrently, monitored by a shared
+    job monitor
+    """
+
+    def __init__(self, queries, max_concurrent=8, name="myQuery",
+                 desc="This is my query", waiter=None, session=None, fmt="csv",
+                 monitor=None, cache_results=True, tap_url=None):
+        """Initialize object (class instance) attributes.  Each query is
+        named with the given name followed by its index in the list.  All
+        the queries share the waiter, the HTTP session and the job monitor
+        (UWS_Job_Monitor), if provided, the output format fmt, and the
+        cache_results and tap_url options of EAS_Query."""
+        self.queries = list(queries)
+        self.max_concurrent = max_concurrent
+        self.name = name
+        self.desc = desc
+        self.fmt = fmt
+        self.waiter = waiter if waiter is not None else UWS_Job_Waiter()
+        self.session = session
+        self.monitor = monitor
+        self.cache_results = cache_results
+        self.tap_url = tap_url
+
+    def create_query(self, idx):
+        """Creates the EAS_Query object for the query with index idx."""
+        qry = EAS_Query(cache_results=self.cache_results, waiter=self.waiter,
+                        session=self.session, monitor=self.monitor, tap_url=self.tap_url)
+        qry.setQuery(adqlQry=self.queries[idx],
+                     name="{}-{}".format(self.name, idx), desc=self.desc,
+                     fmt=self.fmt)
+        return qry
+
+    def run_query(self, qry):
+        """Submits the query, and starts monitoring its job.  Returns False if
+        the submission failed."""
+        try:
+            qry.run()
+        except Exception as e:
+            qry.phase = 'ERROR'
+            qry.status_info = str(e)
+            return False
+        return True
+
+    def as_completed(self):
+        """Submits the queries, keeping at most max_concurrent jobs running,
+        and yields a tuple (index, EAS_Query) for each of them when its job
+        reaches a final phase (see the phase attribute of the query)."""
+        pending = iter(range(len(self.queries)))
+        # Futures of the jobs being monitored, with their index and query
+        running = {}
+        while True:
+            # Fill the free slots with new jobs
+            while len(running) < self.max_concurrent:
+                idx = next(pending, None)
+                if idx is None: break
+                qry = self.create_query(idx)
+                if not self.run_query(qry) or qry.job_future is None:
+                    # Failed submission, or results found in the cache
+                    yield idx, qry
+                    continue
+                running[qry.job_future] = (idx, qry)
+            if not running: break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx, qry = running.pop(future)
+                qry.wait_finished()
+                yield idx, qry
+
+    def run(self):
+        """Executes all the queries, and returns the list of EAS_Query objects
+        in the same order as the queries."""
+        done = [None] * len(self.queries)
+        for idx, qry in self.as_completed():
+            done[idx] = qry
+        return done
+
+
+def main():
+    """Sample usage of the EAS_Batch_Query class"""
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""EAS_Partitioned_Query class from package eas
+
+This module splits a spatial ADQL query (e.g. a cone or box search) into
+sub-queries over RA/Dec tiles, that are run concurrently in the server as
+independent TAP+ asynchronous jobs (see EAS_Batch_Query).  The CSV results
+of the tiles are then merged into a single CSV stream: in tile order, or
+with a streaming k-way merge if the query has an ORDER BY clause.
+
+Usage:
+    The tile constraint is inserted in the WHERE clause of the query (or
+    in place of a ``{tile}`` placeholder, if present)::
+
+        ra_range, dec_range = circle_bounds(16.41683, 4.90781, 2.0)
+        qry = EAS_Partitioned_Query(adql, 'rightascension', 'declination',
+                                    ra_range, dec_range, n_ra=4, n_dec=4)
+        qry.run()
+        qry.save_results_as_csv("results.csv")
+
+    The ORDER BY clause can only refer to columns (or aliases) present in
+    the results, and a TOP clause is applied to the merged results.  The
+    results of queries with GROUP BY, HAVING, DISTINCT or aggregate
+    functions (COUNT, SUM, AVG...) cannot be merged from those of the
+    tiles, so these queries are rejected with a ValueError.  RA
+    ranges may extend below 0 or above 360 degrees (crossing RA=0), and
+    ranges of 360 degrees or more are taken as the whole [0, 360) range.
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from eas.eas_batch import EAS_Batch_Query
+from eas.csv_to_fits import iter_lines
+from eas.result_cache import String_Literal_Regex
+
+import csv, heapq, math, re
+
+Where_Regex = re.compile(r'\bWHERE\b', re.IGNORECASE)
+Tail_Regex = re.compile(r'\b(GROUP\s+BY|HAVING|ORDER\s+BY)\b', re.IGNORECASE)
+Order_By_Regex = re.compile(r'\bORDER\s+BY\s+(.+?)\s*;?\s*$', re.IGNORECASE | re.DOTALL)
+Top_Regex = re.compile(r'\bSELECT\s+(?:DISTINCT\s+)?TOP\s+(\d+)', re.IGNORECASE)
+Not_Partitionable_Regex = re.compile(r'\b(GROUP\s+BY|HAVING|DISTINCT)\b|'
+                                     r'\b(COUNT|SUM|AVG|MIN|MAX)\s*\(', re.IGNORECASE)
+
+
+def mask_literals(adqlQry):
+    """Returns the query with the contents of its string literals replaced
+    by blanks, so that the keywords they may contain are not taken as part
+    of the query.  The positions in the query are kept."""
+    return String_Literal_Regex.sub(lambda m: "'" + ' ' * (len(m.group(0)) - 2) + "'",
+                                    adqlQry)
+
+
+def check_partitionable(adqlQry):
+    """Raises ValueError if the results of the query cannot be obtained by
+    merging those of its tiles, i.e. if it groups rows, removes duplicate
+    rows or computes aggregate functions."""
+    clause = Not_Partitionable_Regex.search(mask_literals(adqlQry))
+    if clause is not None:
+        raise ValueError("Query cannot be partitioned in tiles (found {}): {}"
+                         .format(' '.join(clause.group(0).rstrip('(').split()).upper(),
+                                 adqlQry))
+
+
+def circle_bounds(ra, dec, radius):
+    """Returns the RA and Dec ranges (in degrees) of the box containing the
+    circle with the given center and radius.  If the circle contains a pole,
+    or its RA extent is 360 degrees or more, the RA range is [0, 360)."""
+    dec_min = max(dec - radius, -90.0)
+    dec_max = min(dec + radius, 90.0)
+    if dec_min <= -90.0 or dec_max >= 90.0:
+        return (0.0, 360.0), (dec_min, dec_max)
+    delta_ra = radius / math.cos(math.radians(max(abs(dec_min), abs(dec_max))))
+    if 2.0 * delta_ra >= 360.0:
+        return (0.0, 360.0), (dec_min, dec_max)
+    return (ra - delta_ra, ra + delta_ra), (dec_min, dec_max)
+
+
+def ra_constraint(ra_col, ra_lo, ra_hi, last):
+    """Returns the ADQL constraint for the RA interval [ra_lo, ra_hi) (or
+    [ra_lo, ra_hi] if last), wrapping it around RA=0 if needed."""
+    upper = '<=' if last else '<'
+    # The interval is shifted so that ra_lo is in [0, 360): the edges shared
+    # by neighbour tiles get the same value
+    shift = math.floor(ra_lo / 360.0) * 360.0
+    ra_lo, ra_hi = ra_lo - shift, ra_hi - shift
+    if ra_hi > 360.0:
+        return "({0} >= {1!r} OR {0} {2} {3!r})".format(ra_col, ra_lo, upper, ra_hi - 360.0)
+    return "{0} >= {1!r} AND {0} {2} {3!r}".format(ra_col, ra_lo, upper, ra_hi)
+
+
+def tile_constraints(ra_col, dec_col, ra_range, dec_range, n_ra, n_dec):
+    """Returns the list of ADQL constraints that select each of the n_ra x n_dec
+    tiles of the RA/Dec ranges.  The tiles are half-open intervals, except
+    the last ones, so that each source falls in exactly one of them.  An RA
+    range of 360 degrees or more is taken as [0, 360]."""
+    if ra_range[1] - ra_range[0] >= 360.0:
+        ra_range = (0.0, 360.0)
+
+    def edges(lo, hi, n):
+        step = (hi - lo) / n
+        return [(lo + i * step, hi if i == n - 1 else lo + (i + 1) * step, i == n - 1)
+                for i in range(n)]
+
+    constraints = []
+    for dec_lo, dec_hi, dec_last in edges(dec_range[0], dec_range[1], n_dec):
+        for ra_lo, ra_hi, ra_last in edges(ra_range[0], ra_range[1], n_ra):
+            constraints.append("({} AND {} >= {!r} AND {} {} {!r})"
+                               .format(ra_constraint(ra_col, ra_lo, ra_hi, ra_last),
+                                       dec_col, dec_lo, dec_col, '<=' if dec_last else '<', dec_hi))
+    return constraints
+
+
+def add_constraint(adqlQry, constraint):
+    """Adds the constraint to the query: in place of the {tile} placeholder,
+    if present, or else combined with the condition of the WHERE clause,
+    in parentheses (creating the clause if needed).  The keywords and
+    placeholder within string literals are ignored."""
+    masked = mask_literals(adqlQry)
+    if '{tile}' in masked:
+        pos = masked.index('{tile}')
+        return adqlQry[:pos] + constraint + adqlQry[pos + len('{tile}'):]
+    where = Where_Regex.search(masked)
+    if where is not None:
+        tail = Tail_Regex.search(masked, where.end())
+        end = tail.start() if tail is not None else len(masked.rstrip().rstrip(';'))
+        rest = adqlQry[end:].strip()
+        return "{} {} AND ({}){}{}".format(adqlQry[:where.end()], constraint,
+                                           adqlQry[where.end():end].strip(),
+                                           '' if rest.startswith(';') else ' ', rest).rstrip()
+    tail = Tail_Regex.search(masked)
+    pos = tail.start() if tail is not None else len(masked.rstrip().rstrip(';'))
+    rest = adqlQry[pos:].strip()
+    return "{} WHERE {}{}{}".format(adqlQry[:pos].rstrip(), constraint,
+                                    '' if rest.startswith(';') else ' ', rest).rstrip()
+
+
+def order_by_columns(adqlQry):
+    """Returns the list of (column, descending) pairs of the ORDER BY clause
+    of the query, or an empty list if it has none."""
+    order_by = Order_By_Regex.search(mask_literals(adqlQry))
+    if order_by is None:
+        return []
+    columns = []
+    for item in adqlQry[order_by.start(1):order_by.end(1)].split(','):
+        words = item.split()
+        descending = len(words) > 1 and words[-1].upper() == 'DESC'
+        if len(words) > 1 and words[-1].upper() in ('ASC', 'DESC'):
+            words = words[:-1]
+        columns.append((' '.join(words).split('.')[-1].strip('"'), descending))
+    return columns
+
+
+class Sort_Key(object):
+    """
+    Sort key of a CSV row, for the ORDER BY columns, with their directions.
+    Numeric values are compared as numbers, and empty values (NULL) sort
+    after any other value in ascending order (and before, in descending).
+    """
+
+    __slots__ = ('values', 'descending')
+
+    def __init__(self, values, descending):
+        self.values = [Sort_Key.convert(v) for v in values]
+        self.descending = descending
+
+    @staticmethod
+    def convert(value):
+        """Returns a comparable tuple for the value."""
+        if value == '':
+            return (2, 0)
+        try:
+            return (0, float(value))
+        except ValueError:
+            return (1, value)
+
+    def __lt__(self, other):
+        for a, b, desc in zip(self.values, other.values, self.descending):
+            if a != b:
+                return (a > b) if desc else (a < b)
+        return False
+
+
+class EAS_Partitioned_Query(object):
+    """
+    Runs a spatial query as concurrent sub-queries over RA/Dec tiles, and
+    merges their results
+    """
+
+    def __init__(self, adqlQry, ra_col, dec_col, ra_range, dec_range, n_ra=2, n_dec=2,
+                 max_concurrent=8, name="myQuery", desc="This is my query",
+                 waiter=None, session=None, monitor=None, tap_url=None):
+        """Initialize object (class instance) attributes.  The sub-queries are
+        run by an EAS_Batch_Query, with the waiter, HTTP session, job monitor
+        and TAP+ service URL provided, if any.  Their results are not cached locally,
+        but streamed from the server during the merge.  Raises ValueError if the query cannot be
+        partitioned (see check_partitionable())."""
+        check_partitionable(adqlQry)
+        self.adqlQry = adqlQry
+        self.sub_queries = [add_constraint(adqlQry, constraint)
+                            for constraint in tile_constraints(ra_col, dec_col, ra_range,
+                                                               dec_range, n_ra, n_dec)]
+        self.order_by = order_by_columns(adqlQry)
+        top = Top_Regex.search(mask_literals(adqlQry))
+        self.top = int(top.group(1)) if top is not None else None
+        self.batch = EAS_Batch_Query(self.sub_queries, max_concurrent=max_concurrent,
+                                     name=name, desc=desc, waiter=waiter, session=session,
+                                     monitor=monitor, cache_results=False, tap_url=tap_url)
+        self.tiles = None
+
+    def run(self):
+        """Runs all the sub-queries concurrently, and waits for them to finish.
+        Raises RuntimeError if any of them fails."""
+        self.tiles = self.batch.run()
+        for idx, qry in enumerate(self.tiles):
+            if qry.phase != 'COMPLETED':
+                raise RuntimeError("Sub-query {} finished in phase {}. {}"
+                                   .format(idx, qry.phase, qry.exit_info()))
+        return True
+
+    def iter_tile_rows(self, qry):
+        """Returns the header line and an iterator over the rows of the results
+        of a sub-query, as (line, sort key) pairs."""
+        lines = iter_lines(qry.results_stream())
+        header = next(lines, b'')
+        names = next(csv.reader([header.decode("UTF-8")]), [])
+        try:
+            positions = [names.index(col) for col, desc in self.order_by]
+        except ValueError:
+            raise ValueError("ORDER BY columns {} not found in results columns {}"
+                             .format([col for col, desc in self.order_by], names))
+        descending = [desc for col, desc in self.order_by]
+
+        def rows():
+            for line in lines:
+                if not line.strip(): continue
+                if not positions:
+                    yield line, None
+                    continue
+                values = next(csv.reader([line.decode("UTF-8")]))
+                yield line, Sort_Key([values[p] for p in positions], descending)
+
+        return header, rows()
+
+    def results_stream(self):
+        """Returns an iterator over the merged CSV results (one line per item).
+        The rows of each tile are read from its own result stream, downloaded
+        from the server as the merge goes on (the results of the tiles are
+        not cached), so only one row and one chunk of the download per tile
+        are held in memory.  Each call downloads the results again."""
+        header = None
+        streams = []
+        for qry in self.tiles:
+            tile_header, rows = self.iter_tile_rows(qry)
+            if header is None:
+                header = tile_header
+            streams.append(rows)
+        if self.order_by:
+            merged = heapq.merge(*streams, key=lambda row: row[1])
+        else:
+            merged = (row for rows in streams for row in rows)
+
+        yield header
+        for nrows, (line, key) in enumerate(merged):
+            if self.top is not None and nrows >= self.top: break
+            yield line
+
+    def results(self):
+        """Returns the merged CSV results."""
+        return b''.join(self.results_stream())
+
+    def save_results_as_csv(self, file_name):
+        """Stores the merged CSV results in a local file."""
+        with open(file_name, "wb") as csv_file:
+            for line in self.results_stream():
+                csv_file.write(line)
+
+
+def main():
+    """Sample usage of the EAS_Partitioned_Query class"""
+    pass
+
+
+if __name__ == '__main__':
+    main()
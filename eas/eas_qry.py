@@ -29,16 +29,69 @@ __email__ = "jcgonzalez@sciops.esa.int"
 __status__ = "Prototype" # Prototype | Development | Production
 
 
-from time import sleep
-from threading import Thread
-from xml.dom.minidom import parseString
-from astropy.io import ascii,fits
+from concurrent.futures import wait
+from queue import Queue, Full
+from threading import Thread, Event
+from eas.csv_to_fits import (csv_to_hdulist, fits_to_hdulist, table_to_hdulist,
+                              hdulist_to_buffer, read_table,
+                              iter_csv_records, write_fits_chunked,
+                              csv_to_hdulist_parallel)
+from astropy.table import Table
+from uws.uws_job import UWS_Job_Waiter, parse_job
+from uws.job_monitor import default_monitor
+from uws.http_session import default_session
+from uws.metrics import Metrics
 #from pprint import pprint
 
-import os, tempfile
-import numpy as np
+import io, mmap, os, tempfile
 import urllib.parse as urlparse
-import urllib.request as urlrequest
+
+
+def prefetch(chunks, depth):
+    """Iterates over chunks, that are read in a separate thread up to depth
+    chunks ahead of the consumer, so that producing (e.g. downloading) and
+    consuming (e.g. uploading) them overlap in time.  The exception raised
+    by the producer, if any, is raised to the consumer.  If the consumer
+    stops early (or the iterator is closed), the producer is stopped."""
+    queue = Queue(depth)
+    stop = Event()
+    end = object()
+    failure = []
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def producer():
+        try:
+            for chunk in chunks:
+                if not put(chunk): return
+        except BaseException as e:
+            failure.append(e)
+        finally:
+            try:
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+            finally:
+                # The consumer is always woken up, whatever happened
+                put(end)
+
+    thread = Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is end: break
+            yield item
+        if failure: raise failure[0]
+    finally:
+        stop.set()
+        thread.join()
 
 
 class EAS_Query(object):
@@ -50,120 +103,457 @@ class EAS_Query(object):
 
     Content_Type = "application/x-www-form-urlencoded"
     MIME_Text_Plain = "text/plain"
+    # Content codings accepted for the results (decompressed as they arrive)
+    Accept_Encoding = "gzip, deflate"
 
-    def __init__(self):
-        """Initialize object (class instance) attributes."""
+    # Connect and read timeouts (seconds) of the HTTP requests: a request
+    # whose server sends no data for the read timeout fails
+    Timeout = (10, 60)
+
+    Chunk_Size = 1024 * 1024
+    Result_Cache_Max_Memory = 64 * 1024 * 1024
+    Rows_Per_Chunk = 100000
+    Prefetch_Chunks = 8
+    # Processes parsing the CSV results in parallel (None: all the cores)
+    Parse_Processes = None
+
+    # Output formats of the TAP+ service: 'votable' is a VOTable with BINARY
+    # serialization, 'votable_plain' uses TABLEDATA
+    Output_Formats = ("csv", "votable", "votable_plain", "fits")
+
+    def __init__(self, cache_results=True, waiter=None, session=None,
+                 result_cache=None, tap_url=None, metrics=None, monitor=None, timeout=None):
+        """Initialize object (class instance) attributes.  If cache_results is
+        True, the result of each job is downloaded only once, and kept in a
+        local spooled temporary file (in memory up to Result_Cache_Max_Memory
+        bytes, then on disk) shared by all the results* and save_* methods.
+        After run(), the job is monitored in the background by the provided
+        UWS_Job_Monitor (or the one shared by default in the process), with
+        the backoff schedule of the provided UWS_Job_Waiter (or a default
+        one), that is also used by runUntilFinished().  All the HTTP requests
+        are made through the provided session, or through a session of its
+        own (with its own cookies) that uses the connection pool shared in
+        the process (see default_session()).  If an EAS_Result_Cache is
+        provided, the results of queries already run (with the same
+        normalized text, format and endpoint) are taken from it, without
+        running a new job.  The queries are sent to tap_url (EAS_TAP_URL by
+        default), with the provided timeout (Timeout by default) for each
+        request, so that a stalled server cannot block the polls of the job
+        monitor.  The duration of each phase (tap_submit, tap_job_queued,
+        tap_job_executing, results_download, csv_parse, fits_build...), the
+        number of polls and the bytes downloaded are recorded in the provided
+        Metrics object, or in one owned by the object."""
+        self.tap_url = tap_url if tap_url is not None else EAS_Query.EAS_TAP_URL
+        self.timeout = timeout if timeout is not None else EAS_Query.Timeout
+        self.adql = None
         self.qry_params = None
-        self.request = None
+        self.qry_format = "csv"
+        self.headers = None
         self.connection = None
+        self.session = session if session is not None else default_session()
         self.status_info = ""
-        self.jobThread = None
+        self.job_future = None
+        self.monitor = monitor
+
+        self.waiter = waiter if waiter is not None else UWS_Job_Waiter()
+        self.phase = None
+        self.job_status = None
+        self.polls = 0
+
+        self.cache_results = cache_results
+        self.result_cache = None
+
+        self.disk_cache = result_cache
+        self.cache_key = None
+        self.cache_hit = False
+
+        self.metrics = metrics if metrics is not None else Metrics()
 
         self.vospace_user = ""
         self.vospace_pwd = ""
         self.vospace_auth_set = False
 
-    def setQuery(self, adqlQry, name="myQuery", desc="This is my query"):
+    def setQuery(self, adqlQry, name="myQuery", desc="This is my query", fmt="csv"):
         """Define the query.  Multiple definitions are possible, but when run()
-        is invoked, only the last one will be launched."""
-        self.qry_params = urlparse.urlencode({"REQUEST":        "doQuery",
-                                              "LANG":           "ADQL",
-                                              "FORMAT":         "csv",
-                                              "PHASE":          "RUN",
-                                              "JOBNAME":        name,
-                                              "JOBDESCRIPTION": desc,
-                                              "QUERY":          adqlQry})
-        self.request = urlrequest.Request(EAS_Query.EAS_TAP_URL, method="POST")
-        self.request.add_header("Content-type", EAS_Query.Content_Type)
-        self.request.add_header("Accept", EAS_Query.MIME_Text_Plain)
+        is invoked, only the last one will be launched.  The results will be
+        produced by the server in the output format fmt (see Output_Formats)."""
+        qry_params = EAS_Query.query_params(adqlQry, name, desc, fmt)
+        self.clear_results_cache()
+        self.adql = adqlQry
+        self.qry_format = fmt
+        self.qry_params = qry_params
+        self.headers = {"Content-type": EAS_Query.Content_Type,
+                        "Accept":       EAS_Query.MIME_Text_Plain}
+
+    @staticmethod
+    def query_params(adqlQry, name, desc, fmt):
+        """Returns the (URL encoded) parameters of the TAP+ query request."""
+        if fmt not in EAS_Query.Output_Formats:
+            raise ValueError("Unknown output format: {}".format(fmt))
+        return urlparse.urlencode({"REQUEST":        "doQuery",
+                                   "LANG":           "ADQL",
+                                   "FORMAT":         fmt,
+                                   "PHASE":          "RUN",
+                                   "JOBNAME":        name,
+                                   "JOBDESCRIPTION": desc,
+                                   "QUERY":          adqlQry})
 
     def run(self):
-        """Launch the last defined query.  The execution is done in a separate thread."""
-        self.connection = urlrequest.urlopen(self.request, data=self.qry_params.encode("UTF-8"))
-        self.qry_exit_code = self.connection.getcode()
+        """Launch the last defined query.  The job is monitored in the background
+        by the job monitor, without a thread per job: its phase is available
+        when the job_future attribute (a concurrent.futures.Future, whose
+        result is a tuple with the final phase, UWS_Job_Status and number of
+        polls) is done, or after wait_finished()."""
+        self.submit()
+        if not self.cache_hit:
+            if self.monitor is None:
+                self.monitor = default_monitor()
+            self.job_future = self.monitor.watch(self.connection_url, self.fetch_job_document,
+                                                 self.waiter.backoff(), self.waiter.count_poll,
+                                                 self.metrics, 'tap_job')
+            self.job_future.add_done_callback(self.job_finished)
+        return self.qry_exit_code
+
+    def job_finished(self, future):
+        """Takes the final phase of the job from its (done) future."""
+        if future.cancelled():
+            self.phase = 'ABORTED'
+            self.status_info = "Monitoring of the job cancelled"
+        elif future.exception() is not None:
+            self.phase = 'ERROR'
+            self.status_info = str(future.exception())
+        else:
+            self.phase, self.job_status, self.polls = future.result()
+
+    def wait_finished(self, timeout=None):
+        """Waits (at most timeout seconds, if provided) for the job launched
+        with run() to reach a final phase, and returns the phase."""
+        if self.job_future is not None:
+            wait([self.job_future], timeout)
+            if self.job_future.done():
+                self.job_finished(self.job_future)
+        return self.phase
+
+    def submit(self):
+        """Submits the last defined query to the TAP asynchronous endpoint,
+        without monitoring it.  The job must then be monitored with poll().
+        If the results are found in the persistent cache, no job is submitted,
+        and the query is already in the COMPLETED phase."""
+        self.clear_results_cache()
+        self.job_future = None
+        self.phase = None
+        self.job_status = None
+        self.polls = 0
+        self.cache_hit = False
+        if self.disk_cache is not None:
+            self.cache_key = self.disk_cache.key(self.adql, self.qry_format, self.tap_url)
+            if self.disk_cache.lookup(self.cache_key):
+                self.metrics.count('result_cache_hits')
+                self.cache_hit = True
+                self.phase = 'COMPLETED'
+                self.qry_exit_code = 200
+                self.status_info = "Status: 200, Reason: Results found in local cache"
+                return self.qry_exit_code
+            self.metrics.count('result_cache_misses')
+        with self.metrics.timer('tap_submit'):
+            self.connection = self.session.post(self.tap_url,
+                                                data=self.qry_params.encode("UTF-8"),
+                                                headers=self.headers, timeout=self.timeout)
+        self.qry_exit_code = self.connection.status_code
         self.status_info = "Status: {}, Reason: {}".format(str(self.qry_exit_code),
                                                            str(self.connection.reason))
-        self.connection_info = self.connection.info()
-        self.connection_url = self.connection.geturl()
+        self.connection.raise_for_status()
+        self.connection_info = self.connection.headers
+        self.connection_url = self.connection.url
         self.jobid = self.connection_url[self.connection_url.rfind('/') + 1:]
         self.connection.close()
-        self.jobThread = Thread(target=self.runUntilFinished, args=())
-        self.jobThread.start()
         return self.qry_exit_code
 
     def runUntilFinished(self):
-        """Performs the monitoring of the query requested, and retrieves the
-        results for later use."""
-        while True:
-            self.request = urlrequest.Request(self.connection_url, method="GET")
-            self.connection = urlrequest.urlopen(self.request)
-            data = self.connection.read().decode("UTF-8")
-            #print(">>> ",data)
-            # XML response: parse it to obtain the current status
-            dom = parseString(data)
-            #print("[[[{}]]]".format(dom.toprettyxml()))  #### <<<<<====================
-            phaseElement = dom.getElementsByTagName('uws:phase')[0]
-            phaseValueElement = phaseElement.firstChild
-            phase = phaseValueElement.toxml()
-            #print ("Status: " + phase)
-            # Check finished
-            if phase == 'COMPLETED': break
-            # wait and repeat
-            sleep(0.2)
-        self.connection.close()
+        """Performs the monitoring of the query requested, until the job
+        reaches a final phase.  The number of polls made is kept in polls."""
+        self.phase, self.job_status, self.polls = self.waiter.wait(self.connection_url,
+                                                                   self.fetch_job_document,
+                                                                   self.metrics, 'tap_job')
+
+    def poll(self):
+        """Retrieves the current phase of the submitted job, once."""
+        if self.cache_hit:
+            return self.phase
+        data = self.fetch_job_document(self.connection_url)
+        self.polls += 1
+        self.waiter.count_poll()
+        self.metrics.count('tap_job_polls')
+        self.job_status = parse_job(data)
+        self.phase = self.job_status.phase
+        return self.phase
+
+    def fetch_job_document(self, url):
+        """Retrieves the UWS job document (XML) from the given URL."""
+        self.connection = self.session.get(url, timeout=self.timeout)
+        try:
+            self.connection.raise_for_status()
+            return self.connection.text
+        finally:
+            self.connection.close()
 
     def exit_info(self):
-        """Return exit information in case the run() method reported a failure."""
+        """Return exit information in case the run() method reported a failure,
+        or the job finished with an error."""
+        if self.job_status is not None and self.job_status.error_summary:
+            return "{}, Error: {}".format(self.status_info, self.job_status.error_summary)
         return self.status_info
 
     def results(self):
         """Returns the results from the last query executed."""
+        return b''.join(self.results_stream())
+
+    def results_stream(self, chunk_size=None):
+        """Returns an iterator over the results from the last query executed,
+        as chunks of bytes of at most chunk_size bytes, yielded as they are
+        downloaded.  If the results are cached locally (cache_results), they
+        are also stored in a spooled temporary file, that keeps up to
+        Result_Cache_Max_Memory bytes in memory before moving them to disk
+        (see cached_results())."""
+        if chunk_size is None:
+            chunk_size = EAS_Query.Chunk_Size
+        if not self.cache_results:
+            return self.download_results(chunk_size)
+        return self.cached_results(chunk_size)
+
+    def download_results(self, chunk_size):
+        """Downloads the results from the server, chunk by chunk, bypassing
+        the local results cache.  The results are read from the persistent
+        cache if they were found there, or else stored in it as they are
+        downloaded.  The server may send them compressed (see Accept_Encoding):
+        they are decompressed as they arrive.  Raises RuntimeError if the job
+        did not complete successfully."""
+        if self.cache_hit:
+            yield from self.metrics.timed_iter('result_cache_read',
+                                               self.disk_cache.read(self.cache_key, chunk_size),
+                                               'result_cache_read_bytes')
+            return
         # Wait for job to finish
-        self.jobThread.join()
-        # Retrieve and return results data
-        self.request = urlrequest.Request(self.connection_url + "/results/result", method="GET")
-        self.connection = urlrequest.urlopen(self.request)
-        results_data = self.connection.read()
-        self.connection.close()
-        return results_data
-        
+        if self.wait_finished() != 'COMPLETED':
+            raise RuntimeError("No results for job {}, in phase {}. {}"
+                               .format(self.connection_url, self.phase, self.exit_info()))
+        # Retrieve results data, chunk by chunk
+        writer = None
+        self.connection = self.session.get(self.connection_url + "/results/result", stream=True,
+                                           headers={"Accept-Encoding": EAS_Query.Accept_Encoding},
+                                           timeout=self.timeout)
+        try:
+            self.connection.raise_for_status()
+            if self.disk_cache is not None:
+                writer = self.disk_cache.writer(self.cache_key, query=self.adql,
+                                                format=self.qry_format, endpoint=self.tap_url)
+            for chunk in self.metrics.timed_iter('results_download',
+                                                 self.connection.iter_content(chunk_size),
+                                                 'results_download_bytes'):
+                if writer is not None: writer.write(chunk)
+                yield chunk
+            if writer is not None:
+                writer.commit()
+                writer = None
+        finally:
+            if writer is not None: writer.abort()
+            self.connection.close()
+
+    def cached_results(self, chunk_size):
+        """Returns an iterator over the locally cached results.  If they have
+        not been downloaded yet for the current job, the chunks are yielded
+        as they are downloaded, while they are stored in the cache (see
+        _tee_results())."""
+        if self.result_cache is None:
+            return self._tee_results(chunk_size)
+        return self._iter_cache(self.result_cache, chunk_size)
+
+    def _tee_results(self, chunk_size):
+        """Downloads the results, yielding each chunk after writing it to a
+        new spooled temporary file.  The file becomes the local results
+        cache only once the download is complete: if it fails, or the
+        iteration is abandoned, the file is discarded."""
+        cache = tempfile.SpooledTemporaryFile(max_size=EAS_Query.Result_Cache_Max_Memory)
+        try:
+            for chunk in self.download_results(chunk_size):
+                cache.write(chunk)
+                yield chunk
+        except:
+            cache.close()
+            raise
+        if self.result_cache is None:
+            self.result_cache = cache
+        else:
+            cache.close()
+
+    @staticmethod
+    def _iter_cache(cache, chunk_size):
+        """Reads the cache file chunk by chunk, keeping its own offset so that
+        several iterators can be used one after the other."""
+        offset = 0
+        while True:
+            cache.seek(offset)
+            chunk = cache.read(chunk_size)
+            if not chunk: break
+            offset += len(chunk)
+            yield chunk
+
+    def clear_results_cache(self):
+        """Discards the locally cached results of the last job, if any."""
+        if self.result_cache is not None:
+            self.result_cache.close()
+            self.result_cache = None
+
+    def save_results(self, file_name):
+        """Stores the results, in the format produced by the server, in a
+        local file.  The data are written to disk as they arrive."""
+        with open(file_name, "wb") as out_file:
+            for chunk in self.results_stream():
+                out_file.write(chunk)
+
     def save_results_as_csv(self, file_name):
-        """Takes results, already as CSV data, and store them in a local file"""
-        with open(file_name, "wb") as csv_file:
-            # Read the whole file at once
-            csv_file.write(self.results())
+        """Takes results, already as CSV data, and store them in a local file.
+        The data are written to disk as they arrive.  Results produced in any
+        other format are converted to CSV in memory."""
+        if self.qry_format == "csv":
+            self.save_results(file_name)
+        else:
+            self.results_as_table().write(file_name, format="ascii.csv", overwrite=True)
+
+    def iter_results(self, rows_per_chunk=None, dtype=None, as_table=False):
+        """Returns an iterator over the CSV results, parsed from the results
+        stream into NumPy structured arrays (or astropy Tables, if as_table is
+        True) of at most rows_per_chunk rows (Rows_Per_Chunk by default).  The
+        column types are the ones of dtype, if provided, or else the ones
+        inferred from the first chunk, and are the same for all the chunks."""
+        if self.qry_format != "csv":
+            raise ValueError("Results are not in CSV format, but {}".format(self.qry_format))
+        if rows_per_chunk is None:
+            rows_per_chunk = EAS_Query.Rows_Per_Chunk
+        chunks = self.metrics.timed_iter('csv_parse',
+                                         iter_csv_records(self.results_stream(), rows_per_chunk, dtype),
+                                         'csv_parse_rows')
+        if not as_table:
+            return chunks
+        return (Table(records, copy=False) for records in chunks)
 
-    def save_results_as_fits_table(self, file_name, header=None):
+    def results_as_table(self):
+        """Parses the results, in memory, into an astropy Table."""
+        data = self.results()
+        with self.metrics.timer('csv_parse' if self.qry_format == "csv" else 'votable_parse'):
+            return read_table(data, self.qry_format)
+
+    def save_results_as_fits_table(self, file_name, header=None, chunked=False, parallel=False):
         """Takes the CSV results, convert them to an ascii.table.Table and outputs
         a pyfits.hdu.table.BinTableHDU, creating a blank header if no header
-        is provided.  The result is stored in a FITS file."""
-        if header is None:
-            prihdr = fits.Header()
-            prihdu = fits.PrimaryHDU(header=prihdr)
+        is provided.  The result is stored in a FITS file.  In chunked mode,
+        the rows are appended to the FITS table in chunks of Rows_Per_Chunk
+        rows, so that the entire table is never held in memory.  In parallel
+        mode, the CSV results are parsed by a pool of Parse_Processes
+        processes (see results_as_fits_hdulist()).  Results produced by the
+        server already as FITS are stored as they arrive if no header is
+        provided."""
+        if self.qry_format == "fits" and header is None:
+            self.save_results(file_name)
+        elif chunked and self.qry_format == "csv":
+            with self.metrics.timer('fits_build'):
+                write_fits_chunked(self.iter_results(), file_name, header)
         else:
-            prihdu = fits.PrimaryHDU(header=header)
+            hdulist = self.results_as_fits_hdulist(header, parallel)
+            with self.metrics.timer('fits_write'):
+                hdulist.writeto(file_name, overwrite=True)
 
-        csv_file_name = file_name + ".csv"
-        self.save_results_as_csv(csv_file_name)
-        tab = ascii.read(csv_file_name)
-        os.unlink(csv_file_name)
+    def results_as_fits_hdulist(self, header=None, parallel=False):
+        """Converts the results, in memory, into a FITS HDUList with a
+        primary HDU (with a blank header if no header is provided) and a
+        binary table.  Results produced by the server already as FITS are
+        not converted, but their primary header is updated with header.
+        In parallel mode, CSV results are stored in a temporary file, whose
+        byte ranges are parsed by a pool of Parse_Processes processes (see
+        csv_to_hdulist_parallel())."""
+        if self.qry_format == "fits":
+            return fits_to_hdulist(self.results(), header)
+        if self.qry_format == "csv" and parallel:
+            csv_file = tempfile.NamedTemporaryFile(suffix=".csv", delete=False)
+            try:
+                # The file is closed before the processes open it by name
+                with csv_file:
+                    for chunk in self.results_stream():
+                        csv_file.write(chunk)
+                with self.metrics.timer('fits_build'):
+                    return csv_to_hdulist_parallel(csv_file.name, header,
+                                                   EAS_Query.Parse_Processes)
+            finally:
+                os.unlink(csv_file.name)
+        if self.qry_format == "csv":
+            data = self.results()
+            with self.metrics.timer('fits_build'):
+                return csv_to_hdulist(data, header)
+        table = self.results_as_table()
+        with self.metrics.timer('fits_build'):
+            return table_to_hdulist(table, header)
 
-        table_hdu = fits.BinTableHDU.from_columns(np.array(tab.filled()))
-        myfitstable = fits.HDUList([prihdu, table_hdu])
-        myfitstable.writeto(file_name, overwrite=True)
+    def results_as_fits_buffer(self, header=None, chunked=False, parallel=False):
+        """Returns the results as a FITS file in a binary file object,
+        rewound to its start, that can be uploaded directly.  In chunked
+        mode, the buffer is a temporary file on disk."""
+        if self.qry_format == "fits" and header is None:
+            return io.BytesIO(self.results())
+        if not chunked:
+            return hdulist_to_buffer(self.results_as_fits_hdulist(header, parallel))
+        buf = tempfile.TemporaryFile()
+        self.save_results_as_fits_table(buf, header, chunked=True)
+        buf.seek(0)
+        return buf
 
-    def results_as_fits_table(self, header=None):
-        """Takes the CSV results, saves them in a temp. dile, and then retrieves
-        the entire content."""
-        tmpfile = tempfile.NamedTemporaryFile(delete=False)
-        self.save_results_as_fits_table(tmpfile.name)
+    def results_as_fits_file(self, file_name=None, header=None, chunked=False, parallel=False):
+        """Stores the results as a FITS file, and returns its path.  If no file
+        name is provided, a temporary file is created (to be removed by the
+        caller)."""
+        if file_name is None:
+            fd, file_name = tempfile.mkstemp(suffix=".fits")
+            os.close(fd)
+        self.save_results_as_fits_table(file_name, header, chunked, parallel)
+        return file_name
 
-        with open(tmpfile.name, "rb") as fits_file:
-            # Read the whole file at once
-            fits_data = fits_file.read()
+    def results_as_fits_mmap(self, header=None, chunked=False, parallel=False):
+        """Returns the results as a FITS file mapped (read-only) in memory, so
+        that its content is not copied into the Python heap.  The mmap object
+        can be passed directly as content to VOSpace_Handler.save_to_file(),
+        and must be closed when no longer needed."""
+        file_name = self.results_as_fits_file(None, header, chunked, parallel)
+        try:
+            with open(file_name, "rb") as fits_file:
+                return mmap.mmap(fits_file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            os.unlink(file_name)
 
-        os.unlink(tmpfile.name)
-        return fits_data
+    def save_results_to_vospace(self, vos, folder, file, as_fits=False, header=None,
+                                user=None, pwd=None, progress=None, compress=False):
+        """Stores the results in a VOSpace folder/file, using the VOSpace_Handler
+        vos, streaming the results body directly into the upload: the download
+        runs in a separate thread, up to Prefetch_Chunks chunks ahead of the
+        upload, and the results are not stored locally (unless they are already
+        cached).  If as_fits is True, the results are stored as a FITS file:
+        this is done on the fly if the server produced them as FITS (see
+        setQuery()), otherwise the chunked conversion needs a local temporary
+        file, that is uploaded from a memory map.  If compress is True, the
+        file is compressed on the fly in gzip format (see save_to_file() in
+        VOSpace_Handler)."""
+        if as_fits and (self.qry_format != "fits" or header is not None):
+            with self.results_as_fits_mmap(header, chunked=self.qry_format == "csv") as fits_map:
+                return vos.save_to_file(folder, file, fits_map, user, pwd, progress,
+                                        compress=compress)
+        if self.result_cache is not None or not self.cache_results:
+            chunks = self.results_stream()
+        else:
+            chunks = self.download_results(EAS_Query.Chunk_Size)
+        return vos.save_to_file(folder, file, prefetch(chunks, EAS_Query.Prefetch_Chunks),
+                                user, pwd, progress, compress=compress)
+
+    def results_as_fits_table(self, header=None):
+        """Returns the entire content of the results as a FITS file."""
+        return self.results_as_fits_buffer(header).getvalue()
 
 
 def main():
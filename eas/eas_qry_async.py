@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Async_EAS_Query class from package eas
+
+This module provides an asyncio counterpart of the EAS_Query class, to
+perform asynchronous queries to the archives via TAP+ interface from an
+event loop, without blocking it.  Many queries can be in flight at the
+same time, all of them monitored (with non-blocking polling) from the
+same event loop.
+
+This module requires the ``aiohttp`` package.
+
+Usage:
+    The sequence of commands to perform a query would be
+     1. Create the Async_EAS_Query object (inside a coroutine)
+     2. Define the query with the ``setQuery()`` method
+     3. Await the ``run()`` method, that submits the job and starts
+        its monitoring as an asyncio task
+     4. Await the ``results()`` method, or iterate asynchronously over
+        the ``results_stream()`` method
+     5. Await the ``close()`` method (or use ``async with``)
+
+    For example::
+
+        async with Async_EAS_Query() as qry:
+            qry.setQuery(adqlQry=adql)
+            await qry.run()
+            await qry.save_results_as_csv("results.csv")
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from eas.eas_qry import EAS_Query
+from uws.uws_job import UWS_Job_Waiter
+
+import asyncio
+import aiohttp
+
+
+class Async_EAS_Query(object):
+    """
+    Main class to encapsulate query jobs for EAS, for asyncio clients
+    """
+
+    def __init__(self, waiter=None, session=None, tap_url=None):
+        """Initialize object (class instance) attributes.  The HTTP requests
+        are made through the provided aiohttp.ClientSession (that can be
+        shared by many queries), or through a session owned by the object,
+        created when first needed and closed by close().  The queries are
+        sent to tap_url (EAS_Query.EAS_TAP_URL by default)."""
+        self.tap_url = tap_url if tap_url is not None else EAS_Query.EAS_TAP_URL
+        self.qry_params = None
+        self.qry_format = "csv"
+        self.headers = None
+        self.status_info = ""
+        self.jobTask = None
+
+        self.waiter = waiter if waiter is not None else UWS_Job_Waiter()
+        self.phase = None
+        self.job_status = None
+        self.polls = 0
+
+        self.session = session
+        self.own_session = session is None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def get_session(self):
+        """Returns the HTTP session, creating it if needed."""
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    async def close(self):
+        """Closes the HTTP session, if it is owned by the object."""
+        if self.own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def setQuery(self, adqlQry, name="myQuery", desc="This is my query", fmt="csv"):
+        """Define the query.  Multiple definitions are possible, but when run()
+        is invoked, only the last one will be launched.  The results will be
+        produced by the server in the output format fmt (see
+        EAS_Query.Output_Formats)."""
+        self.qry_params = EAS_Query.query_params(adqlQry, name, desc, fmt)
+        self.qry_format = fmt
+        self.headers = {"Content-type": EAS_Query.Content_Type,
+                        "Accept":       EAS_Query.MIME_Text_Plain}
+
+    async def run(self):
+        """Launch the last defined query.  Its monitoring is done in a separate
+        asyncio task."""
+        await self.submit()
+        self.jobTask = asyncio.ensure_future(self.runUntilFinished())
+        return self.qry_exit_code
+
+    async def submit(self):
+        """Submits the last defined query to the TAP asynchronous endpoint,
+        without monitoring it."""
+        self.jobTask = None
+        self.phase = None
+        self.job_status = None
+        self.polls = 0
+        async with self.get_session().post(self.tap_url,
+                                           data=self.qry_params.encode("UTF-8"),
+                                           headers=self.headers) as response:
+            self.qry_exit_code = response.status
+            self.status_info = "Status: {}, Reason: {}".format(str(self.qry_exit_code),
+                                                               str(response.reason))
+            response.raise_for_status()
+            self.connection_url = str(response.url)
+        self.jobid = self.connection_url[self.connection_url.rfind('/') + 1:]
+        return self.qry_exit_code
+
+    async def runUntilFinished(self):
+        """Performs the monitoring of the query requested, until the job
+        reaches a final phase."""
+        self.phase, self.job_status, self.polls = await self.waiter.wait_async(
+            self.connection_url, self.fetch_job_document)
+        return self.phase
+
+    async def fetch_job_document(self, url):
+        """Retrieves the UWS job document (XML) from the given URL."""
+        async with self.get_session().get(url) as response:
+            response.raise_for_status()
+            return await response.text()
+
+    def exit_info(self):
+        """Return exit information in case the run() method reported a failure,
+        or the job finished with an error."""
+        if self.job_status is not None and self.job_status.error_summary:
+            return "{}, Error: {}".format(self.status_info, self.job_status.error_summary)
+        return self.status_info
+
+    async def results_stream(self, chunk_size=None):
+        """Asynchronous iterator over the results from the last query executed,
+        as chunks of bytes of at most chunk_size bytes.  Raises RuntimeError
+        if the job did not complete successfully."""
+        if chunk_size is None:
+            chunk_size = EAS_Query.Chunk_Size
+        # Wait for job to finish
+        if self.jobTask is not None:
+            await self.jobTask
+        if self.phase != 'COMPLETED':
+            raise RuntimeError("No results for job {}, in phase {}. {}"
+                               .format(self.connection_url, self.phase, self.exit_info()))
+        async with self.get_session().get(self.connection_url + "/results/result") as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(chunk_size):
+                yield chunk
+
+    async def results(self):
+        """Returns the results from the last query executed."""
+        return b''.join([chunk async for chunk in self.results_stream()])
+
+    async def save_results(self, file_name):
+        """Stores the results, in the format produced by the server, in a
+        local file.  The data are written to disk as they arrive, in a
+        worker thread, so that the event loop is not blocked."""
+        with open(file_name, "wb") as out_file:
+            async for chunk in self.results_stream():
+                await asyncio.to_thread(out_file.write, chunk)
+
+    async def save_results_as_csv(self, file_name):
+        """Takes results, already as CSV data, and store them in a local file."""
+        if self.qry_format != "csv":
+            raise ValueError("Results are not in CSV format, but {}".format(self.qry_format))
+        await self.save_results(file_name)
+
+
+def main():
+    """Sample usage of the Async_EAS_Query class"""
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""EAS_Result_Cache class from package eas
+
+This module provides a persistent (on disk) cache of query results, keyed
+by the normalized ADQL query text, the output format and the TAP endpoint,
+so that repeated queries are answered from local disk without running a
+new TAP+ job.  The results are stored gzip-compressed, and the cache is
+limited both in time (TTL) and in size (least recently used entries are
+evicted first).
+
+Usage:
+    The cache is opt-in: create an EAS_Result_Cache object and pass it to
+    the EAS_Query constructor::
+
+        cache = EAS_Result_Cache(ttl=3600, max_bytes=10 * 1024**3)
+        easHdl = EAS_Query(result_cache=cache)
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from time import time
+
+import gzip, hashlib, json, os, re, tempfile
+
+String_Literal_Regex = re.compile(r"('(?:[^']|'')*')")
+
+
+def normalize_query(adqlQry):
+    """Returns the query with white space collapsed and stripped, and without
+    trailing semicolons (string literals are kept untouched)."""
+    parts = String_Literal_Regex.split(adqlQry)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r'\s+', ' ', parts[i])
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+class EAS_Result_Cache(object):
+    """
+    Persistent cache of query results, with TTL and LRU size-based eviction
+    """
+
+    Default_Directory = os.path.join(os.path.expanduser('~'), '.cache', 'eas_results')
+
+    def __init__(self, directory=None, ttl=24 * 3600, max_bytes=1024 ** 3, compresslevel=6):
+        """Initialize object (class instance) attributes.  Entries older than
+        ttl seconds are discarded, and the least recently used ones are
+        evicted when the total size exceeds max_bytes."""
+        self.directory = directory if directory is not None else EAS_Result_Cache.Default_Directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compresslevel = compresslevel
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(adqlQry, fmt, endpoint):
+        """Returns the cache key for a query, output format and TAP endpoint."""
+        text = "\n".join([normalize_query(adqlQry), fmt, endpoint])
+        return hashlib.sha256(text.encode("UTF-8")).hexdigest()
+
+    def data_path(self, key):
+        return os.path.join(self.directory, key + '.gz')
+
+    def meta_path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def lookup(self, key):
+        """Returns True if there is a valid entry for the key, marking it as
+        recently used.  Expired entries are removed."""
+        try:
+            with open(self.meta_path(key)) as meta_file:
+                created = json.load(meta_file)['created']
+        except (OSError, ValueError, KeyError):
+            return False
+        if time() - created > self.ttl:
+            self.remove(key)
+            return False
+        try:
+            os.utime(self.data_path(key))
+        except OSError:
+            return False
+        return True
+
+    def read(self, key, chunk_size):
+        """Returns an iterator over the (uncompressed) results of the entry,
+        as chunks of bytes."""
+        with gzip.open(self.data_path(key), 'rb') as data_file:
+            while True:
+                chunk = data_file.read(chunk_size)
+                if not chunk: break
+                yield chunk
+
+    def writer(self, key, **meta):
+        """Returns a new EAS_Result_Cache_Writer to store the results for the
+        key; meta are stored with the entry, for information."""
+        return EAS_Result_Cache_Writer(self, key, meta)
+
+    def remove(self, key):
+        """Removes the entry for the key, if present."""
+        for path in (self.data_path(key), self.meta_path(key)):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def evict(self):
+        """Removes expired entries, and then the least recently used ones,
+        until the total size of the cache is below max_bytes."""
+        entries = []
+        now = time()
+        for name in os.listdir(self.directory):
+            if not name.endswith('.gz'): continue
+            key = name[:-3]
+            try:
+                stat = os.stat(self.data_path(key))
+                with open(self.meta_path(key)) as meta_file:
+                    created = json.load(meta_file)['created']
+            except (OSError, ValueError, KeyError):
+                self.remove(key)
+                continue
+            if now - created > self.ttl:
+                self.remove(key)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, key))
+        total = sum(size for mtime, size, key in entries)
+        for mtime, size, key in sorted(entries):
+            if total <= self.max_bytes: break
+            self.remove(key)
+            total -= size
+
+    def clear(self):
+        """Removes all the entries."""
+        for name in os.listdir(self.directory):
+            if name.endswith('.gz'):
+                self.remove(name[:-3])
+
+
+class EAS_Result_Cache_Writer(object):
+    """
+    Stores the results of a query in the cache, chunk by chunk, as they are
+    downloaded.  The entry is only made visible by commit().
+    """
+
+    def __init__(self, cache, key, meta):
+        """Initialize object (class instance) attributes."""
+        self.cache = cache
+        self.key = key
+        self.meta = meta
+        self.tmp_file = tempfile.NamedTemporaryFile(dir=cache.directory, prefix='.' + key,
+                                                    suffix='.part', delete=False)
+        self.gz_file = gzip.GzipFile(fileobj=self.tmp_file, mode='wb',
+                                     compresslevel=cache.compresslevel)
+
+    def write(self, chunk):
+        self.gz_file.write(chunk)
+
+    def commit(self):
+        """Completes the entry, and evicts old entries if needed."""
+        self.gz_file.close()
+        self.tmp_file.close()
+        os.replace(self.tmp_file.name, self.cache.data_path(self.key))
+        self.meta['created'] = time()
+        with open(self.cache.meta_path(self.key), 'w') as meta_file:
+            json.dump(self.meta, meta_file)
+        self.cache.evict()
+
+    def abort(self):
+        """Discards the partially written entry."""
+        self.gz_file.close()
+        self.tmp_file.close()
+        os.unlink(self.tmp_file.name)
@@ -23,6 +23,7 @@ def main():
     - run queries
     - store csv and fits files in VOSpace
     - retrieve an entire folder from VOSpace
+    - mirror a folder from VOSpace into a local folder
     """
 
     # Define query and request parameters
@@ -57,9 +58,8 @@ def main():
     vos = VOSpace_Handler()
     folder = 'queries'
     file_name = 'my_query_results.csv'
-    if not vos.save_to_file(folder=folder, file=file_name,
-                            content=easHdl.results(),
-                            user=user, pwd=pwd):
+    if not easHdl.save_results_to_vospace(vos, folder=folder, file=file_name,
+                                          user=user, pwd=pwd):
         print("ERROR while storing query results in VOSpace")
         sys.exit(2)
 
@@ -88,6 +88,13 @@ def main():
 
     print("- Folder '{}' from VOSpace retrieved as file '{}'".format(folder, zip_file))
 
+    # Mirror the folder 'queries' file by file (only the files that changed
+    # since the last run are downloaded)
+    mirrored = vos.mirror_folder(folder=folder, local_dir=folder, user=user, pwd=pwd)
+
+    print("- Folder '{}' from VOSpace mirrored in local folder '{}' ({} files downloaded)".format(
+        folder, folder, sum(1 for result in mirrored.values() if result is True)))
+
 
 if __name__ == '__main__':
     main()
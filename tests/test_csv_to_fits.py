@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests of the CSV to FITS conversion functions
+
+Usage:
+    From the top folder of the repository::
+
+        $ python -m pytest tests
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from astropy.io import fits
+from bench.mock_server import csv_rows_for_size, iter_csv
+from eas.csv_to_fits import (Parallel_Min_Size, csv_to_hdulist, csv_to_hdulist_parallel,
+                             iter_csv_records, write_fits_chunked)
+
+import io, os, subprocess, sys, tempfile, unittest
+import numpy as np
+
+
+# Converts size bytes of the mock CSV results in chunked mode to /dev/null,
+# and prints the peak RSS of the process (in KB on Linux, bytes on macOS)
+Chunked_RSS_Script = """
+import os, resource, sys
+from bench.mock_server import csv_rows_for_size, iter_csv
+from bench.mock_server import csv_rows_for_size, iter_csv
+from eas.csv_to_fits import (Parallel_Min_Size, csv_to_hdulist, csv_to_hdulist_parallel,
+                             iter_csv_records, write_fits_chunked)
+rows = csv_rows_for_size(int(sys.argv[1]))
+with open(os.devnull, 'wb') as out:
+    write_fits_chunked(iter_csv_records(iter_csv(rows), 20000), out)
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def sparse_csv():
+    """CSV data whose column types change after the first chunk of 10 rows:
+    mag is all NULL, then float; cnt is integer, then float; tag is
+    integer, then a string."""
+    rows = [b'id,mag,cnt,tag\n']
+    for i in range(30):
+        mag = b'' if i < 10 else b'%.1f' % (i + 0.5)
+        cnt = b'%d' % i if i < 10 else b'%.1f' % (i + 0.5) if i % 2 else b''
+        tag = b'abc' if i == 25 else b'%d' % i
+        rows.append(b'%d,%s,%s,%s\n' % (i, mag, cnt, tag))
+    data = b''.join(rows)
+    return [data[pos:pos + 37] for pos in range(0, len(data), 37)]
+
+
+class Test_CSV_Chunked(unittest.TestCase):
+
+    def test_iter_csv_records_promotion(self):
+        records = list(iter_csv_records(iter(sparse_csv()), 10))
+        self.assertEqual(sum(len(chunk) for chunk in records), 30)
+        self.assertEqual(records[0].dtype['mag'].kind, 'i')
+        self.assertEqual(records[-1].dtype['mag'].kind, 'f')
+        self.assertEqual(records[-1].dtype['cnt'].kind, 'f')
+        self.assertEqual(records[-1].dtype['tag'].kind, 'U')
+
+    def test_write_fits_chunked_promotion(self):
+        buf = io.BytesIO()
+        write_fits_chunked(iter_csv_records(iter(sparse_csv()), 10), buf)
+        buf.seek(0)
+        with fits.open(buf) as hdul:
+            data = hdul[1].data
+            self.assertEqual(len(data), 30)
+            self.assertTrue(np.isnan(data['mag'][:10]).all())
+            self.assertEqual(data['mag'][29], 29.5)
+            self.assertEqual(list(data['cnt'][:10]), list(range(10)))
+            self.assertTrue(np.isnan(data['cnt'][10]))
+            self.assertEqual(data['cnt'][11], 11.5)
+            self.assertEqual(data['tag'][3], '3')
+            self.assertEqual(data['tag'][25], 'abc')
+            self.assertEqual(list(data['id']), list(range(30)))
+
+    @unittest.skipIf(sys.platform.startswith('win'), "needs the resource module")
+    def test_chunked_memory_is_flat(self):
+        """The peak RSS of the chunked conversion must not grow with the size
+        of the results (only one chunk of rows is held in memory)."""
+        def peak_rss(size):
+            out = subprocess.run([sys.executable, '-c', Chunked_RSS_Script,
+                                  str(size)], check=True, capture_output=True,
+                                 cwd=os.path.dirname(os.path.dirname(
+                                     os.path.abspath(__file__))))
+            rss = int(out.stdout.split()[-1])
+            return rss if sys.platform == 'darwin' else rss * 1024
+        small, large = peak_rss(4 << 20), peak_rss(40 << 20)
+        self.assertLess(large - small, 32 << 20)
+
+
+class Test_CSV_Parallel(unittest.TestCase):
+
+    def test_csv_to_hdulist_parallel(self):
+        # The byte ranges of a CSV file are parsed by processes started with
+        # Parallel_Start_Method, into the same table as in a single process
+        data = b''.join(iter_csv(csv_rows_for_size(Parallel_Min_Size + 4096)))
+        fd, file_name = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'wb') as csv_file:
+            csv_file.write(data)
+        self.addCleanup(os.unlink, file_name)
+        parallel = csv_to_hdulist_parallel(file_name, processes=2)[1].data
+        serial = csv_to_hdulist(data)[1].data
+        self.assertEqual(len(parallel), len(serial))
+        self.assertEqual(parallel.dtype.names, serial.dtype.names)
+        for name in serial.dtype.names:
+            self.assertTrue(np.array_equal(parallel[name], serial[name]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests of the query partitioning functions of the eas_partition module
+
+Usage:
+    From the top folder of the repository::
+
+        $ python -m pytest tests
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from bench.mock_server import Mock_Server
+from eas.eas_partition import (EAS_Partitioned_Query, add_constraint,
+                               order_by_columns, tile_constraints)
+from uws.uws_job import UWS_Job_Waiter
+
+import unittest
+
+
+class Test_Partition_Query(unittest.TestCase):
+
+    def test_add_constraint(self):
+        self.assertEqual(add_constraint("SELECT * FROM t", 'TILE'),
+                         "SELECT * FROM t WHERE TILE")
+        self.assertEqual(add_constraint("SELECT * FROM t;", 'TILE'),
+                         "SELECT * FROM t WHERE TILE;")
+        self.assertEqual(add_constraint("SELECT * FROM t ORDER BY a", 'TILE'),
+                         "SELECT * FROM t WHERE TILE ORDER BY a")
+        self.assertEqual(add_constraint("SELECT * FROM t WHERE a > 1 OR b < 2", 'TILE'),
+                         "SELECT * FROM t WHERE TILE AND (a > 1 OR b < 2)")
+        self.assertEqual(add_constraint("SELECT * FROM t where a > 1 ORDER BY a;", 'TILE'),
+                         "SELECT * FROM t where TILE AND (a > 1) ORDER BY a;")
+        self.assertEqual(add_constraint("SELECT * FROM t WHERE {tile} OR a = 1", 'TILE'),
+                         "SELECT * FROM t WHERE TILE OR a = 1")
+
+    def test_tile_constraints(self):
+        constraints = tile_constraints('ra', 'dec', (10.0, 30.0), (-10.0, 10.0), 2, 2)
+        self.assertEqual(constraints, [
+            "(ra >= 10.0 AND ra < 20.0 AND dec >= -10.0 AND dec < 0.0)",
+            "(ra >= 20.0 AND ra <= 30.0 AND dec >= -10.0 AND dec < 0.0)",
+            "(ra >= 10.0 AND ra < 20.0 AND dec >= 0.0 AND dec <= 10.0)",
+            "(ra >= 20.0 AND ra <= 30.0 AND dec >= 0.0 AND dec <= 10.0)"])
+
+    def test_tile_constraints_ra_wrap(self):
+        # Tiles crossing RA=0 are wrapped around it, and ranges of 360
+        # degrees or more are the whole [0, 360] range
+        self.assertEqual(tile_constraints('ra', 'dec', (-10.0, 10.0), (0.0, 1.0), 1, 1),
+                         ["((ra >= 350.0 OR ra <= 10.0) AND dec >= 0.0 AND dec <= 1.0)"])
+        self.assertEqual(tile_constraints('ra', 'dec', (355.0, 375.0), (0.0, 1.0), 2, 1),
+                         ["((ra >= 355.0 OR ra < 5.0) AND dec >= 0.0 AND dec <= 1.0)",
+                          "(ra >= 5.0 AND ra <= 15.0 AND dec >= 0.0 AND dec <= 1.0)"])
+        self.assertEqual(tile_constraints('ra', 'dec', (-5.0, 400.0), (0.0, 1.0), 1, 1),
+                         ["(ra >= 0.0 AND ra <= 360.0 AND dec >= 0.0 AND dec <= 1.0)"])
+
+    def test_order_by_columns(self):
+        self.assertEqual(order_by_columns("SELECT * FROM t"), [])
+        self.assertEqual(order_by_columns('SELECT * FROM t ORDER BY t.mag DESC, "Dec" asc, ra;'),
+                         [('mag', True), ('Dec', False), ('ra', False)])
+
+    def test_not_partitionable(self):
+        for adql in ("SELECT COUNT(*) FROM t",
+                     "SELECT a, sum (b) FROM t GROUP BY a",
+                     "SELECT a FROM t GROUP BY a HAVING a > 1",
+                     "SELECT DISTINCT a FROM t",
+                     "SELECT DISTINCT TOP 10 a FROM t ORDER BY a"):
+            with self.assertRaises(ValueError):
+                EAS_Partitioned_Query(adql, 'ra', 'dec', (0, 10), (0, 10))
+
+    def test_keywords_in_literals(self):
+        adql = "SELECT * FROM t WHERE b = 'ORDER BY x' ORDER BY mag DESC"
+        self.assertEqual(add_constraint(adql, 'TILE'),
+                         "SELECT * FROM t WHERE TILE AND (b = 'ORDER BY x') ORDER BY mag DESC")
+        self.assertEqual(order_by_columns(adql), [('mag', True)])
+        self.assertEqual(order_by_columns("SELECT * FROM t WHERE b = 'ORDER BY x'"), [])
+        self.assertEqual(add_constraint("SELECT * FROM t WHERE b = 'x WHERE {tile}'", 'TILE'),
+                         "SELECT * FROM t WHERE TILE AND (b = 'x WHERE {tile}')")
+        qry = EAS_Partitioned_Query("SELECT * FROM t WHERE s = 'count(x) GROUP BY'",
+                                    'ra', 'dec', (0, 10), (0, 10))
+        self.assertEqual(len(qry.sub_queries), 4)
+
+
+class Test_EAS_Partitioned_Query(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Mock_Server()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def test_results_stream_merge(self):
+        # The mock server returns the same rows (sorted by source_id) for
+        # each of the 4 tiles: the merge keeps them sorted, and TOP applies
+        # to the merged rows
+        qry = EAS_Partitioned_Query("SELECT TOP 100 * FROM t ORDER BY source_id",
+                                    'ra', 'dec', (0.0, 10.0), (0.0, 10.0),
+                                    waiter=UWS_Job_Waiter(initial_delay=0.01),
+                                    tap_url=self.server.tap_url)
+        qry.run()
+        self.assertTrue(all(not tile.cache_results for tile in qry.tiles))
+        lines = qry.results().splitlines()
+        self.assertEqual(lines[0], b'source_id,ra,dec,flux_g,flux_r,flag')
+        ids = [int(line.split(b',')[0]) for line in lines[1:]]
+        self.assertEqual(ids, sorted(list(range(25)) * 4))
+        self.assertTrue(all(tile.result_cache is None for tile in qry.tiles))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
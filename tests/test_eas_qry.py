@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests of the EAS_Query class, against the local stand-in services of
+bench.mock_server
+
+Usage:
+    From the top folder of the repository::
+
+        $ python -m pytest tests
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from bench.mock_server import Mock_Server, csv_size
+from eas.eas_qry import EAS_Query
+from eas.eas_qry_async import Async_EAS_Query
+from uws.uws_job import UWS_Job_Waiter
+
+import asyncio, os, requests, tempfile, unittest
+
+
+class Test_EAS_Query(unittest.TestCase):
+
+    Rows = 20000
+
+    def setUp(self):
+        self.server = Mock_Server()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def finished_query(self, adql=None, fmt="csv", **kwargs):
+        qry = EAS_Query(waiter=UWS_Job_Waiter(initial_delay=0.01),
+                        tap_url=self.server.tap_url, **kwargs)
+        qry.setQuery(adql or "SELECT TOP {} * FROM test".format(Test_EAS_Query.Rows), fmt=fmt)
+        qry.run()
+        qry.wait_finished()
+        return qry
+
+    def downloads(self, qry):
+        return qry.metrics.snapshot()['timers']['results_download']['count']
+
+    def test_results_stream_tee(self):
+        # The first chunks are yielded before the whole results are
+        # downloaded, and the next streams are served from the local cache
+        qry = self.finished_query()
+        stream = qry.results_stream(4096)
+        first = next(stream)
+        self.assertEqual(len(first), 4096)
+        self.assertIsNone(qry.result_cache)
+        data = first + b''.join(stream)
+        self.assertEqual(len(data), csv_size(Test_EAS_Query.Rows))
+        self.assertIsNotNone(qry.result_cache)
+        self.assertEqual(qry.results(), data)
+        self.assertEqual(self.downloads(qry), 1)
+
+    def test_results_stream_abandoned(self):
+        # An incomplete download is not kept as the local cache
+        qry = self.finished_query()
+        stream = qry.results_stream(4096)
+        next(stream)
+        stream.close()
+        self.assertIsNone(qry.result_cache)
+        self.assertEqual(len(qry.results()), csv_size(Test_EAS_Query.Rows))
+        self.assertEqual(self.downloads(qry), 2)
+
+    def test_results_as_fits_hdulist_parallel(self):
+        qry = self.finished_query()
+        hdulist = qry.results_as_fits_hdulist(parallel=True)
+        self.assertEqual(len(hdulist[1].data), Test_EAS_Query.Rows)
+        self.assertEqual(list(hdulist[1].data['source_id'][:3]), [0, 1, 2])
+
+    def test_results_failed_job(self):
+        # The mock server fails the jobs with other formats than CSV: no
+        # results are requested, and the error of the job is reported
+        qry = self.finished_query(fmt="votable")
+        self.assertEqual(qry.phase, 'ERROR')
+        with self.assertRaises(RuntimeError) as raised:
+            qry.results()
+        self.assertIn("not supported by the mock server", str(raised.exception))
+        self.assertNotIn('results_download', qry.metrics.snapshot()['timers'])
+
+    def test_async_save_results(self):
+        async def save(file_name):
+            async with Async_EAS_Query(waiter=UWS_Job_Waiter(initial_delay=0.01),
+                                       tap_url=self.server.tap_url) as qry:
+                qry.setQuery("SELECT TOP {} * FROM test".format(Test_EAS_Query.Rows))
+                await qry.run()
+                await qry.save_results_as_csv(file_name)
+        fd, file_name = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        self.addCleanup(os.unlink, file_name)
+        asyncio.run(save(file_name))
+        self.assertEqual(os.path.getsize(file_name), csv_size(Test_EAS_Query.Rows))
+
+    def test_async_results_failed_job(self):
+        async def results():
+            async with Async_EAS_Query(waiter=UWS_Job_Waiter(initial_delay=0.01),
+                                       tap_url=self.server.tap_url) as qry:
+                qry.setQuery("SELECT TOP 10 * FROM test", fmt="votable")
+                await qry.run()
+                return await qry.results()
+        with self.assertRaises(RuntimeError) as raised:
+            asyncio.run(results())
+        self.assertIn("in phase ERROR", str(raised.exception))
+        self.assertIn("not supported by the mock server", str(raised.exception))
+
+
+class Test_EAS_Query_Timeout(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Mock_Server(latency=1.0)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def test_request_timeout(self):
+        # A server that does not respond makes the request fail, instead of
+        # blocking it indefinitely
+        qry = EAS_Query(tap_url=self.server.tap_url, timeout=(1.0, 0.1))
+        qry.setQuery("SELECT TOP 10 * FROM test")
+        with self.assertRaises(requests.exceptions.Timeout):
+            qry.run()
+        with self.assertRaises(requests.exceptions.Timeout):
+            qry.fetch_job_document(self.server.tap_url + '/q1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests of the UWS_Job_Monitor class
+
+Usage:
+    From the top folder of the repository::
+
+        $ python -m pytest tests
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from time import sleep
+from bench.mock_server import Job_Document
+from uws.job_monitor import UWS_Job_Monitor
+from uws.metrics import Metrics
+from uws.retry import Retry_Policy
+
+import requests, unittest
+
+
+def job_document(phase):
+    return Job_Document.format(job_id='j1', phase=phase, error='', results='')
+
+
+class Fake_Job(object):
+    """
+    Job document source: returns (or raises) the given outcomes in order,
+    repeating the last one
+    """
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.polls = 0
+
+    def fetch(self, url):
+        outcome = self.outcomes[min(self.polls, len(self.outcomes) - 1)]
+        self.polls += 1
+        if isinstance(outcome, Exception):
+            raise outcome
+        return job_document(outcome)
+
+
+class Test_UWS_Job_Monitor(unittest.TestCase):
+
+    def setUp(self):
+        self.monitor = UWS_Job_Monitor(initial_delay=0.01, max_delay=0.01,
+                                       retry=Retry_Policy(max_attempts=3, initial_delay=0.01))
+        self.addCleanup(self.monitor.shutdown)
+
+    def test_completed(self):
+        job = Fake_Job('QUEUED', 'EXECUTING', 'COMPLETED')
+        phase, status, polls = self.monitor.watch('url', job.fetch).result(timeout=5)
+        self.assertEqual((phase, status.phase, polls), ('COMPLETED', 'COMPLETED', 3))
+
+    def test_transient_errors_retried(self):
+        job = Fake_Job(requests.ConnectionError("down"), requests.Timeout("slow"), 'COMPLETED')
+        metrics = Metrics()
+        future = self.monitor.watch('url', job.fetch, metrics=metrics, label='tap_job')
+        self.assertEqual(future.result(timeout=5)[0], 'COMPLETED')
+        self.assertEqual(metrics.snapshot()['counters']['tap_job_poll_retries'], 2)
+
+    def test_retries_exhausted(self):
+        job = Fake_Job(requests.ConnectionError("down"))
+        future = self.monitor.watch('url', job.fetch)
+        self.assertIsInstance(future.exception(timeout=5), requests.ConnectionError)
+        self.assertEqual(job.polls, 3)
+
+    def test_permanent_error(self):
+        job = Fake_Job(ValueError("bad job document"))
+        future = self.monitor.watch('url', job.fetch)
+        self.assertIsInstance(future.exception(timeout=5), ValueError)
+        self.assertEqual(job.polls, 1)
+
+    def test_cancel(self):
+        # A cancelled job is no longer polled
+        job = Fake_Job('EXECUTING')
+        future = self.monitor.watch('url', job.fetch)
+        sleep(0.05)
+        self.assertTrue(future.cancel())
+        sleep(0.05)
+        polls = job.polls
+        sleep(0.1)
+        self.assertEqual(job.polls, polls)
+        self.assertEqual(self.monitor.pending(), 0)
+
+    def test_shutdown(self):
+        future = self.monitor.watch('url', Fake_Job('EXECUTING').fetch)
+        self.monitor.shutdown()
+        self.assertTrue(future.cancelled())
+        with self.assertRaises(RuntimeError):
+            self.monitor.watch('url', Fake_Job('EXECUTING').fetch)
+
+
+if __name__ == '__main__':
+    unittest.main()
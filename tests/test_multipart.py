@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests of the streaming multipart/form-data body of the vos package
+
+Usage:
+    From the top folder of the repository::
+
+        $ python -m pytest tests
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from vos.multipart import Multipart_Stream, content_size, iter_content, iter_gzip
+
+import gzip, io, mmap, os, tempfile, unittest
+
+
+class Test_Multipart(unittest.TestCase):
+
+    Content = os.urandom(10000)
+
+    def test_content_size(self):
+        self.assertEqual(content_size(self.Content), 10000)
+        self.assertEqual(content_size(memoryview(self.Content)[100:]), 9900)
+        buf = io.BytesIO(self.Content)
+        buf.seek(1000)
+        self.assertEqual(content_size(buf), 9000)
+        self.assertIsNone(content_size(iter([self.Content])))
+
+    def test_iter_content(self):
+        for content in (self.Content, io.BytesIO(self.Content)):
+            chunks = [bytes(chunk) for chunk in iter_content(content, 3000)]
+            self.assertEqual([len(chunk) for chunk in chunks], [3000, 3000, 3000, 1000])
+            self.assertEqual(b''.join(chunks), self.Content)
+        self.assertEqual(list(iter_content(iter([b'a', b'b']))), [b'a', b'b'])
+
+    def test_iter_gzip(self):
+        data = b''.join(iter_gzip(io.BytesIO(self.Content * 10), 4096))
+        self.assertEqual(gzip.decompress(data), self.Content * 10)
+
+    def body(self, stream):
+        return b'\r\n'.join([b'--' + stream.boundary.encode(),
+                             b'Content-Disposition: form-data; name="file"; filename="f.bin"',
+                             b'', self.Content, b'--' + stream.boundary.encode() + b'--', b''])
+
+    def test_read(self):
+        progress = []
+        stream = Multipart_Stream('file', 'f.bin', self.Content, chunk_size=3000,
+                                  progress=lambda sent, total, elapsed: progress.append((sent, total)))
+        self.assertEqual(stream.content_type,
+                         'multipart/form-data; boundary={}'.format(stream.boundary))
+        parts = []
+        while True:
+            data = stream.read(1024)
+            if not data: break
+            parts.append(bytes(data))
+        body = b''.join(parts)
+        self.assertEqual(body, self.body(stream))
+        self.assertEqual(stream.len, len(body))
+        self.assertEqual(progress[-1], (10000, 10000))
+
+    def test_unknown_size(self):
+        # Without a Content-Length, the body is sent with chunked encoding
+        stream = Multipart_Stream('file', 'f.bin', iter([self.Content[:5000], self.Content[5000:]]))
+        self.assertFalse(hasattr(stream, 'len'))
+        self.assertEqual(b''.join(bytes(part) for part in stream), self.body(stream))
+
+    def test_close_mmap(self):
+        # The memory map can be closed after a partial read of the body
+        fd, file_name = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as out:
+            out.write(self.Content)
+        self.addCleanup(os.unlink, file_name)
+        with open(file_name, 'rb') as in_file:
+            data = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+            stream = Multipart_Stream('file', 'f.bin', data, chunk_size=3000)
+            stream.read(100)
+            stream.read(100)
+            stream.close()
+            data.close()
+            self.assertTrue(data.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests of the EAS_Result_Cache class
+
+Usage:
+    From the top folder of the repository::
+
+        $ python -m pytest tests
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from time import time
+from eas.result_cache import EAS_Result_Cache, normalize_query
+
+import json, os, shutil, tempfile, unittest
+
+
+class Test_EAS_Result_Cache(unittest.TestCase):
+
+    Endpoint = "https://eas.esac.esa.int/tap-dev/tap/async"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = EAS_Result_Cache(self.directory, ttl=3600, max_bytes=1024 ** 2)
+
+    def store(self, key, data):
+        writer = self.cache.writer(key, query="SELECT 1")
+        writer.write(data[:len(data) // 2])
+        writer.write(data[len(data) // 2:])
+        writer.commit()
+
+    def read(self, key):
+        return b''.join(self.cache.read(key, 100))
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query("  SELECT *\n  FROM\tt  WHERE a = 'x  y' ;; "),
+                         "SELECT * FROM t WHERE a = 'x  y'")
+        key = EAS_Result_Cache.key("SELECT * FROM t", "csv", self.Endpoint)
+        self.assertEqual(EAS_Result_Cache.key("SELECT *\n FROM t;", "csv", self.Endpoint), key)
+        self.assertNotEqual(EAS_Result_Cache.key("SELECT * FROM t", "fits", self.Endpoint), key)
+        self.assertNotEqual(EAS_Result_Cache.key("SELECT * FROM t", "csv", "http://x"), key)
+        self.assertNotEqual(EAS_Result_Cache.key("SELECT * FROM t WHERE a = 'x  y'", "csv",
+                                                 self.Endpoint),
+                            EAS_Result_Cache.key("SELECT * FROM t WHERE a = 'x y'", "csv",
+                                                 self.Endpoint))
+
+    def test_hit(self):
+        data = os.urandom(1000)
+        self.assertFalse(self.cache.lookup('a'))
+        self.store('a', data)
+        self.assertTrue(self.cache.lookup('a'))
+        self.assertEqual(self.read('a'), data)
+        with open(self.cache.meta_path('a')) as meta_file:
+            self.assertEqual(json.load(meta_file)['query'], "SELECT 1")
+
+    def test_expiry(self):
+        self.store('a', b'data')
+        with open(self.cache.meta_path('a'), 'w') as meta_file:
+            json.dump({'created': time() - 3601}, meta_file)
+        self.assertFalse(self.cache.lookup('a'))
+        self.assertFalse(os.path.exists(self.cache.data_path('a')))
+        self.assertFalse(os.path.exists(self.cache.meta_path('a')))
+
+    def test_lru_eviction(self):
+        # Random data are not compressed: each entry takes about 1 KB
+        self.cache.max_bytes = 2500
+        self.store('a', os.urandom(1000))
+        self.store('b', os.urandom(1000))
+        now = time()
+        os.utime(self.cache.data_path('a'), (now - 100, now - 100))
+        os.utime(self.cache.data_path('b'), (now - 50, now - 50))
+        # Using 'a' makes 'b' the least recently used entry
+        self.assertTrue(self.cache.lookup('a'))
+        self.store('c', os.urandom(1000))
+        self.assertFalse(self.cache.lookup('b'))
+        self.assertTrue(self.cache.lookup('a'))
+        self.assertTrue(self.cache.lookup('c'))
+
+    def test_commit_abort(self):
+        writer = self.cache.writer('a')
+        writer.write(b'partial')
+        # The entry is not visible until it is committed
+        self.assertFalse(self.cache.lookup('a'))
+        writer.abort()
+        self.assertFalse(self.cache.lookup('a'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_clear(self):
+        self.store('a', b'data')
+        self.store('b', b'data')
+        self.cache.clear()
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
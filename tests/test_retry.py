@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests of the retry policy functions and classes of the uws package
+
+Usage:
+    From the top folder of the repository::
+
+        $ python -m pytest tests
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from uws.retry import Retry_Policy, is_transient
+from vos.vos_handler import VOSpace_Transfer_Error
+
+import requests, unittest
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError("HTTP {}".format(status), response=response)
+
+
+class Test_Retry(unittest.TestCase):
+
+    def test_is_transient(self):
+        for e in (http_error(500), http_error(503), http_error(429),
+                  requests.HTTPError("no response"),
+                  requests.ConnectionError(), requests.Timeout(),
+                  ConnectionResetError(), TimeoutError()):
+            self.assertTrue(is_transient(e), repr(e))
+        for e in (http_error(400), http_error(404), ValueError(), KeyError()):
+            self.assertFalse(is_transient(e), repr(e))
+        # The retryable attribute takes precedence
+        self.assertTrue(is_transient(VOSpace_Transfer_Error("failed", 503)))
+        self.assertFalse(is_transient(VOSpace_Transfer_Error("failed", 403)))
+
+    def test_delays(self):
+        policy = Retry_Policy(max_attempts=5, initial_delay=1.0, factor=2.0, max_delay=5.0,
+                              jitter=0.0)
+        self.assertEqual(list(policy.delays()), [1.0, 2.0, 4.0, 5.0])
+        policy.jitter = 0.5
+        for delay, nominal in zip(policy.delays(), [1.0, 2.0, 4.0, 5.0]):
+            self.assertTrue(nominal * 0.5 <= delay <= nominal)
+
+    def test_call(self):
+        policy = Retry_Policy(max_attempts=3, initial_delay=0.0)
+        outcomes = [requests.ConnectionError(), requests.Timeout(), 'ok']
+        retries = []
+
+        def func():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception): raise outcome
+            return outcome
+
+        self.assertEqual(policy.call(func, is_transient,
+                                     lambda e, delay: retries.append(type(e))), 'ok')
+        self.assertEqual(retries, [requests.ConnectionError, requests.Timeout])
+
+    def test_call_not_retried(self):
+        policy = Retry_Policy(max_attempts=3, initial_delay=0.0)
+        calls = []
+
+        def fail(e):
+            calls.append(e)
+            raise e
+
+        with self.assertRaises(ValueError):
+            policy.call(lambda: fail(ValueError()), is_transient)
+        self.assertEqual(len(calls), 1)
+        # The last exception is raised once the attempts are exhausted
+        with self.assertRaises(requests.ConnectionError):
+            policy.call(lambda: fail(requests.ConnectionError()), is_transient)
+        self.assertEqual(len(calls), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
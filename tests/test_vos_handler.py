@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests of the VOSpace_Handler class, against the local stand-in services
+of bench.mock_server
+
+Usage:
+    From the top folder of the repository::
+
+        $ python -m pytest tests
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from bench.mock_server import Mock_Server
+from uws.retry import Retry_Policy
+from uws.uws_job import UWS_Job_Waiter
+from vos.vos_handler import VOSpace_Handler, VOSpace_Transfer_Error
+
+import json, os, shutil, tempfile, unittest
+
+
+class Test_VOSpace_Handler(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Mock_Server()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.vos = VOSpace_Handler(waiter=UWS_Job_Waiter(initial_delay=0.01),
+                                   retry=Retry_Policy(max_attempts=1),
+                                   vospace_url=self.server.vospace_url)
+        self.vos.set_auth('user', 'pwd')
+        fd, self.local_file = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as out:
+            out.write(os.urandom(3 * 1024 * 1024 + 5))
+        self.addCleanup(os.unlink, self.local_file)
+
+    def test_save_file_mmap_error(self):
+        # The HTTP error of the upload is raised, not a BufferError when
+        # the memory map is closed
+        with self.assertRaises(VOSpace_Transfer_Error) as raised:
+            self.vos.save_file('folder', 'file.bin', self.local_file, use_mmap=True,
+                               transfer=('x', 'nonexistent'))
+        self.assertEqual(raised.exception.status, 404)
+
+    def test_retrieve_file_stale_partial(self):
+        # A partial file of an older version of the remote file is discarded
+        content = b'CONTENT-NEW' * 11
+        self.vos.save_to_file('folder', 'file.bin', content)
+        local_file = self.local_file + '.retrieved'
+        self.addCleanup(lambda: os.path.exists(local_file) and os.unlink(local_file))
+        for old_data, validator, length in ((b'OLD-VERSION-DATA', '"old"', 16),
+                                            (b'x' * 1000, '"old"', None),
+                                            (b'OLD-VERSION-DATA', None, None)):
+            with open(local_file + '.part', 'wb') as part:
+                part.write(old_data)
+            with open(local_file + '.part.info', 'w') as info:
+                json.dump([validator, length], info)
+            self.vos.retrieve_file('folder/file.bin', '', local_file)
+            with open(local_file, 'rb') as retrieved:
+                self.assertEqual(retrieved.read(), content)
+            self.assertFalse(os.path.exists(local_file + '.part.info'))
+
+    def test_retrieve_file_resume(self):
+        # A partial file of the current version is completed with a range request
+        content = os.urandom(1000)
+        self.vos.save_to_file('folder', 'file.bin', content)
+        starts = []
+        stream = self.vos.retrieve_stream('folder/file.bin', '',
+                                          on_start=lambda *args: starts.append(args))
+        next(stream)
+        stream.close()
+        local_file = self.local_file + '.retrieved'
+        self.addCleanup(os.unlink, local_file)
+        with open(local_file + '.part', 'wb') as part:
+            part.write(content[:400])
+        with open(local_file + '.part.info', 'w') as info:
+            json.dump([starts[0][1], len(content)], info)
+        received = []
+        self.vos.retrieve_file('folder/file.bin', '', local_file,
+                               progress=lambda sent, total, elapsed: received.append(sent))
+        with open(local_file, 'rb') as retrieved:
+            self.assertEqual(retrieved.read(), content)
+        self.assertEqual(received, [len(content)])
+
+    def test_mirror_folder_current_dir(self):
+        # The files are mirrored into the current folder if local_dir is ''
+        self.vos.save_to_file('folder', 'a.bin', b'A' * 100)
+        self.vos.save_to_file('folder/sub', 'b.bin', b'B' * 10)
+        local_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, local_dir)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(local_dir)
+        self.assertEqual(self.vos.mirror_folder('folder', ''), {'a.bin': True, 'sub/b.bin': True})
+        with open(os.path.join(local_dir, 'sub', 'b.bin'), 'rb') as local_file:
+            self.assertEqual(local_file.read(), b'B' * 10)
+        self.assertEqual(self.vos.mirror_folder('folder', ''), {'a.bin': False, 'sub/b.bin': False})
+
+
+class Test_VOSpace_Handler_Timeout(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Mock_Server(latency=1.0)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def test_request_timeout(self):
+        vos = VOSpace_Handler(retry=Retry_Policy(max_attempts=1), timeout=(1.0, 0.1),
+                              vospace_url=self.server.vospace_url)
+        vos.set_auth('user', 'pwd')
+        with self.assertRaises(VOSpace_Transfer_Error) as raised:
+            vos.save_to_file('folder', 'file.bin', b'data')
+        self.assertIn('timed out', str(raised.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""HTTP session functions from package uws
+
+This module provides the pooled HTTP sessions (with keep-alive) used by
+the ``eas`` and ``vos`` packages, so that the many requests made to the
+same hosts (job submission, phase polling, uploads and downloads) reuse
+the already open connections instead of performing a new TCP+TLS
+handshake each time.
+
+Usage:
+    By default, each EAS_Query and VOSpace_Handler object gets its own
+    session from ``default_session()``, with its own cookies, but all of
+    them share the connection pool of ``default_adapter()``, so that the
+    cookies of a user login are never sent in the requests of another user.
+    A specific session can be created with ``new_session()`` and passed to
+    their constructors (to share cookies on purpose, for instance)::
+
+        session = new_session(pool_size=32)
+        easHdl = EAS_Query(session=session)
+        vos = VOSpace_Handler(session=session)
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from threading import Lock
+
+import requests
+
+Default_Pool_Size = 10
+
+_default_adapter = None
+_default_adapter_lock = Lock()
+
+
+def new_adapter(pool_size=Default_Pool_Size):
+    """Creates a new transport adapter, keeping up to pool_size open
+    connections per host."""
+    return requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                         pool_maxsize=pool_size)
+
+
+def new_session(pool_size=Default_Pool_Size, adapter=None):
+    """Creates a new HTTP session, using the provided transport adapter (its
+    connection pool), or a new one keeping up to pool_size open connections
+    per host."""
+    if adapter is None:
+        adapter = new_adapter(pool_size)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def default_adapter():
+    """Returns the transport adapter (connection pool) shared by default in
+    the whole process, creating it the first time."""
+    global _default_adapter
+    with _default_adapter_lock:
+        if _default_adapter is None:
+            _default_adapter = new_adapter()
+        return _default_adapter
+
+
+def default_session():
+    """Returns a new HTTP session, with its own cookies, that uses the
+    connection pool shared by default in the whole process."""
+    return new_session(adapter=default_adapter())
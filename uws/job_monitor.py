@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""UWS_Job_Monitor class from package uws
+
+This module provides a shared background monitor of UWS jobs: a single
+scheduler thread keeps all the pending jobs in a heap ordered by the time
+of their next poll, each one with its own backoff schedule, and the polls
+are made by a small pool of worker threads.  Each job is represented by a
+``concurrent.futures.Future``, completed when the job reaches a final
+phase, so that thousands of jobs can be waited for with a fixed number of
+threads.  A failed poll is retried according to a Retry_Policy if the
+error is transient (see ``uws.retry.is_transient()``).
+
+Usage:
+    Watch a job with its URL and a function that retrieves the job document
+    for a given URL, and wait for its future (or await it from asyncio with
+    ``asyncio.wrap_future()``)::
+
+        monitor = default_monitor()
+        future = monitor.watch(job_url, fetch)
+        phase, job, polls = future.result()
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from itertools import count
+from threading import Condition, Lock, Thread
+from time import monotonic
+from uws.uws_job import UWS_Backoff, UWS_Job_Waiter, UWS_Phase_Timer, parse_job
+from uws.retry import Retry_Policy, is_transient
+
+import heapq
+
+
+class UWS_Watched_Job(object):
+    """
+    Job watched by the monitor, with its backoff schedule and future
+    """
+
+    def __init__(self, job_url, fetch, backoff, on_poll, phases):
+        self.job_url = job_url
+        self.fetch = fetch
+        self.backoff = backoff
+        self.on_poll = on_poll
+        self.phases = phases
+        self.polls = 0
+        self.retry_delays = None
+        self.future = Future()
+
+
+class UWS_Job_Monitor(object):
+    """
+    Monitors many UWS jobs with a single scheduler thread and a small pool
+    of polling threads
+    """
+
+    def __init__(self, initial_delay=0.2, factor=1.5, max_delay=10.0, max_workers=4,
+                 retry=None):
+        """Initialize object (class instance) attributes.  The jobs are polled
+        with the given backoff schedule (unless another one is provided for a
+        job), using up to max_workers threads.  The threads are created when
+        the first job is watched.  Polls failed with a transient error are
+        retried according to the provided Retry_Policy (or a default one)."""
+        self.initial_delay = initial_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.max_workers = max_workers
+        self.retry = retry if retry is not None else Retry_Policy()
+
+        self.polls = 0
+        self.scheduled = []
+        self.sequence = count()
+        self.condition = Condition(Lock())
+        self.scheduler = None
+        self.executor = None
+        self.stopped = False
+
+    def watch(self, job_url, fetch, backoff=None, on_poll=None, metrics=None, label='uws_job'):
+        """Starts monitoring the job at job_url, using fetch(url) to retrieve
+        the job document, and returns a Future whose result is, once the job
+        reaches a final phase, a tuple with the final phase, the UWS_Job_Status
+        of the last job document and the number of polls made.  The future
+        gets the exception raised by fetch(), if it is not transient or the
+        retries of the poll are exhausted.  fetch() is called by one of the
+        max_workers threads of the monitor, shared by all the jobs, so it
+        must not block indefinitely (e.g. it should set a timeout on its HTTP
+        requests, as EAS_Query does).  If provided, on_poll() is called after
+        each poll, and the time spent by the job in each phase is recorded in
+        the Metrics object metrics (see UWS_Job_Waiter.wait())."""
+        if backoff is None:
+            backoff = UWS_Backoff(self.initial_delay, self.factor, self.max_delay)
+        job = UWS_Watched_Job(job_url, fetch, backoff, on_poll, UWS_Phase_Timer(metrics, label))
+        with self.condition:
+            if self.stopped:
+                raise RuntimeError("The job monitor has been shut down")
+            if self.scheduler is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                self.scheduler = Thread(target=self.schedule, daemon=True)
+                self.scheduler.start()
+            self.push(monotonic(), job)
+        return job.future
+
+    def push(self, due, job):
+        """Schedules the next poll of the job (with the condition acquired)."""
+        heapq.heappush(self.scheduled, (due, next(self.sequence), job))
+        self.condition.notify()
+
+    def pending(self):
+        """Returns the number of jobs being monitored."""
+        with self.condition:
+            return len(self.scheduled)
+
+    def schedule(self):
+        """Scheduler loop: submits the poll of each job when it is due."""
+        while True:
+            with self.condition:
+                while not self.stopped:
+                    if self.scheduled:
+                        delay = self.scheduled[0][0] - monotonic()
+                        if delay <= 0: break
+                        self.condition.wait(delay)
+                    else:
+                        self.condition.wait()
+                if self.stopped:
+                    return
+                due, seq, job = heapq.heappop(self.scheduled)
+            if job.future.cancelled():
+                continue
+            try:
+                self.executor.submit(self.poll, job)
+            except RuntimeError:
+                # Interpreter shutting down
+                job.future.cancel()
+                return
+
+    def poll(self, job):
+        """Polls the job once, and completes its future if it is finished or
+        failed, or else schedules its next poll."""
+        start = monotonic()
+        try:
+            data = job.fetch(job.job_url)
+            status = parse_job(data)
+        except Exception as e:
+            if is_transient(e):
+                if job.retry_delays is None:
+                    job.retry_delays = self.retry.delays()
+                delay = next(job.retry_delays, None)
+                if delay is not None:
+                    if job.phases.metrics is not None:
+                        job.phases.metrics.count(job.phases.label + '_poll_retries')
+                    self.reschedule(job, delay)
+                    return
+            job.phases.record(job.polls)
+            self.complete(job, exception=e)
+            return
+        job.retry_delays = None
+        job.polls += 1
+        with self.condition:
+            self.polls += 1
+        if job.on_poll is not None:
+            job.on_poll()
+        job.phases.observe(status.phase)
+        if status.phase in UWS_Job_Waiter.Final_Phases:
+            job.phases.record(job.polls)
+            self.complete(job, result=(status.phase, status, job.polls))
+            return
+        self.reschedule(job, job.backoff.next_delay() - (monotonic() - start))
+
+    def reschedule(self, job, delay):
+        """Schedules the next poll of the job after delay seconds, or cancels
+        its future if the monitor has been shut down."""
+        with self.condition:
+            if not self.stopped:
+                self.push(monotonic() + max(delay, 0.0), job)
+                return
+        job.future.cancel()
+
+    @staticmethod
+    def complete(job, result=None, exception=None):
+        """Sets the result (or exception) of the future of the job, unless it
+        has been cancelled in the meantime."""
+        try:
+            if exception is not None:
+                job.future.set_exception(exception)
+            else:
+                job.future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def shutdown(self):
+        """Stops monitoring: the futures of the pending jobs are cancelled."""
+        with self.condition:
+            self.stopped = True
+            scheduled, self.scheduled = self.scheduled, []
+            self.condition.notify_all()
+        for due, seq, job in scheduled:
+            job.future.cancel()
+        if self.scheduler is not None:
+            self.scheduler.join()
+            self.executor.shutdown()
+
+
+_default_monitor = None
+_default_monitor_lock = Lock()
+
+
+def default_monitor():
+    """Returns the job monitor shared by default in the process, creating it
+    the first time."""
+    global _default_monitor
+    with _default_monitor_lock:
+        if _default_monitor is None:
+            _default_monitor = UWS_Job_Monitor()
+        return _default_monitor
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Metrics class from package uws
+
+This module provides a simple instrumentation object, used by the EAS and
+VOSpace clients to record the duration of each phase of their operations
+(submission, job queue and execution, download, parsing, FITS building,
+transfer negotiation, upload...), the number of polls, and the number of
+bytes transferred, so that the bottlenecks can be found.
+
+The recorded values can be exported as structured (JSON) log records, or
+in the Prometheus text exposition format, and a listener can be provided
+to be notified of each value as it is recorded.
+
+Usage:
+    Create a Metrics object, and pass it to the clients::
+
+        metrics = Metrics(prefix='eas')
+        qry = EAS_Query(metrics=metrics)
+        ...
+        metrics.log(logging.getLogger('eas.metrics'))
+        print(metrics.prometheus())
+
+    The clients create their own Metrics object if none is provided, and
+    it can be accessed with their ``metrics`` attribute.
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from contextlib import contextmanager
+from threading import Lock
+from time import monotonic
+
+import json, logging
+
+
+class Metrics(object):
+    """
+    Thread-safe collection of phase timers and counters
+    """
+
+    def __init__(self, prefix='eas', listener=None):
+        """Initialize object (class instance) attributes.  The names of the
+        exported metrics start with prefix.  If provided, listener(kind, name,
+        value) is called for each value recorded, kind being 'timer' (value
+        in seconds) or 'counter' (value is the increment)."""
+        self.prefix = prefix
+        self.listener = listener
+        self.lock = Lock()
+        self.timers = {}
+        self.counters = {}
+
+    def record_time(self, name, seconds):
+        """Adds the duration of an occurrence of the phase name."""
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+        if self.listener is not None:
+            self.listener('timer', name, seconds)
+
+    def count(self, name, value=1):
+        """Increments the counter name by value."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        if self.listener is not None:
+            self.listener('counter', name, value)
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager recording the duration of its block as an
+        occurrence of the phase name (also if the block raises)."""
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.record_time(name, monotonic() - start)
+
+    def timed_iter(self, name, items, counter=None):
+        """Iterates over items (e.g. chunks of bytes), recording as the phase
+        name only the time spent producing them (not the time spent by the
+        consumer), and adding their total length to counter, if provided
+        (use name + '_bytes' for chunks of bytes to get the throughput)."""
+        elapsed = 0.0
+        size = 0
+        iterator = iter(items)
+        try:
+            while True:
+                start = monotonic()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += monotonic() - start
+                size += len(item)
+                yield item
+        finally:
+            self.record_time(name, elapsed)
+            if counter is not None:
+                self.count(counter, size)
+
+    def throughput(self, name):
+        """Returns the throughput (bytes per second) of the phase name, from
+        its counter name + '_bytes', or None if it is not known."""
+        with self.lock:
+            timer = self.timers.get(name)
+            size = self.counters.get(name + '_bytes')
+        if timer is None or size is None or timer[1] <= 0:
+            return None
+        return size / timer[1]
+
+    def snapshot(self):
+        """Returns a dictionary with the current values of the timers (number
+        of occurrences, total and maximum seconds, and throughput if known)
+        and counters."""
+        with self.lock:
+            timers = {name: {'count': count, 'seconds': total, 'max_seconds': longest}
+                      for name, (count, total, longest) in self.timers.items()}
+            counters = dict(self.counters)
+        for name, timer in timers.items():
+            size = counters.get(name + '_bytes')
+            if size is not None and timer['seconds'] > 0:
+                timer['bytes_per_second'] = size / timer['seconds']
+        return {'timers': timers, 'counters': counters}
+
+    def reset(self):
+        """Discards all the values recorded."""
+        with self.lock:
+            self.timers.clear()
+            self.counters.clear()
+
+    def log(self, logger=None, level=logging.INFO):
+        """Emits one structured (JSON) log record per timer and counter."""
+        if logger is None:
+            logger = logging.getLogger(self.prefix + '.metrics')
+        values = self.snapshot()
+        for name, timer in sorted(values['timers'].items()):
+            record = dict(metric=name, type='timer', **timer)
+            logger.log(level, json.dumps(record, sort_keys=True))
+        for name, value in sorted(values['counters'].items()):
+            record = dict(metric=name, type='counter', value=value)
+            logger.log(level, json.dumps(record, sort_keys=True))
+
+    def prometheus(self):
+        """Returns the values in the Prometheus text exposition format: the
+        timers as the summary <prefix>_phase_seconds (with a phase label)
+        and the gauge <prefix>_phase_max_seconds, and each counter as
+        <prefix>_<name>_total."""
+        values = self.snapshot()
+        lines = []
+        if values['timers']:
+            family = self.prefix + '_phase_seconds'
+            lines.append('# TYPE {} summary'.format(family))
+            for name, timer in sorted(values['timers'].items()):
+                lines.append('{}_count{{phase="{}"}} {}'.format(family, name, timer['count']))
+                lines.append('{}_sum{{phase="{}"}} {!r}'.format(family, name, timer['seconds']))
+            family = self.prefix + '_phase_max_seconds'
+            lines.append('# TYPE {} gauge'.format(family))
+            for name, timer in sorted(values['timers'].items()):
+                lines.append('{}{{phase="{}"}} {!r}'.format(family, name, timer['max_seconds']))
+        for name, value in sorted(values['counters'].items()):
+            family = '{}_{}_total'.format(self.prefix, name)
+            lines.append('# TYPE {} counter'.format(family))
+            lines.append('{} {}'.format(family, value))
+        return '\n'.join(lines) + '\n'
+
+
+def main():
+    """Sample usage of the Metrics class"""
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Retry_Policy class from package uws
+
+This module provides the configuration of the retries of failed requests
+to the ESAC services, with exponential backoff and random jitter between
+attempts, so that many clients failing at the same time (e.g. after a
+transient 503) do not retry all at once.
+
+Usage:
+    Create a Retry_Policy, and use its ``call()`` method to run a function
+    that is retried while it raises a retryable exception::
+
+        policy = Retry_Policy(max_attempts=5, max_delay=30.0)
+        result = policy.call(func, is_retryable=lambda e: ...)
+
+    or iterate over its ``delays()`` method for custom retry loops.  The
+    ``is_transient()`` function tells the errors that are worth retrying.
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from time import sleep
+
+import requests
+import random
+
+
+def is_transient(e):
+    """Tells whether a failed request can be retried: the exception has a
+    true retryable attribute (e.g. VOSpace_Transfer_Error), or is a network
+    error (connection error, timeout) or an HTTP 5xx or 429 status."""
+    retryable = getattr(e, 'retryable', None)
+    if retryable is not None:
+        return bool(retryable)
+    if isinstance(e, requests.HTTPError):
+        status = e.response.status_code if e.response is not None else None
+        return status is None or status >= 500 or status == 429
+    return isinstance(e, (requests.ConnectionError, requests.Timeout,
+                          ConnectionError, TimeoutError))
+
+
+class Retry_Policy(object):
+    """
+    Number of attempts and jittered exponential backoff delays for retries
+    """
+
+    def __init__(self, max_attempts=5, initial_delay=1.0, factor=2.0, max_delay=60.0, jitter=0.5):
+        """Initialize object (class instance) attributes.  The n-th retry
+        waits initial_delay * factor**n seconds (at most max_delay), reduced
+        by a random fraction of up to jitter of that value."""
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delays(self):
+        """Yields the delays to wait before each retry (max_attempts - 1)."""
+        for n in range(self.max_attempts - 1):
+            delay = min(self.initial_delay * self.factor ** n, self.max_delay)
+            yield delay * (1.0 - self.jitter * random.random())
+
+    def call(self, func, is_retryable, on_retry=None):
+        """Calls func() until it succeeds, retrying while it raises exceptions
+        for which is_retryable(exception) is True.  If provided, on_retry(
+        exception, delay) is called before each retry."""
+        delays = self.delays()
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                if not is_retryable(e): raise
+                delay = next(delays, None)
+                if delay is None: raise
+                if on_retry is not None:
+                    on_retry(e, delay)
+                sleep(delay)
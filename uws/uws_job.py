@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""UWS_Job_Waiter class from package uws
+
+This module provides the monitoring of IVOA UWS (Universal Worker Service)
+jobs, shared by the ``eas`` and ``vos`` packages: both the TAP+ asynchronous
+queries and the VOSpace transfers are UWS jobs whose phase must be polled
+until they finish.
+
+Usage:
+    Create a UWS_Job_Waiter object (it can be shared by several clients and
+    threads), and call its ``wait()`` method with the job URL and a function
+    that retrieves the job document for a given URL::
+
+        waiter = UWS_Job_Waiter(max_delay=5.0)
+        phase, job, polls = waiter.wait(job_url, fetch)
+        print("Total number of polls: {}".format(waiter.polls))
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from time import sleep, monotonic
+from threading import Lock
+from collections import namedtuple
+from xml.etree.ElementTree import XMLPullParser
+
+import asyncio, re
+
+
+UWS_Job_Status = namedtuple('UWS_Job_Status',
+                            ['job_id', 'phase', 'error_summary', 'results', 'version'])
+UWS_Job_Status.__doc__ = """Information extracted from a UWS job document: job id, phase,
+error summary message (or None), list of result URLs and UWS version (an
+empty string if not declared)."""
+
+
+def parse_job(data):
+    """Extracts the job information from a UWS job document (str or bytes),
+    in a single pass of the (expat based) pull parser, without building a
+    DOM.  Elements are matched by local name, whatever their namespace."""
+    if isinstance(data, str):
+        data = data.encode("UTF-8")
+    parser = XMLPullParser(events=('start', 'end'))
+    parser.feed(data)
+    parser.close()
+
+    job_id = phase = error_summary = None
+    results = []
+    version = ''
+    in_error = False
+    for event, elem in parser.read_events():
+        name = elem.tag.rpartition('}')[2]
+        if event == 'start':
+            if name == 'job':
+                version = elem.get('version', '')
+            elif name == 'errorSummary':
+                in_error = True
+            elif name == 'result':
+                for attr, value in elem.attrib.items():
+                    if attr.rpartition('}')[2] == 'href':
+                        results.append(value)
+        elif name == 'jobId':
+            job_id = (elem.text or '').strip()
+        elif name == 'phase':
+            phase = (elem.text or '').strip()
+        elif name == 'message' and in_error:
+            error_summary = (elem.text or '').strip()
+        elif name == 'errorSummary':
+            in_error = False
+    return UWS_Job_Status(job_id, phase, error_summary, results, version)
+
+
+def get_phase(data):
+    """Returns the value of the uws:phase element of a UWS job document."""
+    return parse_job(data).phase
+
+
+def get_job_id(data):
+    """Returns the value of the uws:jobId element of a UWS job document."""
+    return parse_job(data).job_id
+
+
+def version_tuple(version):
+    """Converts a UWS version (e.g. '1.1') into a tuple of integers, that can
+    be compared (e.g. (1, 10) > (1, 9)).  Non numeric parts are ignored."""
+    return tuple(int(part) for part in re.findall(r'\d+', version or ''))
+
+
+class UWS_Backoff(object):
+    """
+    Exponential backoff schedule for the polling of a single job
+    """
+
+    def __init__(self, initial_delay=0.2, factor=1.5, max_delay=10.0):
+        """Initialize object (class instance) attributes."""
+        self.initial_delay = initial_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.delay = initial_delay
+
+    def reset(self):
+        """Restarts the schedule from the initial delay."""
+        self.delay = self.initial_delay
+
+    def next_delay(self):
+        """Returns the delay to wait before the next poll, and increases the
+        following one, up to the configured cap."""
+        delay = self.delay
+        self.delay = min(self.delay * self.factor, self.max_delay)
+        return delay
+
+
+class UWS_Phase_Timer(object):
+    """
+    Time spent by a job in each phase, as observed by its polls
+    """
+
+    def __init__(self, metrics, label):
+        """Initialize object (class instance) attributes.  The times are
+        recorded in the Metrics object metrics (if not None) as the phases
+        label + '_' + phase (in lower case)."""
+        self.metrics = metrics
+        self.label = label
+        self.phase = None
+        self.since = monotonic()
+        self.times = {}
+
+    def observe(self, phase):
+        """Takes note of the phase reported by a poll."""
+        now = monotonic()
+        if self.phase is not None:
+            self.times[self.phase] = self.times.get(self.phase, 0.0) + now - self.since
+        self.phase = phase
+        self.since = now
+
+    def record(self, polls):
+        """Records the time spent in each phase, and the number of polls."""
+        if self.metrics is None:
+            return
+        for phase, seconds in self.times.items():
+            self.metrics.record_time("{}_{}".format(self.label, phase.lower()), seconds)
+        self.metrics.count(self.label + '_polls', polls)
+
+
+class UWS_Job_Waiter(object):
+    """
+    Waits for UWS jobs to reach a final phase, polling with exponential
+    backoff, and using the UWS 1.1 blocking WAIT parameter when available
+    """
+
+    Final_Phases = ('COMPLETED', 'ERROR', 'ABORTED')
+    # First UWS version with the blocking WAIT parameter
+    Wait_Version = (1, 1)
+
+    def __init__(self, initial_delay=0.2, factor=1.5, max_delay=10.0,
+                 wait_time=30, use_wait=None):
+        """Initialize object (class instance) attributes.  The blocking WAIT
+        parameter (with wait_time seconds) is always used if use_wait is True,
+        never if it is False, and only if the server declares UWS 1.1 in the
+        job document if use_wait is None."""
+        self.initial_delay = initial_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.wait_time = wait_time
+        self.use_wait = use_wait
+
+        self.polls = 0
+        self.polls_lock = Lock()
+
+    def backoff(self):
+        """Returns a new backoff schedule with the waiter configuration."""
+        return UWS_Backoff(self.initial_delay, self.factor, self.max_delay)
+
+    def wait_url(self, job_url):
+        """Returns the job URL with the blocking WAIT parameter."""
+        sep = '&' if '?' in job_url else '?'
+        return "{}{}WAIT={}".format(job_url, sep, self.wait_time)
+
+    def count_poll(self):
+        """Increases the total number of polls made by this waiter."""
+        with self.polls_lock:
+            self.polls += 1
+
+    def wait(self, job_url, fetch, metrics=None, label='uws_job'):
+        """Polls the job at job_url, using fetch(url) to retrieve the job
+        document, until it reaches a final phase.  Returns the final phase,
+        the UWS_Job_Status of the last job document and the number of polls
+        made for this job.  If a Metrics object is provided, the time spent
+        in each phase (e.g. label + '_queued', label + '_executing') and the
+        number of polls (label + '_polls') are recorded in it."""
+        backoff = self.backoff()
+        blocking = self.use_wait is True
+        polls = 0
+        phases = UWS_Phase_Timer(metrics, label)
+        try:
+            while True:
+                start = monotonic()
+                data = fetch(self.wait_url(job_url) if blocking else job_url)
+                polls += 1
+                self.count_poll()
+                job = parse_job(data)
+                phase = job.phase
+                phases.observe(phase)
+                # Check finished
+                if phase in UWS_Job_Waiter.Final_Phases:
+                    return phase, job, polls
+                if polls == 1 and self.use_wait is None:
+                    blocking = version_tuple(job.version) >= UWS_Job_Waiter.Wait_Version
+                # Wait and repeat (blocking requests already waited on the server)
+                delay = backoff.next_delay() - (monotonic() - start)
+                if delay > 0: sleep(delay)
+        finally:
+            phases.record(polls)
+
+    async def wait_async(self, job_url, fetch, metrics=None, label='uws_job'):
+        """Same as wait(), but for asyncio clients: fetch(url) must be a
+        coroutine function, and the waits do not block the event loop."""
+        backoff = self.backoff()
+        blocking = self.use_wait is True
+        polls = 0
+        phases = UWS_Phase_Timer(metrics, label)
+        try:
+            while True:
+                start = monotonic()
+                data = await fetch(self.wait_url(job_url) if blocking else job_url)
+                polls += 1
+                self.count_poll()
+                job = parse_job(data)
+                phase = job.phase
+                phases.observe(phase)
+                if phase in UWS_Job_Waiter.Final_Phases:
+                    return phase, job, polls
+                if polls == 1 and self.use_wait is None:
+                    blocking = version_tuple(job.version) >= UWS_Job_Waiter.Wait_Version
+                delay = backoff.next_delay() - (monotonic() - start)
+                if delay > 0: await asyncio.sleep(delay)
+        finally:
+            phases.record(polls)
+
+
+def main():
+    """Sample usage of the UWS_Job_Waiter class"""
+    pass
+
+
+if __name__ == '__main__':
+    main()
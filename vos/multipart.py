@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Multipart_Stream class from package vos
+
+This module provides a streaming encoder for ``multipart/form-data`` bodies
+with a single file field, equivalent to the ``files={'file': (name, data)}``
+argument of ``requests``, but reading the file content in chunks as the
+body is sent, so that the memory used does not depend on the file size.
+
+Usage:
+    The content can be a bytes-like object (bytes, bytearray, memoryview,
+    mmap), a binary file object, or an iterator of chunks of bytes::
+
+        body = Multipart_Stream('file', 'cube.fits', open('cube.fits', 'rb'))
+        requests.post(url, data=body, headers={'Content-Type': body.content_type})
+
+    If the size of the content can be determined, the body is sent with
+    a Content-Length header, otherwise chunked transfer encoding is used.
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from time import monotonic
+
+import mmap, os, uuid, zlib
+
+Chunk_Size = 1024 * 1024
+
+
+def is_buffer(content):
+    """Tells whether the content is a bytes-like object."""
+    return isinstance(content, (bytes, bytearray, memoryview, mmap.mmap))
+
+
+def content_size(content):
+    """Returns the number of bytes of content still to be read, or None if
+    it cannot be determined (e.g. for iterators)."""
+    if is_buffer(content):
+        return memoryview(content).nbytes
+    if hasattr(content, 'read'):
+        try:
+            pos = content.tell()
+            try:
+                return os.fstat(content.fileno()).st_size - pos
+            except (AttributeError, OSError):
+                end = content.seek(0, os.SEEK_END)
+                content.seek(pos)
+                return end - pos
+        except (AttributeError, OSError):
+            return None
+    return None
+
+
+def iter_content(content, chunk_size=Chunk_Size):
+    """Returns an iterator over the content in chunks of bytes."""
+    if is_buffer(content):
+        view = memoryview(content).cast('B')
+        return (view[pos:pos + chunk_size] for pos in range(0, view.nbytes, chunk_size))
+    if hasattr(content, 'read'):
+        return iter(lambda: content.read(chunk_size), b'')
+    return iter(content)
+
+
+def iter_gzip(content, chunk_size=Chunk_Size, level=6):
+    """Returns an iterator over the content compressed on the fly in gzip
+    format, in chunks of bytes, without holding the entire content (or its
+    compressed version) in memory."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in iter_content(content, chunk_size):
+        data = compressor.compress(chunk)
+        if data: yield data
+    yield compressor.flush()
+
+
+class Multipart_Stream(object):
+    """
+    Streaming multipart/form-data body with a single file field
+    """
+
+    def __init__(self, field, file_name, content, chunk_size=Chunk_Size, progress=None):
+        """Initialize object (class instance) attributes.  If provided,
+        progress(bytes_sent, total_bytes, elapsed_seconds) is called after
+        each chunk of the content is sent (total_bytes may be None)."""
+        self.boundary = uuid.uuid4().hex
+        self.head = ('--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\n\r\n'
+                     .format(self.boundary, field, file_name)).encode("UTF-8")
+        self.tail = '\r\n--{}--\r\n'.format(self.boundary).encode("UTF-8")
+        self.content_size = content_size(content)
+        self.chunks = iter_content(content, chunk_size)
+        self.progress = progress
+
+        self.content_type = 'multipart/form-data; boundary={}'.format(self.boundary)
+        self.bytes_sent = 0
+        self.start = None
+        self.body = self.iter_body()
+        self.buffer = memoryview(b'')
+        # Total size of the body, used for the Content-Length header (the
+        # attribute is not set if the size is unknown, for chunked encoding)
+        if self.content_size is not None:
+            self.len = len(self.head) + self.content_size + len(self.tail)
+
+    def iter_body(self):
+        """Yields the parts of the body, chunk by chunk."""
+        self.start = monotonic()
+        yield self.head
+        for chunk in self.chunks:
+            if not chunk: continue
+            yield chunk
+            self.bytes_sent += len(chunk)
+            if self.progress is not None:
+                self.progress(self.bytes_sent, self.content_size, monotonic() - self.start)
+        yield self.tail
+
+    def __iter__(self):
+        """Iterates over the parts of the body (bytes or, for bytes-like
+        contents, memoryview slices, so that they are not copied)."""
+        return self.body
+
+    def read(self, size=-1):
+        """Reads up to size bytes of the body (as used by http.client), or
+        the rest of the body if size is negative."""
+        if size < 0:
+            return b''.join([bytes(self.buffer)] + list(self))
+        while not self.buffer:
+            chunk = next(self.body, None)
+            if chunk is None: return b''
+            self.buffer = memoryview(chunk).cast('B')
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        """Stops the body, releasing the references to the content (e.g. the
+        memoryview slices of a mmap, that could not be closed otherwise)."""
+        self.body.close()
+        if hasattr(self.chunks, 'close'):
+            self.chunks.close()
+        self.chunks = iter(())
+        self.buffer = memoryview(b'')
@@ -28,11 +28,18 @@ __email__ = "jcgonzalez@sciops.esa.int"
 __status__ = "Prototype" # Prototype | Development | Production
 
 
-from time import sleep
-from xml.dom.minidom import parseString
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
+from time import monotonic, sleep
+from uws.uws_job import UWS_Job_Waiter
+from uws.http_session import default_session
+from uws.metrics import Metrics
+from uws.retry import Retry_Policy
+from vos.multipart import Multipart_Stream, is_buffer, iter_gzip
+from vos.vos_node import parse_container
 
 import requests
-import sys
+import json, mmap, os, re
 
 requests.packages.urllib3.disable_warnings()
 
@@ -43,6 +50,101 @@ except:
     from requests.packages.urllib3.exceptions import InsecureRequestWarning
     requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
+class VOSpace_Error(Exception):
+    """
+    Error in a VOSpace storage or retrieval request
+    """
+    pass
+
+
+class VOSpace_Auth_Error(VOSpace_Error):
+    """
+    Missing or rejected VOSpace credentials
+    """
+    pass
+
+
+class VOSpace_Job_Error(VOSpace_Error):
+    """
+    VOSpace transfer job finished in the ERROR or ABORTED phase
+    """
+
+    def __init__(self, message, phase=None, error_summary=None):
+        super(VOSpace_Job_Error, self).__init__(message)
+        self.phase = phase
+        self.error_summary = error_summary
+
+
+class VOSpace_Transfer_Error(VOSpace_Error):
+    """
+    Failed HTTP request (network error or HTTP error status) to VOSpace.
+    Network errors and 5xx/429 status codes are considered transient, and
+    the request can be retried.
+    """
+
+    def __init__(self, message, status=None):
+        super(VOSpace_Transfer_Error, self).__init__(message)
+        self.status = status
+        self.retryable = status is None or status >= 500 or status == 429
+
+
+def is_retryable(e):
+    """Tells whether a failed request can be retried."""
+    return isinstance(e, VOSpace_Transfer_Error) and e.retryable
+
+
+def status_error(what, status, reason):
+    """Returns the VOSpace_Error corresponding to an HTTP error status."""
+    message = "{} failed with HTTP status {} {}".format(what, status, reason)
+    if status in (401, 403):
+        return VOSpace_Auth_Error(message)
+    return VOSpace_Transfer_Error(message, status)
+
+
+def check_response(response, what):
+    """Raises the corresponding VOSpace_Error if the response has an HTTP
+    error status."""
+    if response.ok:
+        return response
+    response.close()
+    raise status_error(what, response.status_code, response.reason)
+
+
+def response_validator(response):
+    """Returns the validator of the data of a response, to be sent in the
+    If-Range header of a later range request: its strong ETag or, if there
+    is none, its Last-Modified date (None if it has neither)."""
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def response_range(response):
+    """Returns the first byte and the total size of the data (None if
+    unknown) of a response, from its Content-Range header (206) or its
+    Content-Length header (200)."""
+    if response.headers.get('Content-Encoding', 'identity') != 'identity':
+        return 0, None
+    if response.status_code == 206:
+        match = re.match(r'bytes\s+(\d+)-\d+/(\d+|\*)', response.headers.get('Content-Range', ''))
+        if match is None:
+            return None, None
+        total = match.group(2)
+        return int(match.group(1)), int(total) if total != '*' else None
+    length = response.headers.get('Content-Length')
+    return 0, int(length) if length is not None else None
+
+
+def changed_error(folder):
+    """Returns the (not retryable) error raised when a download cannot be
+    resumed, because the remote data changed."""
+    e = VOSpace_Transfer_Error("Download from {} cannot be resumed: the remote data changed"
+                               .format(folder))
+    e.retryable = False
+    return e
+
+
 class VOSpace_Handler(object):
     '''
     Main class to encapsulate VOSpace storage functions
@@ -50,6 +152,14 @@ class VOSpace_Handler(object):
 
     VOSpace_Url = 'https://vospace.esac.esa.int/vospace'
 
+    Nodes_Path = '/nodes/'
+
+    Chunk_Size = 1024 * 1024
+
+    # Connect and read timeouts (seconds) of the HTTP requests: a request
+    # whose server sends no data for the read timeout fails (and is retried)
+    Timeout = (10, 60)
+
     Tx_XML_File = """<vos:transfer xmlns:vos="http://www.ivoa.net/xml/VOSpace/v2.0">
                          <vos:target>vos://esavo!vospace/{}/{}</vos:target>
                          <vos:direction>{}</vos:direction>
@@ -57,185 +167,535 @@ class VOSpace_Handler(object):
                          <vos:protocol uri="vos://esavo!vospace/core#httpput"/>
                      </vos:transfer>"""
 
-    def __init__(self):
-        """Initialize object (class instance) attributes."""
+    def __init__(self, waiter=None, session=None, retry=None, metrics=None, vospace_url=None,
+                 reuse_transfers=False, timeout=None):
+        """Initialize object (class instance) attributes.  The transfer jobs
+        are monitored with the provided UWS_Job_Waiter, or with a default one,
+        whose polls attribute holds the number of polls made.  All the HTTP
+        requests are made through the provided session, or through a session
+        of its own (with its own cookies) that uses the connection pool
+        shared in the process (see default_session()).  Transient
+        failures are retried according to the provided Retry_Policy, or to a
+        default one.  The duration of each phase (vos_negotiate, vos_upload,
+        vos_download...), the number of polls and retries, and the bytes
+        transferred are recorded in the provided Metrics object, or in one
+        owned by the object.  The requests are sent to the VOSpace service
+        at vospace_url (VOSpace_Url by default).  If reuse_transfers is True,
+        the transfer negotiated for a folder is reused for all the uploads to
+        that folder (and negotiated again if the service rejects it), until
+        clear_transfers() is called.  Each request fails if it takes longer
+        than the provided timeout (Timeout by default) to connect or to
+        receive data."""
+        self.vospace_url = vospace_url if vospace_url is not None else VOSpace_Handler.VOSpace_Url
+        self.timeout = timeout if timeout is not None else VOSpace_Handler.Timeout
         self.vospace_user = ""
         self.vospace_pwd = ""
         self.vospace_auth_set = False
 
+        self.waiter = waiter if waiter is not None else UWS_Job_Waiter()
+        self.session = session if session is not None else default_session()
+        self.retry = retry if retry is not None else Retry_Policy()
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        self.reuse_transfers = reuse_transfers
+        self.transfers = {}
+        self.transfers_lock = Lock()
+
     def set_auth(self, user, pwd):
         """Specifies the VOSpace user/passsword credentials to be used."""
         self.vospace_user = user
         self.vospace_pwd = pwd
         self.vospace_auth_set = True
 
-    def save_to_file(self, folder, file, content, user=None, pwd=None):
-        """Makes a storage request, followed by the sending the actual data to be
-        stored in the desired folder/file.  The VOSpace user credentials are needed."""
+    def credentials(self, user=None, pwd=None):
+        """Returns the credentials to use: the ones provided, or else the ones
+        specified with set_auth()."""
         if user is None or pwd is None:
             if not self.vospace_auth_set:
-                print ("ERROR: VOSpace credentials not provided")
-                sys.exit(1)
-            else:
-                user = self.vospace_user
-                pwd = self.vospace_pwd
+                raise VOSpace_Auth_Error("VOSpace credentials not provided")
+            user = self.vospace_user
+            pwd = self.vospace_pwd
+        return user, pwd
+
+    def request(self, method, url, what, **kwargs):
+        """Makes an HTTP request through the session, raising the corresponding
+        VOSpace_Error if it fails (or does not respond within the timeout)."""
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:  # This is the correct syntax
+            raise VOSpace_Transfer_Error("{} failed: {}".format(what, e))
+        return check_response(response, what)
+
+    def negotiate(self, folder, direction, user, pwd, verify=True):
+        """Posts the transfer document for the folder (or folder/file) and
+        direction, and waits for the transfer job to be completed.  Returns
+        the transfer job URL and the job id."""
+        transfer_url = self.vospace_url + '/servlet/transfers/async?PHASE=RUN'
+        if direction == 'pushToVoSpace':
+            metadataTransfer = 'transfer_push_to_a.xml'  # Contains the path where to store the output file
+        else:
+            metadataTransfer = 'transfer_pull_from_a.xml'
+
+        txData = VOSpace_Handler.Tx_XML_File.format(user, folder, direction)
+        #print(txData + '\n');
+        files = {'file': (metadataTransfer, txData)}
+
+        with self.metrics.timer('vos_negotiate'):
+            upload_request = self.request('POST', transfer_url, "Transfer negotiation",
+                                          files=files, auth=(user, pwd), verify=verify)
+            redirection = upload_request.url
+            upload_request.close()
+
+            phase, job, polls = self.waiter.wait(
+                redirection,
+                lambda url: self.request('GET', url, "Transfer job status",
+                                         auth=(user, pwd), verify=verify).text,
+                self.metrics, 'vos_job')
+        if phase != 'COMPLETED':
+            raise VOSpace_Job_Error("Transfer job {} finished in phase {}: {}".format(
+                redirection, phase, job.error_summary), phase, job.error_summary)
+        return redirection, job.job_id
+
+    def delete_job(self, redirection, user, pwd):
+        """Removes the asynchronous transfer job from the jobs queue (errors
+        are ignored, as the job would expire anyway)."""
+        # curl -v -u <user> -X DELETE "https://localhost:8443/vospace/servlet/transfers/async/<job_Id>"
+        try:
+            self.session.delete(redirection, auth=(user, pwd), verify=False,
+                                timeout=self.timeout).close()
+        except requests.exceptions.RequestException:
+            pass
+
+    def push_transfer(self, folder, user, pwd):
+        """Returns the transfer (job URL and job id) to upload files to the
+        folder: the one already negotiated for the folder, if transfers are
+        reused, or else a new one."""
+        if not self.reuse_transfers:
+            return self.negotiate(folder, 'pushToVoSpace', user, pwd)
+        key = (user, folder)
+        with self.transfers_lock:
+            transfer = self.transfers.get(key)
+        if transfer is not None:
+            self.metrics.count('vos_transfers_reused')
+            return transfer
+        transfer = self.negotiate(folder, 'pushToVoSpace', user, pwd)
+        with self.transfers_lock:
+            kept = self.transfers.setdefault(key, transfer)
+        if kept is not transfer:
+            # Negotiated at the same time by another thread
+            self.delete_job(transfer[0], user, pwd)
+        return kept
+
+    def forget_transfer(self, folder, user, transfer):
+        """Stops reusing a transfer, e.g. after it has been rejected."""
+        with self.transfers_lock:
+            if self.transfers.get((user, folder)) == transfer:
+                del self.transfers[(user, folder)]
+
+    def clear_transfers(self):
+        """Removes the transfer jobs kept for reuse."""
+        with self.transfers_lock:
+            transfers, self.transfers = self.transfers, {}
+        for (user, folder), (redirection, jobId) in transfers.items():
+            pwd = self.vospace_pwd if user == self.vospace_user else None
+            if pwd is not None:
+                self.delete_job(redirection, user, pwd)
+
+    def save_to_file(self, folder, file, content, user=None, pwd=None, progress=None,
+                     transfer=None, compress=False):
+        """Makes a storage request, followed by the sending the actual data to be
+        stored in the desired folder/file.  The VOSpace user credentials are needed.
+        The content (bytes-like object, binary file object or iterator of chunks
+        of bytes) is streamed, chunk by chunk, and progress(bytes_sent,
+        total_bytes, elapsed_seconds) is called after each chunk, if provided.
+        After a transient failure, the whole transfer is restarted according to
+        the retry policy, unless the content is an iterator (or a non seekable
+        file object), that cannot be read again.  Raises VOSpace_Error (or one
+        of its subclasses) if the transfer fails.  If provided, the transfer
+        (job URL and job id, as returned by negotiate()) is used for the first
+        attempt, instead of negotiating a new one.  If compress is True, the
+        content is compressed on the fly in gzip format, and stored with the
+        '.gz' extension added to the file name (if not already there); the
+        progress is then reported for the compressed bytes sent."""
+        user, pwd = self.credentials(user, pwd)
 
         #print ("Saving query results in VOSpace private account for user: " + user)
 
-        transfer_url = VOSpace_Handler.VOSpace_Url + '/servlet/transfers/async?PHASE=RUN'
-        end_point = VOSpace_Handler.VOSpace_Url + '/service/data/'
+        if compress and not file.endswith('.gz'):
+            file += '.gz'
 
-        metadataTransfer = 'transfer_push_to_a.xml'  # Contains the path where to store the output file
-        toupload = file  # Name of the file to be uploaded in VOSpace
+        restartable = is_buffer(content) or (hasattr(content, 'seekable') and content.seekable())
+        start_pos = content.tell() if restartable and not is_buffer(content) else None
+        transfers = [transfer]
 
-        txData = VOSpace_Handler.Tx_XML_File.format(user, folder, 'pushToVoSpace')
-        #print(txData + '\n');
-        files = {'file': (metadataTransfer, txData)}
+        def attempt():
+            if start_pos is not None:
+                content.seek(start_pos)
+            data = iter_gzip(content, VOSpace_Handler.Chunk_Size) if compress else content
+            return self.push(folder, file, data, user, pwd, progress, transfers.pop() if transfers else None)
 
-        try:
-            upload_request = requests.post(transfer_url, files=files, auth=(user, pwd))
-        except requests.exceptions.RequestException as e:  # This is the correct syntax
-            #print (upload_request.text)
-            sys.exit(1)
-        else:  # 200
-            redirection = upload_request.url
-            jobid = redirection[redirection.rfind('/') + 1:]
-
-        upload_request.close()
-
-        while True:
-            request = requests.get(redirection, auth=(user, pwd))
-            # XML response: parse it to obtain the current status
-            data = request.text
-            #print (data + '\n')
-            dom = parseString(data)
-            phaseElement = dom.getElementsByTagName('uws:phase')[0]
-            phaseValueElement = phaseElement.firstChild
-            phase = phaseValueElement.toxml()
-            #print ("Status: " + phase)
-            # Check finished
-            if phase == 'COMPLETED': break
-            if phase == 'ERROR': sys.exit(1)
-            # wait and repeat
-            sleep(0.3)
-
-        # Open XML document using minidom parser
-        DOMTree = parseString(data)
-        collection = DOMTree.documentElement
-        jobId_element = collection.getElementsByTagName('uws:jobId')[0]
-        jobId = jobId_element.childNodes[0].data
-
-        files = {'file': (toupload, content)}
+        if not restartable:
+            return attempt()
+        return self.retry.call(attempt, is_retryable, self.count_retry)
+
+    def count_retry(self, exception, delay):
+        """Counts a retry of a failed transfer."""
+        self.metrics.count('vos_retries')
 
+    def push(self, folder, file, content, user, pwd, progress=None, transfer=None):
+        """Makes a storage request (unless a negotiated transfer is provided,
+        or one can be reused), and sends the content (once)."""
+        end_point = self.vospace_url + '/service/data/'
+        toupload = file  # Name of the file to be uploaded in VOSpace
+
+        if transfer is None:
+            transfer = self.push_transfer(folder, user, pwd)
+        redirection, jobId = transfer
+
+        body = Multipart_Stream('file', toupload, content, progress=progress)
         try:
-            upload_post = requests.post(end_point + user + "/" + jobId, files=files, auth=(user, pwd))
-        except requests.exceptions.RequestException as e:  # This is the correct syntax
-            #print (upload_post.text)
-            sys.exit(1)
-        else:  # 200
-            #print(upload_post.text)
-            redirection = upload_post.url
-            jobid = redirection[redirection.rfind('/') + 1:]
-            #print ("Job id: " + jobid)
+            with self.metrics.timer('vos_upload'):
+                upload_post = self.request('POST', end_point + user + "/" + jobId,
+                                           "Upload of {}".format(toupload), data=body,
+                                           headers={'Content-Type': body.content_type},
+                                           auth=(user, pwd))
+        except VOSpace_Transfer_Error as e:
+            if self.reuse_transfers and e.status is not None and 400 <= e.status < 500:
+                # The transfer cannot be reused anymore: negotiate a new one if retried
+                self.forget_transfer(folder, user, transfer)
+                e.retryable = True
+            raise
+        finally:
+            self.metrics.count('vos_upload_bytes', body.bytes_sent)
+            # Release the chunks of the content before it is closed by the
+            # caller (a mmap cannot be closed while slices of it are alive)
+            body.close()
+            del body
         result = upload_post.ok
         upload_post.close()
         return result
 
-    def save_file(self, folder, file, local_file, user, pwd):
+    def save_file(self, folder, file, local_file, user=None, pwd=None, progress=None,
+                  use_mmap=False, transfer=None, compress=False):
         """Makes a storage request, followed by the sending the actual data to be
-        stored in the desired folder/file.  The VOSpace user credentials are needed."""
+        stored in the desired folder/file.  The VOSpace user credentials are needed.
+        The local file is streamed, chunk by chunk, read from the file or, if
+        use_mmap is True, sent directly from a memory map of the file."""
         with open(local_file, "rb") as bin_file:
-            # Read the whole file at once
-            bin_data = bin_file.read()
-        return self.save_to_file(folder, file, bin_data, user, pwd)
+            if not use_mmap or os.fstat(bin_file.fileno()).st_size == 0:
+                return self.save_to_file(folder, file, bin_file, user, pwd, progress, transfer,
+                                         compress)
+            with mmap.mmap(bin_file.fileno(), 0, access=mmap.ACCESS_READ) as file_map:
+                return self.save_to_file(folder, file, file_map, user, pwd, progress, transfer,
+                                         compress)
+
+    def save_files(self, folder, local_files, user=None, pwd=None, max_workers=4,
+                   pipeline=True, compress=False):
+        """Stores several local files in the desired folder, keeping their base
+        names, using up to max_workers concurrent transfers.  Returns a dict
+        with, for each local file, the result of save_file() (True/False), or
+        the exception raised if its transfer failed.  If pipeline is True (and
+        transfers are not reused), the transfer for each file is negotiated
+        in advance, while the previous files are being uploaded, so that the
+        negotiation latency is hidden."""
+        user, pwd = self.credentials(user, pwd)
+        local_files = list(local_files)
+        results = {}
+        negotiator = None
+        transfers = {}
+        claimed = set()
+        lock = Lock()
+        if pipeline and not self.reuse_transfers:
+            negotiator = ThreadPoolExecutor(max_workers=max_workers)
+
+        def negotiate_ahead(i):
+            with lock:
+                if i < len(local_files) and i not in claimed:
+                    transfers[i] = negotiator.submit(self.negotiate, folder, 'pushToVoSpace', user, pwd)
+
+        def save(i):
+            transfer = None
+            if negotiator is not None:
+                # Negotiate the transfer of a later file while this one is uploaded
+                negotiate_ahead(i + max_workers)
+                with lock:
+                    claimed.add(i)
+                    negotiation = transfers.pop(i, None)
+                try:
+                    transfer = negotiation.result() if negotiation is not None else None
+                except VOSpace_Error:
+                    pass  # Negotiated again by save_file()
+            return self.save_file(folder, os.path.basename(local_files[i]), local_files[i],
+                                  user, pwd, transfer=transfer, compress=compress)
+
+        try:
+            if negotiator is not None:
+                for i in range(max_workers):
+                    negotiate_ahead(i)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(save, i): local_file
+                           for i, local_file in enumerate(local_files)}
+                for future in as_completed(futures):
+                    try:
+                        results[futures[future]] = future.result()
+                    except Exception as e:
+                        results[futures[future]] = e
+        finally:
+            if negotiator is not None:
+                negotiator.shutdown()
+                # Transfers negotiated but not used
+                for negotiation in transfers.values():
+                    if negotiation.exception() is None:
+                        self.delete_job(negotiation.result()[0], user, pwd)
+        return results
 
     def retrieve_from_file(self, folder, file, user=None, pwd=None):
         """Makes a retrieval request, followed by the retrieval of the actual data to be
                 stored in a local file.  The VOSpace user credentials are needed."""
-        if user is None or pwd is None:
-            if not self.vospace_auth_set:
-                print ("ERROR: VOSpace credentials not provided")
-                sys.exit(1)
-            else:
-                user = self.vospace_user
-                pwd = self.vospace_pwd
-
+        return b''.join(self.retrieve_stream(folder, file, user, pwd))
+
+    def retrieve_stream(self, folder, file, user=None, pwd=None, chunk_size=None, progress=None,
+                        offset=0, validator=None, length=None, on_start=None):
+        """Makes a retrieval request, and returns an iterator over the actual data,
+        as chunks of bytes of at most chunk_size bytes, read from the network as
+        they are consumed, starting at byte offset.  If provided, progress(
+        bytes_received, total_bytes, elapsed_seconds) is called after each chunk
+        (total_bytes may be None).  The VOSpace user credentials are needed.
+        After a transient failure, the download is resumed (with an HTTP Range
+        request) from the last byte received, according to the retry policy.
+        Raises VOSpace_Error (or one of its subclasses) if the transfer fails.
+
+        A range request is sent with an If-Range header with the validator
+        (ETag or Last-Modified date) of the data already received, if known,
+        and the range returned is checked against the position and against
+        length (the total size of the data, if known).  If the remote data
+        changed, the data received so far cannot be used: the data are then
+        downloaded again from the start if on_start is provided, or else a
+        (not retryable) VOSpace_Transfer_Error is raised.  If provided,
+        on_start(position, validator, length) is called before the data of
+        each response, with the position they start at (0 if the data
+        received before must be discarded), and the validator and total size
+        of the remote data."""
+        user, pwd = self.credentials(user, pwd)
+        if chunk_size is None:
+            chunk_size = VOSpace_Handler.Chunk_Size
         # URL for Download request
-        transfer_url = VOSpace_Handler.VOSpace_Url + '/servlet/transfers/async?PHASE=RUN'
-        end_point = VOSpace_Handler.VOSpace_Url + '/service/data/'
-
-        metadataTransfer = 'transfer_pull_from_a.xml'  # Contains the path where to store the output file
-        todownload = file
-
-        txData = VOSpace_Handler.Tx_XML_File.format(user, folder, 'pullFromVoSpace')
-        #print(txData + '\n');
-        files = {'file': (metadataTransfer, txData)}
-
-        # initial negotiation
-        try:
-            upload_request = requests.post(transfer_url, files=files, auth=(user, pwd), verify=False)
-        except requests.exceptions.RequestException as e:  # This is the correct syntax
-            print ("PROBLEM UPLOAD: " + upload_request.text)
-        else:  # 200
-            #print (upload_request.status_code)
-            redirection = upload_request.url
-            jobid = redirection[redirection.rfind('/') + 1:]
-            #print ("Job id: " + jobid)
-            upload_request.close()
-
-        # Check job status till completed phase
-        while True:
-            request = requests.get(redirection, auth=(user, pwd), verify=False)
-            # XML response: parse it to obtain the current status
-            data = request.text
-            dom = parseString(data)
-            phaseElement = dom.getElementsByTagName('uws:phase')[0]
-            phaseValueElement = phaseElement.firstChild
-            phase = phaseValueElement.toxml()
-            #print ("Status: " + phase)
-            # Check finished
-            if phase == 'COMPLETED': break
-            if phase == 'ERROR': exit(1)
-            # wait and repeat
-            sleep(0.3)
-
-        # Open XML document using minidom parser
-        DOMTree = parseString(data)
-        collection = DOMTree.documentElement
-        jobId_element = collection.getElementsByTagName('uws:jobId')[0]
-        jobId = jobId_element.childNodes[0].data
-
-        content = ''
+        end_point = self.vospace_url + '/service/data/'
 
+        received = offset
+        total = length
+        start = monotonic()
+        delays = self.retry.delays()
+        redirection = None
         try:
-            download = requests.get(end_point + user + "/" + jobId, auth=(user, pwd), verify=False)
-        except requests.exceptions.RequestException as e:  # This is the correct syntax
-            print ("PROBLEM: " + download.text)
-            exit(1)
-        else:  # 200
-            content = download.content
-            # with open(todownload, 'wb') as f:
-            #     f.write(download.content)
-            # # print(upload_post.text)
-            redirection_upload = download.url
-            jobid = redirection_upload[redirection_upload.rfind('/') + 1:]
-            #print ("Job id: " + jobid)
-            download.close()
-
-        result = download.ok
-        # Asynchronous job to be removed from the jobs queue
-        # curl -v -u <user> -X DELETE "https://localhost:8443/vospace/servlet/transfers/async/<job_Id>"
-        request = requests.delete(redirection, auth=(user, pwd), verify=False)
-        #print(request.status_code)
-        return content
-
-    def retrieve_file(self, folder, file, local_file, user=None, pwd=None):
+            while True:
+                try:
+                    if redirection is None:
+                        redirection, jobId = self.retry.call(
+                            lambda: self.negotiate(folder, 'pullFromVoSpace', user, pwd, verify=False),
+                            is_retryable, self.count_retry)
+                    headers = {}
+                    if received:
+                        headers['Range'] = 'bytes={}-'.format(received)
+                        if validator is not None:
+                            headers['If-Range'] = validator
+                    try:
+                        download = self.request('GET', end_point + user + "/" + jobId,
+                                                "Download from {}".format(folder), auth=(user, pwd),
+                                                verify=False, stream=True, headers=headers)
+                    except VOSpace_Transfer_Error as e:
+                        # Range not satisfiable: the remote data are now shorter
+                        if e.status != 416 or not received: raise
+                        if on_start is None: raise changed_error(folder)
+                        received, validator, total = 0, None, None
+                        continue
+                    try:
+                        skip = 0
+                        first, size = response_range(download)
+                        if download.status_code == 206:
+                            if first != received or (total is not None and size not in (None, total)):
+                                if on_start is None: raise changed_error(folder)
+                                received, validator, total = 0, None, None
+                                continue
+                            if size is None and first is not None:
+                                length = download.headers.get('Content-Length')
+                                size = received + int(length) if length is not None else None
+                        elif received:
+                            # The whole data were sent instead of the range requested
+                            if on_start is not None:
+                                received = 0
+                            elif 'If-Range' in headers or (total is not None and size not in (None, total)):
+                                raise changed_error(folder)
+                            else:
+                                skip = received
+                        validator = response_validator(download) or validator
+                        total = size if size is not None else total
+                        if on_start is not None:
+                            on_start(received, validator, total)
+                        for chunk in self.metrics.timed_iter('vos_download',
+                                                             download.iter_content(chunk_size),
+                                                             'vos_download_bytes'):
+                            if skip:
+                                chunk, skip = chunk[skip:], max(skip - len(chunk), 0)
+                                if not chunk: continue
+                            yield chunk
+                            received += len(chunk)
+                            if progress is not None:
+                                progress(received, total, monotonic() - start)
+                    except requests.exceptions.RequestException as e:
+                        raise VOSpace_Transfer_Error("Download from {} interrupted: {}".format(folder, e))
+                    finally:
+                        download.close()
+                    if total is not None and received != total:
+                        raise VOSpace_Transfer_Error("Download from {} incomplete: {} of {} bytes"
+                                                     .format(folder, received, total))
+                    return
+                except VOSpace_Transfer_Error as e:
+                    delay = next(delays, None) if e.retryable else None
+                    if delay is None: raise
+                    self.count_retry(e, delay)
+                    sleep(delay)
+                    if e.status is not None and redirection is not None:
+                        # The transfer job may not be usable anymore: negotiate a new one
+                        self.delete_job(redirection, user, pwd)
+                        redirection = None
+        finally:
+            # Asynchronous job to be removed from the jobs queue
+            if redirection is not None:
+                self.delete_job(redirection, user, pwd)
+
+    def retrieve_file(self, folder, file, local_file, user=None, pwd=None, progress=None,
+                      resume=True):
         """Makes a retrieval request, followed by the retrieval of the actual data to be
-                stored in a local file.  The VOSpace user credentials are needed."""
-        with open(local_file, "wb") as bin_file:
-            # Read the whole file at once
-            bin_file.write(self.retrieve_from_file(folder, file, user, pwd))
-
+                stored in a local file.  The VOSpace user credentials are needed.
+        The data are written to a partial file (local_file + '.part') as they are
+        received, and the file is renamed to local_file only when complete.  The
+        validator (ETag or Last-Modified date) and the size of the remote data are
+        stored along with it (in local_file + '.part.info').  If resume is True and
+        a partial file exists from a previous (interrupted) call, the download
+        continues from its end, unless the remote data changed in the meantime,
+        in which case the partial file is discarded."""
+        part_file = local_file + '.part'
+        info_file = part_file + '.info'
+        offset, validator, length = 0, None, None
+        if resume and os.path.exists(part_file):
+            validator, length = VOSpace_Handler.partial_info(local_file)
+            offset = os.path.getsize(part_file)
+            # A partial file that cannot be validated is not trusted
+            if validator is None or (length is not None and offset > length):
+                offset, validator, length = 0, None, None
+
+        with open(part_file, "r+b" if offset else "wb") as bin_file:
+            bin_file.seek(offset)
+            bin_file.truncate()
+
+            def on_start(position, validator, length):
+                if position != bin_file.tell():
+                    bin_file.seek(position)
+                    bin_file.truncate()
+                with open(info_file, "w") as info:
+                    json.dump([validator, length], info)
+
+            for chunk in self.retrieve_stream(folder, file, user, pwd, progress=progress,
+                                              offset=offset, validator=validator, length=length,
+                                              on_start=on_start):
+                bin_file.write(chunk)
+            size = bin_file.tell()
+        with open(info_file) as info:
+            validator, length = json.load(info)
+        if length is not None and size != length:
+            raise VOSpace_Transfer_Error("Download from {} incomplete: {} of {} bytes"
+                                         .format(folder, size, length))
+        os.replace(part_file, local_file)
+        os.unlink(info_file)
+
+    @staticmethod
+    def partial_info(local_file):
+        """Returns the validator and the total size of the remote data stored
+        by retrieve_file() for the partial file of local_file (None, None if
+        there is none)."""
+        try:
+            with open(local_file + '.part.info') as info:
+                validator, length = json.load(info)
+            return validator, length
+        except (OSError, ValueError, TypeError):
+            return None, None
+
+    def list_folder(self, folder, user=None, pwd=None):
+        """Returns the list of nodes (VOSpace_Node) in the desired folder, with
+        their type, size and modification date."""
+        user, pwd = self.credentials(user, pwd)
+        listing = self.request('GET', self.vospace_url + VOSpace_Handler.Nodes_Path + user + "/" + folder,
+                               "Listing of {}".format(folder), params={'detail': 'max'},
+                               auth=(user, pwd), verify=False)
+        try:
+            return parse_container(listing.content)
+        finally:
+            listing.close()
+
+    @staticmethod
+    def is_up_to_date(node, local_file):
+        """Tells whether the local file has the same size and modification
+        date (to the second) as the VOSpace node."""
+        if node.length is None or node.date is None:
+            return False
+        try:
+            stat = os.stat(local_file)
+        except OSError:
+            return False
+        return stat.st_size == node.length and abs(stat.st_mtime - node.date) < 1.0
+
+    def mirror_folder(self, folder, local_dir, user=None, pwd=None, max_workers=4,
+                      recursive=True):
+        """Downloads the files of the desired folder (and, if recursive is True,
+        of its sub-folders) into the local folder local_dir, using up to
+        max_workers concurrent transfers.  The files whose local copy has the
+        same size and modification date are skipped, and the downloaded files
+        get the modification date of the VOSpace node, so that repeated calls
+        only download the files that changed.  The partial file left by an
+        interrupted call is resumed only if it was downloaded when the remote
+        file had its current size.  An empty local_dir is the current folder.
+        Returns a dict with, for each file (path relative to folder), True if
+        it was downloaded, False if it was skipped, or the exception raised if
+        its transfer failed."""
+        user, pwd = self.credentials(user, pwd)
+        folder = folder.strip('/')
+        local_dir = os.path.abspath(local_dir)
+
+        def download(path, node, local_file):
+            os.makedirs(os.path.dirname(local_file), exist_ok=True)
+            resume = node.length is not None and \
+                VOSpace_Handler.partial_info(local_file)[1] == node.length
+            self.retrieve_file(folder + '/' + path, '', local_file, user, pwd, resume=resume)
+            if node.date is not None:
+                os.utime(local_file, (node.date, node.date))
+            return True
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            pending = ['']
+            while pending:
+                sub_folder = pending.pop()
+                for node in self.list_folder((folder + '/' + sub_folder).rstrip('/'), user, pwd):
+                    if node.name in ('', '.', '..'): continue
+                    path = (sub_folder + '/' + node.name).lstrip('/')
+                    if node.type == 'ContainerNode':
+                        if recursive: pending.append(path)
+                        continue
+                    local_file = os.path.join(local_dir, *path.split('/'))
+                    if VOSpace_Handler.is_up_to_date(node, local_file):
+                        results[path] = False
+                        self.metrics.count('vos_mirror_skipped')
+                    else:
+                        futures[executor.submit(download, path, node, local_file)] = path
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    results[futures[future]] = e
+        return results
 
 def main():
     """Sample usage of the VOSpace_Push class"""
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Async_VOSpace_Handler class from package vos
+
+This module provides an asyncio counterpart of the VOSpace_Handler class,
+to store and retrieve content in the user VOSpace account from an event
+loop, without blocking it.  The transfer jobs are monitored with
+non-blocking polling, and the data are streamed in both directions.
+
+This module requires the ``aiohttp`` package.
+
+Usage:
+    The sequence of commands to store and retrieve a file would be::
+
+        async with Async_VOSpace_Handler() as vos:
+            vos.set_auth(user, pwd)
+            await vos.save_to_file(folder, file, content)
+            await vos.retrieve_file(folder, file, local_file)
+
+    The data can also be retrieved as a stream of chunks, within a context
+    that removes the transfer job when exited::
+
+        async with vos.retrieve_stream(folder, file) as chunks:
+            async for chunk in chunks:
+                ...
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from contextlib import asynccontextmanager
+from time import monotonic
+from uws.uws_job import UWS_Job_Waiter
+from vos.multipart import Multipart_Stream, is_buffer
+from vos.vos_handler import VOSpace_Handler, VOSpace_Auth_Error, VOSpace_Job_Error, \
+    VOSpace_Transfer_Error, status_error
+
+import aiohttp
+import asyncio, os, tempfile
+
+
+def check_response(response, what):
+    """Raises the corresponding VOSpace_Error if the (aiohttp) response has
+    an HTTP error status."""
+    if response.status >= 400:
+        raise status_error(what, response.status, response.reason)
+    return response
+
+
+class Async_VOSpace_Handler(object):
+    '''
+    Main class to encapsulate VOSpace storage functions, for asyncio clients
+    '''
+
+    def __init__(self, waiter=None, session=None, vospace_url=None):
+        """Initialize object (class instance) attributes.  The HTTP requests
+        are made through the provided aiohttp.ClientSession, or through a
+        session owned by the object, created when first needed and closed
+        by close().  The requests are sent to the VOSpace service at
+        vospace_url (VOSpace_Handler.VOSpace_Url by default)."""
+        self.vospace_url = vospace_url if vospace_url is not None else VOSpace_Handler.VOSpace_Url
+        self.vospace_user = ""
+        self.vospace_pwd = ""
+        self.vospace_auth_set = False
+
+        self.waiter = waiter if waiter is not None else UWS_Job_Waiter()
+        self.session = session
+        self.own_session = session is None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def get_session(self):
+        """Returns the HTTP session, creating it if needed."""
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    async def close(self):
+        """Closes the HTTP session, if it is owned by the object."""
+        if self.own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def set_auth(self, user, pwd):
+        """Specifies the VOSpace user/passsword credentials to be used."""
+        self.vospace_user = user
+        self.vospace_pwd = pwd
+        self.vospace_auth_set = True
+
+    def credentials(self, user=None, pwd=None):
+        """Returns the credentials to use, as an aiohttp.BasicAuth object."""
+        if user is None or pwd is None:
+            if not self.vospace_auth_set:
+                raise VOSpace_Auth_Error("VOSpace credentials not provided")
+            user = self.vospace_user
+            pwd = self.vospace_pwd
+        return aiohttp.BasicAuth(user, pwd)
+
+    async def negotiate(self, folder, direction, auth, metadataTransfer, ssl=None):
+        """Posts the transfer document, and waits for the transfer job to be
+        completed.  Returns the job URL and the job id."""
+        transfer_url = self.vospace_url + '/servlet/transfers/async?PHASE=RUN'
+        txData = VOSpace_Handler.Tx_XML_File.format(auth.login, folder, direction)
+        form = aiohttp.FormData()
+        form.add_field('file', txData, filename=metadataTransfer)
+
+        session = self.get_session()
+        try:
+            async with session.post(transfer_url, data=form, auth=auth, ssl=ssl) as response:
+                check_response(response, "Transfer negotiation")
+                redirection = str(response.url)
+        except aiohttp.ClientError as e:
+            raise VOSpace_Transfer_Error("Transfer negotiation failed: {}".format(e))
+
+        async def fetch(url):
+            try:
+                async with session.get(url, auth=auth, ssl=ssl) as response:
+                    check_response(response, "Transfer job status request")
+                    return await response.text()
+            except aiohttp.ClientError as e:
+                raise VOSpace_Transfer_Error("Transfer job status request failed: {}".format(e))
+
+        phase, job, polls = await self.waiter.wait_async(redirection, fetch)
+        if phase != 'COMPLETED':
+            raise VOSpace_Job_Error("Transfer job {} finished in phase {}: {}".format(
+                redirection, phase, job.error_summary), phase, job.error_summary)
+        return redirection, job.job_id
+
+    async def save_to_file(self, folder, file, content, user=None, pwd=None, progress=None):
+        """Makes a storage request, followed by the sending the actual data to be
+        stored in the desired folder/file.  The content (see save_to_file() in
+        VOSpace_Handler) is streamed with chunked transfer encoding; file
+        objects and iterators are read in a worker thread, so that the event
+        loop is not blocked.  Raises VOSpace_Error (or one of its subclasses)
+        if the transfer fails."""
+        auth = self.credentials(user, pwd)
+        redirection, jobId = await self.negotiate(folder, 'pushToVoSpace', auth,
+                                                  'transfer_push_to_a.xml')
+
+        end_point = self.vospace_url + '/service/data/'
+        body = Multipart_Stream('file', file, content, progress=progress)
+        blocking = not is_buffer(content)
+
+        async def body_chunks():
+            chunks = iter(body)
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None) if blocking else next(chunks, None)
+                if chunk is None: return
+                yield chunk
+
+        try:
+            async with self.get_session().post(end_point + auth.login + "/" + jobId,
+                                               data=body_chunks(),
+                                               headers={'Content-Type': body.content_type},
+                                               auth=auth) as response:
+                check_response(response, "Upload of {}".format(file))
+                return True
+        except aiohttp.ClientError as e:
+            raise VOSpace_Transfer_Error("Upload of {} failed: {}".format(file, e))
+        finally:
+            body.close()
+
+    async def save_file(self, folder, file, local_file, user=None, pwd=None, progress=None):
+        """Makes a storage request, followed by the sending the content of the
+        local file, streamed chunk by chunk."""
+        with open(local_file, "rb") as bin_file:
+            return await self.save_to_file(folder, file, bin_file, user, pwd, progress)
+
+    @asynccontextmanager
+    async def retrieve_stream(self, folder, file, user=None, pwd=None, chunk_size=None, progress=None):
+        """Makes a retrieval request, and returns an asynchronous context
+        manager that provides an asynchronous iterator over the actual data,
+        as chunks of bytes of at most chunk_size bytes.  If provided,
+        progress(bytes_received, total_bytes, elapsed_seconds) is called after
+        each chunk.  The transfer job is removed when the context is exited.
+        Raises VOSpace_Error (or one of its subclasses) if the transfer fails."""
+        auth = self.credentials(user, pwd)
+        if chunk_size is None:
+            chunk_size = VOSpace_Handler.Chunk_Size
+        redirection, jobId = await self.negotiate(folder, 'pullFromVoSpace', auth,
+                                                  'transfer_pull_from_a.xml', ssl=False)
+
+        end_point = self.vospace_url + '/service/data/'
+        session = self.get_session()
+
+        async def chunks(response):
+            total = response.content_length
+            received = 0
+            start = monotonic()
+            try:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    yield chunk
+                    received += len(chunk)
+                    if progress is not None:
+                        progress(received, total, monotonic() - start)
+            except aiohttp.ClientError as e:
+                raise VOSpace_Transfer_Error("Download from {} failed: {}".format(folder, e))
+
+        try:
+            async with session.get(end_point + auth.login + "/" + jobId,
+                                   auth=auth, ssl=False) as response:
+                check_response(response, "Download from {}".format(folder))
+                data = chunks(response)
+                try:
+                    yield data
+                finally:
+                    await data.aclose()
+        except aiohttp.ClientError as e:
+            raise VOSpace_Transfer_Error("Download from {} failed: {}".format(folder, e))
+        finally:
+            # Asynchronous job to be removed from the jobs queue
+            try:
+                async with session.delete(redirection, auth=auth, ssl=False):
+                    pass
+            except aiohttp.ClientError:
+                pass
+
+    async def retrieve_from_file(self, folder, file, user=None, pwd=None):
+        """Makes a retrieval request, and returns the actual data."""
+        async with self.retrieve_stream(folder, file, user, pwd) as chunks:
+            return b''.join([chunk async for chunk in chunks])
+
+    async def retrieve_file(self, folder, file, local_file, user=None, pwd=None, progress=None):
+        """Makes a retrieval request, and stores the actual data in a local file,
+        written as they are received (in a worker thread, so that the event
+        loop is not blocked) to a temporary file that is renamed to local_file
+        only when complete."""
+        local_dir, local_name = os.path.split(os.path.abspath(local_file))
+        tmp_file = tempfile.NamedTemporaryFile(dir=local_dir, prefix='.' + local_name + '.',
+                                               suffix='.part', delete=False)
+        try:
+            with tmp_file as bin_file:
+                async with self.retrieve_stream(folder, file, user, pwd, progress=progress) as chunks:
+                    async for chunk in chunks:
+                        await asyncio.to_thread(bin_file.write, chunk)
+            os.replace(tmp_file.name, local_file)
+        except:
+            os.unlink(tmp_file.name)
+            raise
+
+
+def main():
+    """Sample usage of the Async_VOSpace_Handler class"""
+    pass
+
+
+if __name__ == '__main__':
+    main()
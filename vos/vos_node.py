@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""VOSpace_Node type from package vos
+
+This module provides the parsing of the VOSpace node documents, as
+returned by the ``nodes`` endpoint of the VOSpace service for a container
+(folder), to get the list of its children with their type, size and
+modification date.
+
+Usage:
+    Parse the document returned for a container::
+
+        for node in parse_container(data):
+            print(node.name, node.type, node.length, node.date)
+
+"""
+
+VERSION = '0.1.3'
+
+__author__ = "jcgonzalez"
+__version__ = VERSION
+__email__ = "jcgonzalez@sciops.esa.int"
+__status__ = "Prototype" # Prototype | Development | Production
+
+
+from collections import namedtuple
+from datetime import datetime, timezone
+from xml.etree.ElementTree import XMLPullParser
+
+import re
+
+
+VOSpace_Node = namedtuple('VOSpace_Node', ['name', 'path', 'type', 'length', 'date'])
+VOSpace_Node.__doc__ = """Child node of a VOSpace container: name, path (user/folder/name),
+type ('DataNode', 'ContainerNode', 'LinkNode'...), size in bytes and last
+modification date (as Unix time), or None if not known."""
+
+Length_Property = 'ivo://ivoa.net/vospace/core#length'
+Date_Property = 'ivo://ivoa.net/vospace/core#date'
+
+
+def node_time(date):
+    """Converts a VOSpace (ISO 8601) date to Unix time, or None if it cannot
+    be parsed.  Dates without time zone are taken as UTC."""
+    if not date:
+        return None
+    date = re.sub(r'([+-]\d\d)(\d\d)$', r'\1:\2', date.strip().replace('Z', '+00:00'))
+    try:
+        value = datetime.fromisoformat(date)
+    except ValueError:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def node_path(uri):
+    """Returns the path of the node (user/folder/name) from its URI, e.g.
+    vos://esavo!vospace/user/folder/name."""
+    return re.sub(r'^vos://[^/]*/', '', uri).strip('/')
+
+
+def parse_container(data):
+    """Extracts the list of children (VOSpace_Node) of a container node
+    document (str or bytes).  Elements are matched by local name, whatever
+    their namespace."""
+    if isinstance(data, str):
+        data = data.encode("UTF-8")
+    parser = XMLPullParser(events=('start', 'end'))
+    parser.feed(data)
+    parser.close()
+
+    nodes = []
+    depth = 0
+    child = None
+    for event, elem in parser.read_events():
+        name = elem.tag.rpartition('}')[2]
+        if name != 'node':
+            if event == 'end' and name == 'property' and child is not None:
+                uri = elem.get('uri')
+                if uri == Length_Property:
+                    child['length'] = int((elem.text or '0').strip())
+                elif uri == Date_Property:
+                    child['date'] = node_time(elem.text)
+            continue
+        if event == 'start':
+            depth += 1
+            if depth == 2:
+                node_type = None
+                for attr, value in elem.attrib.items():
+                    if attr.rpartition('}')[2] == 'type':
+                        node_type = value.rpartition(':')[2]
+                path = node_path(elem.get('uri', ''))
+                child = dict(name=path.rpartition('/')[2], path=path, type=node_type,
+                             length=None, date=None)
+        else:
+            if depth == 2 and child is not None:
+                nodes.append(VOSpace_Node(**child))
+                child = None
+            depth -= 1
+    return nodes